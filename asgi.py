@@ -0,0 +1,248 @@
+"""ASGI entry point (SERVER_MODE=asgi): uvicorn asgi:application
+
+The chat stream and thumbnail routes are served natively on the event loop,
+so a slow Anthropic response or Crucible call holds a coroutine instead of a
+thread; they make the same login and project membership checks as the Flask
+routes. Every other route runs the Flask app, on up to ASGI_THREADS threads
+at a time. Needs uvicorn and asgiref (the `asgi` extra, installed in the
+Docker image).
+"""
+import asyncio
+import io
+import json
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+import flask
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from crucible_graph_explore_flask_app import app, auth, async_anthropic_client, chat_events, sse_event, \
+    is_user_in_project, get_project, thumbnail_url, CHAT_SSE_HEADERS, THUMBNAIL_MAX_AGE
+
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", 64))
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi running each request on its own thread, at most `threads` at a time
+
+    asgiref runs the WSGI app on one shared thread by default, which would
+    serialize every Flask request; a ThreadSensitiveContext per request gives
+    each its own thread instead.
+    """
+
+    def __init__(self, wsgi_application, threads=ASGI_THREADS):
+        super().__init__(wsgi_application)
+        self.threads = threads
+        self._slots = None
+
+    async def __call__(self, scope, receive, send):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.threads)
+        async with self._slots, ThreadSensitiveContext():
+            await super().__call__(scope, receive, send)
+
+
+flask_app = ThreadPoolWsgiToAsgi(app)
+
+
+# ── native routes ─────────────────────────────────────────────────────────────
+
+async def chat(scope, receive, send, project_id):
+    denied, cookies = await _check_access(scope, project_id)
+    if denied:
+        return await _send_flask_response(send, denied)
+    body = await _read_body(receive)
+    try:
+        history = json.loads(body or b'{}').get('history', [])
+    except ValueError:
+        return await _send_json(send, 400, {'error': 'invalid JSON'})
+    pc = await asyncio.to_thread(get_project, project_id)
+
+    headers = dict(CHAT_SSE_HEADERS, **{'Content-Type': 'text/event-stream'})
+    await _start(send, 200, headers, cookies)
+
+    async def stream():
+        async for event in chat_events(project_id, pc, history, _anthropic_client()):
+            await send({'type': 'http.response.body', 'body': sse_event(event).encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    # stop the chat loop (and its Anthropic/Crucible calls) when the browser goes away
+    streaming = asyncio.ensure_future(stream())
+    watching = asyncio.ensure_future(_wait_for_disconnect(receive))
+    await asyncio.wait([streaming, watching], return_when=asyncio.FIRST_COMPLETED)
+    for task in (streaming, watching):
+        task.cancel()
+
+
+async def thumbnail(scope, receive, send, project_id, dsid):
+    n = _query(scope).get('n', ['0'])[0] or '0'
+    if not n.isdigit():
+        return await _send_json(send, 400, {'error': 'n must be a non-negative integer'})
+    denied, cookies = await _check_access(scope, project_id)
+    if denied:
+        return await _send_flask_response(send, denied)
+    n = int(n)
+    thumbs = await asyncio.wrap_future(app.thumbnails.submit(dsid))
+    # decoding and hashing the image would block the loop
+    image = await asyncio.to_thread(app.thumbnails.image, dsid, n) if thumbs else None
+    if image is None:
+        return await _send_json(send, 404, {'error': 'no thumbnail'})
+    data, mimetype, etag = image
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': f'private, max-age={THUMBNAIL_MAX_AGE}'}
+    if f'"{etag}"' in _header(scope, b'if-none-match'):
+        await _start(send, 304, headers, cookies)
+        return await send({'type': 'http.response.body', 'body': b''})
+    headers['Content-Type'] = mimetype
+    await _start(send, 200, headers, cookies)
+    await send({'type': 'http.response.body', 'body': data})
+
+
+async def thumbnails(scope, receive, send, project_id):
+    denied, cookies = await _check_access(scope, project_id)
+    if denied:
+        return await _send_flask_response(send, denied)
+    ids = [dsid for dsid in _query(scope).get('ids', [''])[0].split(',') if dsid][:200]
+    ids = list(dict.fromkeys(ids))
+    found = await asyncio.gather(*(asyncio.wrap_future(app.thumbnails.submit(dsid)) for dsid in ids))
+    await _send_json(send, 200, {dsid: thumbnail_url(project_id, dsid) if thumbs else None
+                                 for dsid, thumbs in zip(ids, found)}, cookies)
+
+
+ROUTES = [
+    ('POST', re.compile(r'^/(?P<project_id>[^/]+)/api/chat$'), chat),
+    ('GET', re.compile(r'^/(?P<project_id>[^/]+)/thumb/(?P<dsid>[^/]+)\.png$'), thumbnail),
+    ('GET', re.compile(r'^/(?P<project_id>[^/]+)/api/thumbnails$'), thumbnails),
+]
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] == 'http':
+        for method, pattern, handler in ROUTES:
+            match = pattern.match(scope['path'])
+            if match and scope['method'] == method:
+                return await handler(scope, receive, send, **match.groupdict())
+    await flask_app(scope, receive, send)
+
+
+# ── helpers ───────────────────────────────────────────────────────────────────
+
+_anthropic_clients = {}
+
+def _anthropic_client():
+    # Anthropic's async HTTP client is bound to the loop it is first used on
+    loop = asyncio.get_running_loop()
+    if loop not in _anthropic_clients:
+        _anthropic_clients[loop] = async_anthropic_client()
+    return _anthropic_clients[loop]
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi'))
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def _environ(scope):
+    # WSGI environ of an http scope, without its body (as WsgiToAsgi builds it for the Flask routes)
+    root_path = scope.get('root_path', '')
+    path = scope['path'][len(root_path):] if scope['path'].startswith(root_path) else scope['path']
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('',))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name in ('content-type', 'content-length'):
+            key = name.upper().replace('-', '_')
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _flask_access(scope, project_id):
+    # the checks of the Flask routes (@auth.oidc_auth('orcid'), then is_user_in_project) in a
+    # request context for scope; returns the finished Flask response, and whether access is allowed
+    with app.request_context(_environ(scope)):
+        response = auth.oidc_auth('orcid')(lambda: None)()
+        allowed = response is None and is_user_in_project(project_id)
+        if response is None:
+            response = flask.Response(status=200 if allowed else 403)
+        # saves the session, which the auth check may have changed (login state, refreshed tokens)
+        return app.process_response(response), allowed
+
+
+async def _check_access(scope, project_id):
+    """(None, Set-Cookie headers to send) if the user may access the project, else (Flask response to send, [])"""
+    response, allowed = await asyncio.to_thread(_flask_access, scope, project_id)
+    if allowed:
+        return None, response.headers.getlist('Set-Cookie')
+    return response, []
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _start(send, status, headers, cookies=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()]
+                + [(b'set-cookie', cookie.encode('latin-1')) for cookie in cookies]})
+
+
+async def _send_json(send, status, obj, cookies=()):
+    body = json.dumps(obj).encode()
+    await _start(send, status, {'Content-Type': 'application/json', 'Content-Length': len(body)}, cookies)
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_flask_response(send, response):
+    # e.g. the redirect to the ORCID login, or a 403
+    body = response.get_data()
+    await send({'type': 'http.response.start', 'status': response.status_code,
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response.headers.items()]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _query(scope):
+    return parse_qs(scope.get('query_string', b'').decode('latin-1'))
+
+
+def _header(scope, name):
+    return ','.join(v.decode('latin-1') for k, v in scope['headers'] if k == name)
+
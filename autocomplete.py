@@ -0,0 +1,100 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+# queries up to this long are looked up directly in the n-gram postings
+MAX_GRAM = 3
+
+# result ranks, best first
+EXACT, PREFIX, SUBSTRING = 0, 1, 2
+
+
+def _grams(text):
+    return {text[i:i + n] for n in range(1, MAX_GRAM + 1) for i in range(len(text) - n + 1)}
+
+
+class AutocompleteIndex:
+    """Name/id lookup for autocomplete, built once per project snapshot.
+
+    Entries are kept sorted by lowercased name (ties by id), so a position
+    in that order is also the sort key of a result. Prefix queries are
+    binary searches over the sorted names and ids; substring queries
+    walk the 1- to 3-gram posting list of the query (its rarest trigram
+    for longer queries, verifying each candidate). Results rank exact matches first,
+    then prefix matches, then other substring matches.
+    """
+
+    def __init__(self, entries):
+        """entries: iterable of (unique_id, name)"""
+        items = sorted(((name or '').lower(), str(uid).lower(), uid, name) for uid, name in entries)
+        self.names = [item[0] for item in items]
+        self.ids = [item[1] for item in items]
+        self.entries = [(item[2], item[3]) for item in items]
+        self.id_order = sorted(range(len(items)), key=self.ids.__getitem__)
+        self.sorted_ids = [self.ids[pos] for pos in self.id_order]
+        postings = {}
+        for pos, (name, uid) in enumerate(zip(self.names, self.ids)):
+            for gram in _grams(name) | _grams(uid):
+                postings.setdefault(gram, []).append(pos)
+        self.postings = {gram: array('I', positions) for gram, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, query, limit=20, cursor=None):
+        """([(unique_id, name), ...], next_cursor) for up to limit matches after cursor
+
+        next_cursor is None when there are no more matches.
+        """
+        q = (query or '').lower()
+        after = _parse_cursor(cursor)
+        found = []
+        for rank, pos in self._ranked(q):
+            if after is not None and (rank, pos) <= after:
+                continue
+            if len(found) == limit:
+                last_rank, last_pos = found[-1]
+                return [self.entries[p] for _, p in found], f"{last_rank}.{last_pos}"
+            found.append((rank, pos))
+        return [self.entries[p] for _, p in found], None
+
+    def _ranked(self, q):
+        # (rank, position) of every match, in result order
+        if not q:
+            for pos in range(len(self.entries)):
+                yield SUBSTRING, pos
+            return
+        exact = sorted(set(self._range(self.names, q, q)) | set(self._id_range(q, q)))
+        prefix = sorted(set(self._range(self.names, q, q + '\uffff')) |
+                        set(self._id_range(q, q + '\uffff')))
+        seen = set(prefix)
+        exact_set = set(exact)
+        for pos in exact:
+            yield EXACT, pos
+        for pos in prefix:
+            if pos not in exact_set:
+                yield PREFIX, pos
+        for pos in self._substring_candidates(q):
+            if pos not in seen and (len(q) <= MAX_GRAM or q in self.names[pos] or q in self.ids[pos]):
+                yield SUBSTRING, pos
+
+    @staticmethod
+    def _range(keys, low, high):
+        return range(bisect_left(keys, low), bisect_right(keys, high))
+
+    def _id_range(self, low, high):
+        return [self.id_order[i] for i in self._range(self.sorted_ids, low, high)]
+
+    def _substring_candidates(self, q):
+        if len(q) <= MAX_GRAM:
+            return self.postings.get(q, ())
+        # the rarest trigram's postings (already in result order) hold every match;
+        # candidates are verified lazily, so a page stops scanning once it is full
+        return min((self.postings.get(q[i:i + MAX_GRAM], ()) for i in range(len(q) - MAX_GRAM + 1)), key=len)
+
+
+def _parse_cursor(cursor):
+    try:
+        rank, pos = cursor.split('.')
+        return int(rank), int(pos)
+    except (AttributeError, ValueError):
+        return None
@@ -0,0 +1,222 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import closing
+
+# purge expired entries of the SQLite backend every this many writes
+_PURGE_EVERY = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL,
+                                    stored_at REAL NOT NULL, expires_at REAL)
+"""
+
+
+class CacheBackend:
+    """Key -> bytes store shared by the workers (and possibly instances) of the app.
+
+    Subclasses implement _get, _set, _delete and _delete_prefix; values are
+    zlib compressed here, so they are cheap to ship to a remote store.
+    `shared` tells whether entries outlive the process. This base class
+    stores nothing (CACHE_BACKEND=none).
+    """
+
+    name = 'none'
+    shared = False
+
+    def __init__(self):
+        self._counts_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def get(self, key):
+        """Bytes stored under key, or None (also when the backend fails)"""
+        try:
+            data = self._get(key)
+            value = zlib.decompress(data) if data is not None else None
+        except Exception as err:
+            print(f"{self.name} cache: failed to read {key}: {err}")
+            self._count('errors')
+            return None
+        self._count('hits' if value is not None else 'misses')
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store bytes under key, for ttl seconds if given; failures are only logged"""
+        try:
+            self._set(key, zlib.compress(value, 1), ttl)
+        except Exception as err:
+            print(f"{self.name} cache: failed to write {key}: {err}")
+            self._count('errors')
+            return
+        self._count('writes')
+
+    def get_json(self, key):
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key, obj, ttl=None):
+        self.set(key, json.dumps(obj, separators=(',', ':'), default=str).encode('utf-8'), ttl)
+
+    def delete(self, key):
+        try:
+            self._delete(key)
+        except Exception as err:
+            print(f"{self.name} cache: failed to delete {key}: {err}")
+
+    def delete_prefix(self, prefix):
+        """Drop every key starting with prefix"""
+        try:
+            self._delete_prefix(prefix)
+        except Exception as err:
+            print(f"{self.name} cache: failed to delete {prefix}*: {err}")
+
+    def stats(self):
+        return dict(backend=self.name, shared=self.shared, hits=self.hits, misses=self.misses,
+                    writes=self.writes, errors=self.errors)
+
+    def _count(self, counter):
+        with self._counts_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _get(self, key):
+        return None
+
+    def _set(self, key, value, ttl):
+        pass
+
+    def _delete(self, key):
+        pass
+
+    def _delete_prefix(self, prefix):
+        pass
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Entries in one SQLite file (WAL mode), shared by all worker processes on the host.
+
+    Each thread (of each process) opens its own connection; writers wait up
+    to `timeout` seconds for each other. Expired entries are skipped on read
+    and purged every few hundred writes.
+    """
+
+    name = 'sqlite'
+    shared = True
+
+    def __init__(self, path='cache/shared-cache.sqlite', timeout=10):
+        super().__init__()
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes_since_purge = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def _conn(self):
+        # connections are per thread and never reused across a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _get(self, key):
+        row = self._conn().execute("SELECT value FROM entries WHERE key = ? AND "
+                                   "(expires_at IS NULL OR expires_at > ?)", (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key, value, ttl):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO entries (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                     (key, value, now, now + ttl if ttl else None))
+        self._writes_since_purge += 1
+        if self._writes_since_purge >= _PURGE_EVERY:
+            self._writes_since_purge = 0
+            conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    def _delete(self, key):
+        self._conn().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _delete_prefix(self, prefix):
+        self._conn().execute("DELETE FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def stats(self):
+        stats = super().stats()
+        try:
+            entries, size = self._conn().execute("SELECT count(*), coalesce(sum(length(value)), 0) "
+                                                 "FROM entries").fetchone()
+            stats.update(path=self.path, entries=entries, bytes=size)
+        except sqlite3.Error as err:
+            print(f"sqlite cache: failed to read stats: {err}")
+        return stats
+
+
+class RedisCacheBackend(CacheBackend):
+    """Entries in a Redis-compatible server (Redis, Valkey, Memorystore), shared by all instances.
+
+    Needs the redis package unless a client is passed; any object with
+    redis-py's get/set/delete/scan_iter methods works as a local stand-in
+    (e.g. fakeredis.FakeRedis()). Keys are namespaced with `prefix`.
+    """
+
+    name = 'redis'
+    shared = True
+
+    def __init__(self, url='redis://localhost:6379/0', client=None, prefix='crucible-explorer:', timeout=5):
+        super().__init__()
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.client = client
+        self.url = url
+        self.prefix = prefix
+
+    def _get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def _set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def _delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def _delete_prefix(self, prefix):
+        keys = list(self.client.scan_iter(match=_redis_escape(self.prefix + prefix) + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def _redis_escape(pattern):
+    for special in '\\*?[]':
+        pattern = pattern.replace(special, '\\' + special)
+    return pattern
+
+
+def cache_backend_from_env():
+    """Backend selected by CACHE_BACKEND (sqlite, redis or none)"""
+    kind = os.getenv("CACHE_BACKEND", "sqlite").lower()
+    if kind == 'redis':
+        url = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+        try:
+            return RedisCacheBackend(url, prefix=os.getenv("CACHE_PREFIX", "crucible-explorer:"))
+        except ImportError:
+            print("CACHE_BACKEND=redis needs the redis package (the redis extra), using the local sqlite cache instead")
+            kind = 'sqlite'
+    if kind == 'sqlite':
+        return SQLiteCacheBackend(os.getenv("CACHE_PATH", "cache/shared-cache.sqlite"))
+    if kind != 'none':
+        print(f"unknown CACHE_BACKEND {kind!r}, caching in process only")
+    return CacheBackend()
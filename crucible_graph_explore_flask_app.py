@@ -1,21 +1,22 @@
 import os
 import re
+import asyncio
 import json
 import tempfile
+import threading
+import time
+from urllib.parse import urlencode
 from concurrent.futures import ThreadPoolExecutor
 import anthropic
-import networkx as nx
 import flask
-import pandas
 import markdown
-import requests
 from flask import Flask, render_template, jsonify, abort, redirect, request, Response, stream_with_context
 from flask_qrcode import QRcode
 from flask_vite import Vite
 from flask_pyoidc.user_session import UserSession
 from flask_pyoidc import OIDCAuthentication
 from flask_pyoidc.provider_configuration import ProviderConfiguration, ClientMetadata
-from pycrucible import CrucibleClient
+from transport import HttpTransport, pooled_crucible_client
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -23,18 +24,25 @@ app = Flask(__name__, template_folder="flask_templates")
 QRcode(app)
 vite = Vite(app)
 
-# import project_views.proj10k_perovskite_views
+# project specific tabular views are declared in project_views (see the "project views" routes)
 
-# app.register_blueprint(project_views.proj10k_perovskite_views.proj_views, 
-#                       url_prefix='/10k-views')
-
-app.project_cache = {}
-app.project_sample_graphs = {}
 
 crucible_api_key = os.getenv("CRUCIBLE_API_KEY")
-app.crucible_client = CrucibleClient(
+# one pooled keep-alive transport (with retries) for Crucible API calls and file downloads
+_crucible_timeout = float(os.getenv("CRUCIBLE_TIMEOUT", 30))
+_crucible_connect_timeout = float(os.getenv("CRUCIBLE_CONNECT_TIMEOUT", 5))
+app.transport = HttpTransport(
+    pool_size=int(os.getenv("CRUCIBLE_POOL_SIZE", 32)),
+    retries=int(os.getenv("CRUCIBLE_RETRIES", 3)),
+    backoff=float(os.getenv("CRUCIBLE_RETRY_BACKOFF", 0.5)),
+    timeout=(_crucible_connect_timeout, _crucible_timeout),
+    # whole-project listings and the sample graph can take much longer than single records
+    timeouts=[(r'/sample_graph$|/(samples|datasets)/?$',
+               (_crucible_connect_timeout, float(os.getenv("CRUCIBLE_LIST_TIMEOUT", 120))))])
+app.crucible_client = pooled_crucible_client(
     api_url="https://crucible.lbl.gov/api/v1",
-    api_key=crucible_api_key # v3
+    api_key=crucible_api_key, # v3
+    transport=app.transport
 )
 
 _anthropic_kwargs = {}
@@ -44,7 +52,13 @@ if os.getenv("ANTHROPIC_AUTH_TOKEN"):
     _anthropic_kwargs["auth_token"] = os.getenv("ANTHROPIC_AUTH_TOKEN")
 else:
     _anthropic_kwargs["api_key"] = os.getenv("ANTHROPIC_API_KEY", "not-required")
-app.anthropic_client = anthropic.Anthropic(**_anthropic_kwargs)
+
+def async_anthropic_client():
+    """New Anthropic client for use on one event loop"""
+    return anthropic.AsyncAnthropic(**_anthropic_kwargs)
+
+# used on the chat event loop (see iter_chat_events); ASGI mode has its own
+app.anthropic_client = async_anthropic_client()
 
 #flask-pyoidc config
 app.config.update(
@@ -59,37 +73,162 @@ auth = OIDCAuthentication({PROVIDER_NAME: PROVIDER_CONFIG}, app)
 
 
 from crucible_project_graph import \
-     generate_project_cache
+     generate_project_cache, sync_project_cache, clear_project_cache, project_snapshot_store, \
+     project_search_index
     #load_project_cache, \
 #, cache_filename, cache_sample_graph_filename,\
 #    generate_sample_graph, load_project_sample_graph,\
 #    generate_project_sample_graph
-
-def get_project(project_id,  include_metadata=False):
-    return generate_project_cache(project_id, app.crucible_client,include_metadata=include_metadata, save=False)
-    if project_id in app.project_cache:
-        return app.project_cache[project_id]
+from project_cache import SnapshotCache, estimate_snapshot_size
+from single_flight import SingleFlight
+from cache_backend import cache_backend_from_env
+from snapshot_store import ProjectSnapshotStore
+from lineage_index import ProjectLineageIndex, graph_version
+from lineage_view import compact_lineage, group_siblings
+from thumbnails import ThumbnailService
+from autocomplete import AutocompleteIndex
+from metadata_store import MetadataStore
+from fetch_plan import FetchPlan
+from tool_results import rank_matches, page_results, fit_json
+from project_tables import ProjectTables, dataframe_bytes
+from project_views import ViewStore, get_view, views_for
+
+# warm state shared by the workers (sqlite, one host) or by all instances (redis), see cache_backend.py
+app.cache_backend = cache_backend_from_env()
+# seconds entries are kept in the shared cache once written
+SHARED_CACHE_TTL = float(os.getenv("CACHE_ENTRY_TTL", 7 * 86400))
+PROJECT_CACHE_TTL = float(os.getenv("PROJECT_CACHE_TTL", 300))
+# memoized ancestor/descendant sets kept per sample graph before they are dropped
+LINEAGE_MEMO_MAX_BYTES = int(float(os.getenv("LINEAGE_MEMO_MAX_MB", 16)) * 1024 * 1024)
+
+def _project_key(key):
+    project_id, include_metadata = key
+    return f"project:{project_id}:{'meta' if include_metadata else 'nometa'}"
+
+def _synced_at(pc):
+    return (pc.get('sync') or {}).get('synced_at') or pc.get('saved_at', 0)
+
+def _shared_project(key):
+    """Project snapshot another worker or instance put in the shared cache, or None"""
+    data = app.cache_backend.get(_project_key(key))
+    if data is None:
+        return None
+    try:
+        return ProjectSnapshotStore.loads(data)
+    except Exception as err:
+        print(f"failed to read shared project snapshot {key}: {err}")
+        return None
+
+def _load_project(key):
+    project_id, include_metadata = key
+    previous = app.project_cache.peek(key, allow_stale=True)
+    # another worker may have refreshed the snapshot already; if not, sync from the newest copy
+    shared = _shared_project(key)
+    if shared is not None and (previous is None or _synced_at(shared) > _synced_at(previous)):
+        if time.time() - _synced_at(shared) < PROJECT_CACHE_TTL:
+            return shared
+        previous = shared
+    # the shared cache replaces the per-project snapshot files unless CACHE_BACKEND=none
+    save = not app.cache_backend.shared
+    # refresh an existing snapshot incrementally; full rebuilds only via /update-cache
+    if previous is not None and 'sync' in previous:
+        pc = sync_project_cache(previous, app.crucible_client, include_metadata=include_metadata, save=save)
+    else:
+        pc = generate_project_cache(project_id, app.crucible_client, include_metadata=include_metadata, save=save)
+    if app.cache_backend.shared:
+        app.cache_backend.set(_project_key(key), ProjectSnapshotStore.dumps(pc), ttl=SHARED_CACHE_TTL)
+    return pc
+
+def _warm_project(key):
+    """Start from the shared or on-disk snapshot if there is one (refreshed in background when stale)"""
+    shared = _shared_project(key)
+    if shared is not None:
+        return shared, _synced_at(shared)
+    project_id, include_metadata = key
+    store = project_snapshot_store(project_id, include_metadata)
+    if not store.exists():
+        return None
     try:
-        return load_project_cache(project_id)
+        pc = store.load()
+        return pc, pc.get('saved_at', 0)
     except Exception as err:
-        print(f"failed to load project cache for {project_id}, regenerating...")
-        generate_project_cache(project_id, app.crucible_client)
-        return load_project_cache(project_id)
+        print(f"failed to read project snapshot {store.path}: {err}")
+        return None
+
+# concurrent cold loads of the same (cache, key), e.g. a project snapshot or sample graph, share one fetch
+app.single_flight = SingleFlight()
+
+# in-memory project snapshots keyed by (project_id, include_metadata)
+app.project_cache = SnapshotCache(
+    _load_project,
+    ttl=PROJECT_CACHE_TTL,
+    max_bytes=int(float(os.getenv("PROJECT_CACHE_MAX_MB", 512)) * 1024 * 1024),
+    sizeof=estimate_snapshot_size,
+    name='project_cache',
+    warm=_warm_project,
+    single_flight=app.single_flight)
+
+def get_project(project_id,  include_metadata=False):
+    if not include_metadata:
+        # a fresh snapshot with metadata is a superset of one without
+        pc = app.project_cache.peek((project_id, True))
+        if pc is not None:
+            return pc
+    return app.project_cache.get((project_id, include_metadata))
     
-def get_project_sample_graph(project_id):
-    node_link_data = app.crucible_client._request("GET",f"/projects/{project_id}/sample_graph")
-    G = nx.node_link_graph(node_link_data)
-    return G
-    # if project_id in app.project_cache:
-    #     return app.project_sample_graphs[project_id]
-    # try:
-    #     return load_project_sample_graph(project_id)
-    # except Exception as err:
-    #     print(f"failed to load project cache for {project_id}, regenerating...")
-    #     G = generate_project_sample_graph(project_id,app.crucible_client)
-    #     app.project_sample_graphs[project_id] = G
-    #     return G
+def _load_project_lineage(project_id):
+    # node-link data fetched by another worker within the TTL is reused as is
+    shared = app.cache_backend.get_json(f"sample_graph:{project_id}")
+    if shared is not None and time.time() - shared['fetched_at'] < PROJECT_CACHE_TTL:
+        node_link_data, version = shared['node_link'], shared['version']
+    else:
+        node_link_data = app.crucible_client._request("GET",f"/projects/{project_id}/sample_graph")
+        version = graph_version(node_link_data)
+        app.cache_backend.set_json(f"sample_graph:{project_id}",
+                                   dict(node_link=node_link_data, version=version, fetched_at=time.time()),
+                                   ttl=SHARED_CACHE_TTL)
+    # keep the previous index (and its memoized closures) if the graph is unchanged
+    previous = app.project_sample_graphs.peek(project_id, allow_stale=True)
+    if previous is not None and previous.version == version:
+        return previous
+    return ProjectLineageIndex.from_node_link(node_link_data, version=version,
+                                              max_memo_bytes=LINEAGE_MEMO_MAX_BYTES)
+
+def _warm_project_lineage(project_id):
+    """Start from the sample graph in the shared cache (refreshed in background when stale)"""
+    shared = app.cache_backend.get_json(f"sample_graph:{project_id}")
+    if shared is None:
+        return None
+    index = ProjectLineageIndex.from_node_link(shared['node_link'], version=shared['version'],
+                                               max_memo_bytes=LINEAGE_MEMO_MAX_BYTES)
+    return index, shared['fetched_at']
+
+# lineage indexes of project sample graphs keyed by project_id, budgeted apart from the snapshots;
+# each index is counted with its memoized closures at their limit
+app.project_sample_graphs = SnapshotCache(
+    _load_project_lineage,
+    ttl=PROJECT_CACHE_TTL,
+    max_bytes=int(float(os.getenv("SAMPLE_GRAPH_CACHE_MAX_MB", 128)) * 1024 * 1024),
+    sizeof=lambda lineage: lineage.estimated_bytes(),
+    name='project_sample_graphs',
+    warm=_warm_project_lineage,
+    single_flight=app.single_flight)
+
+def get_project_lineage(project_id):
+    """Returns the cached ProjectLineageIndex for the project sample graph"""
+    return app.project_sample_graphs.get(project_id)
 
+def get_project_sample_graph(project_id):
+    return get_project_lineage(project_id).graph
+
+# dataset thumbnails: in-process LRU + shared cache (cache/thumbnails files without one), fetched on one bounded pool
+app.thumbnails = ThumbnailService(
+    lambda dsid: app.crucible_client.get_thumbnails(dsid),
+    app.cache_backend,
+    shared_ttl=SHARED_CACHE_TTL,
+    max_entries=int(os.getenv("THUMBNAIL_CACHE_ENTRIES", 2000)),
+    max_workers=int(os.getenv("THUMBNAIL_WORKERS", 10)))
+THUMBNAIL_MAX_AGE = int(os.getenv("THUMBNAIL_MAX_AGE", 86400))
     
 # def clear_project_cache(project_id):
 #     fname = cache_filename(project_id)
@@ -104,13 +243,32 @@ def get_project_sample_graph(project_id):
 #     if project_id in app.project_sample_graphs:
 #         del app.project_sample_graphs[project_id]
 
+# projects each user (by ORCID) belongs to; short TTL, refreshed in the background
+app.user_projects = SnapshotCache(
+    lambda orcid: app.crucible_client.list_projects(orcid=orcid),
+    ttl=float(os.getenv("MEMBERSHIP_CACHE_TTL", 60)),
+    max_bytes=16 * 1024 * 1024,
+    name='user_projects',
+    single_flight=app.single_flight)
+
+def get_user_projects(orcid=None):
+    """Projects of the session user (or orcid), cached"""
+    if not orcid:
+        user_session = UserSession(flask.session)
+        orcid=user_session.userinfo['sub']
+    return app.user_projects.get(orcid)
+
 def is_user_in_project(project_id, orcid=None):
     """Look up user from session unless orcid is defined"""
     if not orcid:
         user_session = UserSession(flask.session)
         orcid=user_session.userinfo['sub']
-    projects=app.crucible_client.list_projects(orcid=orcid)
-    project_names = [p['project_id'] for p in projects]
+    project_names = [p['project_id'] for p in get_user_projects(orcid)]
+    if project_id in project_names:
+        return True
+    # about to 403: recheck against Crucible in case the user was just added
+    app.user_projects.invalidate(orcid)
+    project_names = [p['project_id'] for p in get_user_projects(orcid)]
     return project_id in project_names
 
 
@@ -120,17 +278,13 @@ def is_user_in_project(project_id, orcid=None):
 @auth.oidc_auth('orcid')
 def list_projects():
     #return render_template('project_list.html', projects=app.crucible_client.list_projects())
-    user_session = UserSession(flask.session)
-    orcid=user_session.userinfo['sub']
-    user_projects = app.crucible_client.list_projects(orcid=orcid)
+    user_projects = get_user_projects()
     return render_template('project_list.html', projects=user_projects)
 
 @app.route("/users")
 @auth.oidc_auth('orcid')
 def users_overview():
-    user_session = UserSession(flask.session)
-    orcid = user_session.userinfo['sub']
-    user_projects = app.crucible_client.list_projects(orcid=orcid)
+    user_projects = get_user_projects()
 
     projects_with_users = []
     for p in user_projects:
@@ -144,6 +298,27 @@ def users_overview():
     return render_template('users.html', projects_with_users=projects_with_users)
 
 
+@app.route("/api/cache-stats")
+@auth.oidc_auth('orcid')
+def cache_stats():
+    """Hit/miss counters of the in-process and shared caches and chat prompt-cache token usage, for tuning"""
+    usage = dict(app.chat_usage)
+    prompt_tokens = usage['input_tokens'] + usage['cache_read_input_tokens'] + usage['cache_creation_input_tokens']
+    usage['cache_read_ratio'] = usage['cache_read_input_tokens'] / prompt_tokens if prompt_tokens else None
+    tool_cache = app.chat_tool_cache.stats()
+    return jsonify({
+        'projects': app.project_cache.stats(),
+        'sample_graphs': app.project_sample_graphs.stats(),
+        'user_projects': app.user_projects.stats(),
+        'thumbnails': app.thumbnails.stats(),
+        'shared': app.cache_backend.stats(),
+        'single_flight': app.single_flight.stats(),
+        'chat_tools': dict(entries=tool_cache['entries'], bytes=tool_cache['bytes'],
+                           by_tool=app.chat_tool_cache_counts),
+        'chat_usage': usage,
+    })
+
+
 @app.route("/<project_id>/")
 @auth.oidc_auth('orcid')
 def project_overview(project_id):
@@ -177,18 +352,27 @@ def project_overview(project_id):
                         sample_info=sorted(pc['samples_by_name'].values(), key=lambda x:x['sample_name']),
                         samples_by_type=samples_by_type,
                         datasets_by_type=datasets_by_type,
+                        views=views_for(project_id),
                         )
 
-# @app.route("/<project_id>/update-cache")
-# @auth.oidc_auth('orcid')
-# def regen_project_cache(project_id):
-#     if not is_user_in_project(project_id):
-#         abort(403)
-#     clear_project_cache(project_id)
-#     generate_project_cache(project_id, app.crucible_client)
-#     pc = get_project(project_id)
-#     #return (f"Regenerated Cache for {project_id}. {len(pc['samples'])} Samples and {len(pc['datasets'])} Datasets")
-#     return redirect(f"/{project_id}/")
+@app.route("/<project_id>/update-cache")
+@auth.oidc_auth('orcid')
+def regen_project_cache(project_id):
+    """Full rebuild of the project snapshot (normal refreshes are incremental)"""
+    if not is_user_in_project(project_id):
+        abort(403)
+    clear_project_cache(project_id)
+    app.cache_backend.delete_prefix(f"project:{project_id}:")
+    app.cache_backend.delete(f"sample_graph:{project_id}")
+    app.project_cache.invalidate(project_id)
+    app.project_sample_graphs.invalidate(project_id)
+    app.chat_tool_cache.invalidate(project_id)
+    app.project_tables.pop(project_id, None)
+    app.project_views.invalidate(project_id)
+    app.metadata_stores.pop(project_id, None)
+    pc = get_project(project_id)
+    #return (f"Regenerated Cache for {project_id}. {len(pc['samples'])} Samples and {len(pc['datasets'])} Datasets")
+    return redirect(f"/{project_id}/")
 
 @app.route("/<project_id>/sample-graph/<sample_id>")
 @auth.oidc_auth('orcid')
@@ -200,14 +384,14 @@ def sample_graph(project_id, sample_id):
     print(f"sample_graph")
     #G = generate_sample_graph(sample_id, app.crucible_client)
     #Gproject = generate_project_sample_graph(project_id, app.crucible_client)
-    G = get_project_sample_graph(project_id)
+    lineage = get_project_lineage(project_id)
     #G = nx.ego_graph(Gproject,sample_id)
     #print(G)
 
     #sample_name = pc['samples_by_id'][sample_id]['sample_name']
     #print(sample_name)
-    descendants = nx.descendants(G, sample_id)
-    ancestors = nx.ancestors(G, sample_id)
+    descendants = lineage.descendants(sample_id)
+    ancestors = lineage.ancestors(sample_id)
 
     # # find any samples not in cache:
     # for sid in G.nodes:
@@ -216,18 +400,29 @@ def sample_graph(project_id, sample_id):
     #         pc['samples_by_id'][sid] = app.crucible_client.get_sample(sid)
 
 
+    # one shortest path per relative, all from a single BFS in each direction
+    # ?paths=k additionally lists up to k alternative paths per relative
+    n_paths = min(max(request.args.get('paths', 1, type=int), 1), 10)
+
+    def names(path):
+        return [pc['samples_by_id'][x]['sample_name'] for x in path]
+
     # need to translate these to names from ids
     descendants_path = {}
-    for sid in descendants:
-        paths = list(nx.all_simple_paths(G, sample_id, sid))
+    descendants_alt_paths = {}
+    for sid, path in lineage.descendant_paths(sample_id).items():
         name = pc['samples_by_id'][sid]['sample_name']
-        descendants_path[name] = [pc['samples_by_id'][x]['sample_name'] for x in paths[0]]
+        descendants_path[name] = names(path)
+        if n_paths > 1:
+            descendants_alt_paths[name] = [names(p) for p in lineage.alternative_paths(sample_id, sid, n_paths)]
 
     ancestors_path = {}
-    for sid in ancestors:
-        paths = list(nx.all_simple_paths(G, sid, sample_id))
+    ancestors_alt_paths = {}
+    for sid, path in lineage.ancestor_paths(sample_id).items():
         name = pc['samples_by_id'][sid]['sample_name']
-        ancestors_path[name] = [pc['samples_by_id'][x]['sample_name'] for x in paths[0]]
+        ancestors_path[name] = names(path)
+        if n_paths > 1:
+            ancestors_alt_paths[name] = [names(p) for p in lineage.alternative_paths(sid, sample_id, n_paths)]
 
     # time sort ancestors using the unique mfid  as a proxy for time
     ancestors_info = sorted([pc['samples_by_id'][sample_id] for sample_id in ancestors], key=lambda x: x['unique_id'])
@@ -241,149 +436,304 @@ def sample_graph(project_id, sample_id):
                            descendants_info=descendants_info,
                            ancestors_path=ancestors_path,
                            descendants_path = descendants_path,
+                           ancestors_alt_paths=ancestors_alt_paths,
+                           descendants_alt_paths=descendants_alt_paths,
                            client=app.crucible_client,
                            datasets_by_id = pc['datasets_by_id']
                            )
 
+def graph_view_args():
+    """depth_up, depth_down, max_nodes and collapse parameters of the graph data APIs (all optional)"""
+    return dict(depth_up=request.args.get('depth_up', type=int),
+                depth_down=request.args.get('depth_down', type=int),
+                max_nodes=request.args.get('max_nodes', type=int),
+                collapse=request.args.get('collapse', '0') not in ('0', 'false', ''))
+
+def sample_type_key(pc):
+    return lambda sid: pc['samples_by_id'].get(sid, {}).get('sample_type') or ''
+
+def expand_url(project_id, api, sample_id, more, args):
+    """Graph data one generation beyond sample_id, in the directions it has hidden relatives"""
+    params = dict(depth_up=int(bool(more['up'])), depth_down=int(bool(more['down'])),
+                  collapse=int(args['collapse']))
+    if args['max_nodes'] is not None:
+        params['max_nodes'] = args['max_nodes']
+    return f"/{project_id}/api/{api}/{sample_id}?{urlencode(params)}"
+
+def sample_node(project_id, pc, sid, more=None, api=None, args=None):
+    sample = pc['samples_by_id'].get(sid, {})
+    node = {
+        'id': sid,
+        'label': sample.get('sample_name', sid[:13]),
+        'name': sample.get('sample_name', sid[:13]),
+        'type': 'sample',
+        'description': sample.get('description', ''),
+        'url': f'/{project_id}/sample-graph/{sid}'
+    }
+    if more and (more['up'] or more['down']):
+        node['more'] = more
+        node['expand'] = expand_url(project_id, api, sid, more, args)
+    return node
+
+def group_node(project_id, direction, anchor, key, count, datasets=False):
+    """Summary node of a collapsed sibling group; its members are loaded from the expand URL"""
+    label = f"{count} × {key or 'unknown'}"
+    params = dict(key=key, datasets=int(datasets))
+    return {
+        'id': f'group:{direction}:{anchor}:{key}',
+        'label': label,
+        'name': label,
+        'type': 'group',
+        'groupOf': 'dataset' if direction == 'datasets' else 'sample',
+        'count': count,
+        'description': f"{count} {key or 'unknown'} {'datasets' if direction == 'datasets' else 'samples'}",
+        'expand': f'/{project_id}/api/graph-group/{direction}/{anchor}?{urlencode(params)}'
+    }
+
+def group_edge(direction, anchor, node_id):
+    if direction == 'up':
+        return {'source': node_id, 'target': anchor}
+    return {'source': anchor, 'target': node_id}
+
+def lineage_graph_elements(project_id, pc, lineage, view, api, args, datasets=False):
+    """Sample and collapsed group nodes and their edges for a LineageView"""
+    nodes = [sample_node(project_id, pc, sid, view.more.get(sid), api, args) for sid in view.depths]
+    edges = [{'source': source, 'target': target} for source, target in lineage.edges_within(view.depths)]
+    for group in view.groups:
+        node = group_node(project_id, group['direction'], group['anchor'], group['key'],
+                          len(group['members']), datasets)
+        nodes.append(node)
+        edges.append(group_edge(group['direction'], group['anchor'], node['id']))
+    return nodes, edges
+
+def dataset_graph_elements(project_id, pc, sample_ids, collapse=False, seen=()):
+    """Dataset nodes (or, with collapse, per-measurement groups) of the samples and their edges"""
+    nodes = []
+    edges = []
+    dataset_meta = {}  # dsid -> ds dict
+    seen = set(seen)
+    for sid in sample_ids:
+        sample = pc['samples_by_id'].get(sid, {})
+        refs = [pc['datasets_by_id'].get(d['unique_id'], d) for d in sample.get('datasets', [])]
+        if collapse:
+            # datasets already on the graph (e.g. the focal dataset) are never folded away
+            shown = [ds for ds in refs if ds['unique_id'] in seen]
+            refs, groups = group_siblings([ds for ds in refs if ds['unique_id'] not in seen],
+                                          lambda ds: ds.get('measurement') or '')
+            refs += shown
+            for key, members in groups.items():
+                node = group_node(project_id, 'datasets', sid, key, len(members), True)
+                nodes.append(node)
+                edges.append(group_edge('datasets', sid, node['id']))
+        for ds in refs:
+            dsid = ds['unique_id']
+            edges.append({'source': sid, 'target': dsid})
+            if dsid not in seen:
+                seen.add(dsid)
+                dataset_meta[dsid] = ds
+    return nodes, edges, dataset_meta
+
+def dataset_nodes(project_id, dataset_meta):
+    # thumbnails aren't looked up here, so the graph isn't held back by thumbnail fetches;
+    # the browser asks /api/thumbnails for the URLs of all dataset nodes in one request
+    return [{
+        'id': dsid,
+        'label': ds.get('dataset_name', dsid[:13]),
+        'type': 'dataset',
+        'measurement': ds.get('measurement', ''),
+        'url': f'/{project_id}/dataset/{dsid}'
+    } for dsid, ds in dataset_meta.items()]
+
 @app.route("/<project_id>/api/sample-graph-data/<sample_id>")
 @auth.oidc_auth('orcid')
 def sample_graph_data(project_id, sample_id):
-    """API endpoint that returns graph data as JSON for visualization"""
+    """API endpoint that returns graph data as JSON for visualization
+
+    ?depth_up=&depth_down= limit the generations of ancestors/descendants,
+    ?max_nodes= caps the number of nodes (nearest generations are kept) and
+    ?collapse=1 folds large sibling groups of one sample_type into summary
+    nodes. Nodes with hidden relatives or folded members carry an `expand`
+    URL returning the next part of the graph.
+    """
     if not is_user_in_project(project_id):
         abort(403)
 
     pc = get_project(project_id)
-    G = get_project_sample_graph(project_id)
+    lineage = get_project_lineage(project_id)
 
-    # Get the subgraph containing the sample and all its ancestors and descendants
-    descendants = nx.descendants(G, sample_id)
-    ancestors = nx.ancestors(G, sample_id)
-    all_nodes = ancestors | descendants | {sample_id}
-
-    # Create subgraph with only relevant nodes
-    subgraph = G.subgraph(all_nodes)
-
-    # Build nodes list
-    nodes = []
-    for node_id in subgraph.nodes():
-        sample = pc['samples_by_id'].get(node_id, {})
-        nodes.append({
-            'id': node_id,
-            'label': sample.get('sample_name', node_id),
-            'name': sample.get('sample_name', node_id),
-            'description': sample.get('description', '')
-        })
-
-    # Build edges list
-    edges = []
-    for source, target in subgraph.edges():
-        edges.append({
-            'source': source,
-            'target': target
-        })
+    args = graph_view_args()
+    view = compact_lineage(lineage, [sample_id], sample_type_key(pc), **args)
+    nodes, edges = lineage_graph_elements(project_id, pc, lineage, view, 'sample-graph-data', args)
 
     return jsonify({
         'nodes': nodes,
         'edges': edges,
-        'centerNodeId': sample_id
+        'centerNodeId': sample_id,
+        'truncated': view.truncated
     })
 
-@app.route("/<project_id>/dataset/<dsid>")
+@app.route("/<project_id>/api/graph-group/<direction>/<anchor_id>")
 @auth.oidc_auth('orcid')
-def dataset(project_id, dsid):
+def graph_group_data(project_id, direction, anchor_id):
+    """Members of a collapsed group: the parents ('up'), children ('down') or datasets
+    of anchor_id whose sample_type/measurement is ?key=; ?datasets=1 adds the datasets of member samples
+    """
+    if direction not in ('up', 'down', 'datasets'):
+        abort(400)
     if not is_user_in_project(project_id):
         abort(403)
-    #pc = get_project(project_id)
-    ds = app.crucible_client.get_dataset(dsid, include_metadata=True)
-    #ds = pc['datasets_by_id'][dsid] #cache
-    samples = app.crucible_client.list_samples(dataset_id=dsid)
-
-    thumbnails = app.crucible_client.get_thumbnails(dsid)
-
-    associated_files = app.crucible_client.get_associated_files(dsid)
-    print(associated_files)
-
-    download_links = app.crucible_client.get_dataset_download_links(dsid)
-
-    child_datasets = app.crucible_client.list_children_of_dataset(dsid)
-    parent_datasets = app.crucible_client.list_parents_of_dataset(dsid)
-
-    # Handle MDNote measurement type
-    markdown_html = None
-    if ds.get('measurement') == 'MDNote':
-        # Find markdown file in associated files
-        md_file = None
-        for file in associated_files:
-            if file['filename'].endswith('.md'):
-                md_file = file
-                break
 
-        if md_file:
+    pc = get_project(project_id)
+    key = request.args.get('key', '')
+    with_datasets = request.args.get('datasets', '0') == '1'
+
+    if direction == 'datasets':
+        refs = pc['samples_by_id'].get(anchor_id, {}).get('datasets', [])
+        dataset_meta = {}
+        for d in refs:
+            ds = pc['datasets_by_id'].get(d['unique_id'], d)
+            if (ds.get('measurement') or '') == key:
+                dataset_meta[ds['unique_id']] = ds
+        edges = [{'source': anchor_id, 'target': dsid} for dsid in dataset_meta]
+        return jsonify({'nodes': dataset_nodes(project_id, dataset_meta), 'edges': edges})
+
+    lineage = get_project_lineage(project_id)
+    relatives = lineage.parents(anchor_id) if direction == 'up' else lineage.children(anchor_id)
+    is_member = sample_type_key(pc)
+    members = [sid for sid in relatives if is_member(sid) == key]
+
+    # members are a new frontier: each can be expanded one generation further out
+    args = dict(max_nodes=request.args.get('max_nodes', type=int), collapse=True)
+    api = 'entity-graph-data/sample' if with_datasets else 'sample-graph-data'
+    nodes = []
+    for sid in members:
+        outward = lineage.parents(sid) if direction == 'up' else lineage.children(sid)
+        more = {'up': len(outward) if direction == 'up' else 0, 'down': len(outward) if direction == 'down' else 0}
+        nodes.append(sample_node(project_id, pc, sid, more, api, args))
+    edges = [{'source': source, 'target': target}
+             for source, target in lineage.edges_within(set(members) | {anchor_id})]
+    if with_datasets:
+        ds_nodes, ds_edges, dataset_meta = dataset_graph_elements(project_id, pc, members, collapse=True)
+        nodes += ds_nodes + dataset_nodes(project_id, dataset_meta)
+        edges += ds_edges
+    return jsonify({'nodes': nodes, 'edges': edges})
+
+# concurrent Crucible calls behind single pages (see dataset_fetch_plan)
+FETCH_TIMEOUT = float(os.getenv("CRUCIBLE_FETCH_TIMEOUT", 15))
+app.fetch_executor = ThreadPoolExecutor(max_workers=int(os.getenv("CRUCIBLE_FETCH_WORKERS", 16)),
+                                        thread_name_prefix='fetch-plan')
+
+def fetch_mdnote(ds, associated_files, download_links, mdnote_only=True):
+    """Raw markdown of the dataset's .md file ('' if there is none)"""
+    if mdnote_only and ds.get('measurement') != 'MDNote':
+        return ''
+    for file in associated_files:
+        if file['filename'].endswith('.md'):
             # Transform filename to download link key: dataset_unique_id/basename
-            md_basename = os.path.basename(md_file['filename'])
+            md_basename = os.path.basename(file['filename'])
             download_key = f"{ds['unique_id']}/{md_basename}"
-
             if download_key in download_links:
-                try:
-                    # Fetch the markdown content from the download link
-                    response = requests.get(download_links[download_key])
-                    if response.status_code == 200:
-                        md_content = response.text
-
-                        # Convert wiki-style links to proper markdown links
-                        # [[dataset:ID|Name]] -> [Name](/<project_id>/dataset/ID)
-                        # [[dataset:ID]] -> [Dataset ID](/<project_id>/dataset/ID)
-                        def replace_dataset_link(match):
-                            dataset_id = match.group(1)
-                            name = match.group(2) if match.group(2) else f'Dataset-{dataset_id}'
-                            return f'[{name}](/{project_id}/dataset/{dataset_id})'
-
-                        md_content = re.sub(
-                            r'\[\[dataset:([^\]|]+)(?:\|([^\]]+))?\]\]',
-                            replace_dataset_link,
-                            md_content
-                        )
+                response = app.transport.get(download_links[download_key])
+                response.raise_for_status()
+                return response.text
+            break
+    return ''
+
+def dataset_fetch_plan(dsid, mdnote_only=True):
+    """Crucible calls behind the dataset page; run only the steps a view needs"""
+    client = app.crucible_client
+    plan = FetchPlan(app.fetch_executor, timeout=FETCH_TIMEOUT)
+    plan.add('ds', client.get_dataset, dsid, include_metadata=True)
+    plan.add('samples', client.list_samples, dataset_id=dsid, default=[])
+    plan.add('thumbnails', app.thumbnails.get, dsid, default=[])
+    plan.add('associated_files', client.get_associated_files, dsid, default=[])
+    plan.add('download_links', client.get_dataset_download_links, dsid, default={})
+    plan.add('child_datasets', client.list_children_of_dataset, dsid, default=[])
+    plan.add('parent_datasets', client.list_parents_of_dataset, dsid, default=[])
+    plan.add('md_content', fetch_mdnote, mdnote_only=mdnote_only, default='',
+             requires=('ds', 'associated_files', 'download_links'))
+    return plan
+
+def render_mdnote(md_content, project_id):
+    """MDNote markdown to HTML, with wiki-style dataset/sample links resolved"""
+    # Convert wiki-style links to proper markdown links
+    # [[dataset:ID|Name]] -> [Name](/<project_id>/dataset/ID)
+    # [[dataset:ID]] -> [Dataset ID](/<project_id>/dataset/ID)
+    def replace_dataset_link(match):
+        dataset_id = match.group(1)
+        name = match.group(2) if match.group(2) else f'Dataset-{dataset_id}'
+        return f'[{name}](/{project_id}/dataset/{dataset_id})'
+
+    md_content = re.sub(
+        r'\[\[dataset:([^\]|]+)(?:\|([^\]]+))?\]\]',
+        replace_dataset_link,
+        md_content
+    )
+
+    # [[sample:ID|Name]] -> [Name](/<project_id>/sample-graph/ID)
+    # [[sample:ID]] -> [Sample-ID](/<project_id>/sample-graph/ID)
+    def replace_sample_link(match):
+        sample_id = match.group(1)
+        name = match.group(2) if match.group(2) else f'Sample-{sample_id}'
+        return f'[{name}](/{project_id}/sample-graph/{sample_id})'
+
+    md_content = re.sub(
+        r'\[\[sample:([^\]|]+)(?:\|([^\]]+))?\]\]',
+        replace_sample_link,
+        md_content
+    )
+
+    # Convert markdown to HTML
+    return markdown.markdown(md_content, extensions=['extra', 'codehilite', 'tables'])
 
-                        # [[sample:ID|Name]] -> [Name](/<project_id>/sample-graph/ID)
-                        # [[sample:ID]] -> [Sample-ID](/<project_id>/sample-graph/ID)
-                        def replace_sample_link(match):
-                            sample_id = match.group(1)
-                            name = match.group(2) if match.group(2) else f'Sample-{sample_id}'
-                            return f'[{name}](/{project_id}/sample-graph/{sample_id})'
-
-                        md_content = re.sub(
-                            r'\[\[sample:([^\]|]+)(?:\|([^\]]+))?\]\]',
-                            replace_sample_link,
-                            md_content
-                        )
 
-                        # Convert markdown to HTML
-                        markdown_html = markdown.markdown(md_content, extensions=['extra', 'codehilite', 'tables'])
-                except Exception as err:
-                    print(f"Failed to fetch/render markdown for {dsid}: {err}")
+@app.route("/<project_id>/dataset/<dsid>")
+@auth.oidc_auth('orcid')
+def dataset(project_id, dsid):
+    if not is_user_in_project(project_id):
+        abort(403)
+    # all calls run concurrently; anything but the dataset itself may fail and render empty
+    fetched = dataset_fetch_plan(dsid).run()
+    if not fetched.ok('ds') or not fetched['ds']:
+        abort(502 if 'ds' in fetched.errors else 404)
+    ds = fetched['ds']
+
+    markdown_html = None
+    if fetched['md_content']:
+        try:
+            markdown_html = render_mdnote(fetched['md_content'], project_id)
+        except Exception as err:
+            print(f"Failed to render markdown for {dsid}: {err}")
+    elif 'md_content' in fetched.errors:
+        print(f"Failed to fetch markdown for {dsid}: {fetched.errors['md_content']}")
 
     return render_template("dataset.html",
                            project_id=project_id, ds=ds,
-                           child_datasets = child_datasets,
-                           parent_datasets = parent_datasets,
-                           samples=samples,
-                            files=associated_files,
-                            download_links=download_links,
-                           thumbnails=thumbnails,
-                           markdown_html=markdown_html)
-
-def flatten_metadata(obj, path=''):
-    """Recursively flatten a nested dict to 'dotted.key: value' lines."""
-    lines = []
-    if not isinstance(obj, dict):
-        return lines
-    for key, val in obj.items():
-        full_path = f"{path}.{key}" if path else key
-        if isinstance(val, dict):
-            lines.extend(flatten_metadata(val, full_path))
-        else:
-            lines.append(f"{full_path}: {val}")
-    return lines
+                           child_datasets = fetched['child_datasets'],
+                           parent_datasets = fetched['parent_datasets'],
+                           samples=fetched['samples'],
+                            files=fetched['associated_files'],
+                            download_links=fetched['download_links'],
+                           thumbnails=fetched['thumbnails'],
+                           markdown_html=markdown_html,
+                           fetch_errors=fetched.errors)
+
+# snapshot_version each project's search index was last updated to
+app.search_index_versions = {}
+app.search_index_lock = threading.Lock()
+
+def get_project_search_index(project_id):
+    """Search index of the project, brought up to date with its current snapshot"""
+    pc = get_project(project_id, include_metadata=True)
+    index = project_search_index(project_id)
+    version = pc.get('snapshot_version')
+    with app.search_index_lock:
+        if app.search_index_versions.get(project_id) != version:
+            if index.version() != version:
+                changed, removed = index.update(pc)
+                print(f"search index {project_id}: {changed} documents updated, {removed} removed")
+            app.search_index_versions[project_id] = version
+    return index
 
 
 @app.route("/<project_id>/search")
@@ -391,28 +741,94 @@ def flatten_metadata(obj, path=''):
 def project_search(project_id):
     if not is_user_in_project(project_id):
         abort(403)
+    return render_template('search.html', pc=dict(project_id=project_id))
+
+
+@app.route("/<project_id>/api/search")
+@auth.oidc_auth('orcid')
+def api_search(project_id):
+    """Ranked, paginated search: ?q=...&kind=sample|dataset&page=1&per_page=50
+
+    q mixes free text with field filters, e.g. `perovskite measurement:XRD anneal_temp>150`
+    """
+    if not is_user_in_project(project_id):
+        abort(403)
+    q = request.args.get('q', '').strip()
+    kind = request.args.get('kind')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+    found = get_project_search_index(project_id).search(q, kind=kind, page=page, per_page=per_page)
+    for r in found['results']:
+        if r['kind'] == 'sample':
+            r['url'] = f'/{project_id}/sample-graph/{r["id"]}'
+        else:
+            r['url'] = f'/{project_id}/dataset/{r["id"]}'
+    return jsonify(dict(found, query=q, page=page, per_page=per_page))
+
+
+# columnar scientific metadata of each project (see MetadataStore), rebuilt when the snapshot changes
+app.metadata_stores = {}  # project_id -> MetadataStore
+
+def get_metadata_store(project_id):
     pc = get_project(project_id, include_metadata=True)
+    store = app.metadata_stores.get(project_id)
+    if store is None or store.version != pc.get('snapshot_version') or store.version is None:
+        store = MetadataStore(pc)
+        app.metadata_stores[project_id] = store
+    return store
 
-    samples_index = [{
-        'id': s['unique_id'],
-        'name': s['sample_name'],
-        'description': s.get('description', ''),
-        'type': s.get('sample_type', ''),
-        'url': f'/{project_id}/sample-graph/{s["unique_id"]}'
-    } for s in pc['samples']]
-
-    datasets_index = [{
-        'id': d['unique_id'],
-        'name': d['dataset_name'],
-        'measurement': d.get('measurement', ''),
-        'metadata_str': '\n'.join(flatten_metadata(d.get('scientific_metadata') or {})),
-        'url': f'/{project_id}/dataset/{d["unique_id"]}'
-    } for d in pc['datasets']]
-
-    return render_template('search.html',
-                           pc=pc,
-                           samples_index=samples_index,
-                           datasets_index=datasets_index)
+@app.route("/<project_id>/metadata")
+@auth.oidc_auth('orcid')
+def metadata_explorer(project_id):
+    if not is_user_in_project(project_id):
+        abort(403)
+    return render_template('metadata.html', pc=dict(project_id=project_id),
+                           measurements=get_metadata_store(project_id).measurements())
+
+@app.route("/<project_id>/api/metadata-fields")
+@auth.oidc_auth('orcid')
+def api_metadata_fields(project_id):
+    """Fields of ?measurement= with their type, count and range or common values (measurements if omitted)"""
+    if not is_user_in_project(project_id):
+        abort(403)
+    store = get_metadata_store(project_id)
+    measurement = request.args.get('measurement')
+    if measurement is None:
+        return jsonify({'measurements': store.measurements()})
+    try:
+        return jsonify(store.describe(measurement))
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+
+@app.route("/<project_id>/api/metadata-query")
+@auth.oidc_auth('orcid')
+def api_metadata_query(project_id):
+    """Vectorized metadata filters over one measurement's datasets
+
+    ?measurement=spin_run&where=heater_sv_temp:100..150&where=recipe.speed>=3000
+    lists matching datasets (with &fields=a,b &sort=a &desc=1 &page= &per_page=);
+    &aggregate=heater_sv_temp (optionally &group_by=key) summarises a field instead.
+    """
+    if not is_user_in_project(project_id):
+        abort(403)
+    store = get_metadata_store(project_id)
+    measurement = request.args.get('measurement', '')
+    filters = [w for w in request.args.getlist('where') if w.strip()]
+    fields = [f for f in request.args.get('fields', '').split(',') if f] or None
+    try:
+        if request.args.get('aggregate'):
+            return jsonify(store.aggregate(measurement, request.args['aggregate'], filters,
+                                           group_by=request.args.get('group_by') or None))
+        found = store.query(measurement, filters, fields=fields,
+                            sort=request.args.get('sort') or None,
+                            descending=request.args.get('desc', '0') == '1',
+                            page=max(request.args.get('page', 1, type=int), 1),
+                            per_page=min(max(request.args.get('per_page', 50, type=int), 1), 500))
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+    for r in found['results']:
+        r['url'] = f'/{project_id}/dataset/{r["id"]}'
+    return jsonify(found)
 
 
 @app.route("/<project_id>/entity-graph/<entity_type>/<entity_id>")
@@ -445,7 +861,7 @@ def entity_graph_data(project_id, entity_type, entity_id):
         abort(403)
 
     pc = get_project(project_id)
-    G = get_project_sample_graph(project_id)
+    lineage = get_project_lineage(project_id)
 
     # Determine focal sample(s)
     if entity_type == 'sample':
@@ -453,34 +869,12 @@ def entity_graph_data(project_id, entity_type, entity_id):
     else:
         focal_sample_ids = {s['unique_id'] for s in app.crucible_client.list_samples(dataset_id=entity_id)}
 
-    # Expand to ancestors + descendants for each focal sample
-    all_sample_ids = set()
-    for sid in focal_sample_ids:
-        if sid in G:
-            all_sample_ids |= nx.ancestors(G, sid) | nx.descendants(G, sid) | {sid}
-        else:
-            all_sample_ids.add(sid)
-
-    subgraph = G.subgraph(all_sample_ids)
-    nodes = []
-    edges = []
-    seen = set()
-
-    # Sample nodes
-    for sid in all_sample_ids:
-        seen.add(sid)
-        sample = pc['samples_by_id'].get(sid, {})
-        nodes.append({
-            'id': sid,
-            'label': sample.get('sample_name', sid[:13]),
-            'type': 'sample',
-            'description': sample.get('description', ''),
-            'url': f'/{project_id}/sample-graph/{sid}'
-        })
-
-    # Sample-sample edges
-    for source, target in subgraph.edges():
-        edges.append({'source': source, 'target': target})
+    # Ancestors + descendants of the focal samples, within the requested limits
+    args = graph_view_args()
+    view = compact_lineage(lineage, focal_sample_ids, sample_type_key(pc), **args)
+    nodes, edges = lineage_graph_elements(project_id, pc, lineage, view, 'entity-graph-data/sample', args,
+                                          datasets=True)
+    seen = set(view.depths)
 
     # Collect unique dataset IDs and edges in one pass
     dataset_meta = {}  # dsid -> ds dict
@@ -511,74 +905,105 @@ def entity_graph_data(project_id, entity_type, entity_id):
         except Exception:
             pass
 
-    for sid in all_sample_ids:
-        sample = pc['samples_by_id'].get(sid, {})
-        for ds_ref in sample.get('datasets', []):
-            dsid = ds_ref['unique_id']
-            edges.append({'source': sid, 'target': dsid})
-            if dsid not in seen:
-                seen.add(dsid)
-                dataset_meta[dsid] = pc['datasets_by_id'].get(dsid, ds_ref)
-
-    # Fetch all thumbnails in parallel
-    def fetch_thumbnail(dsid):
-        try:
-            thumbs = app.crucible_client.get_thumbnails(dsid)
-            if thumbs:
-                return dsid, f"data:image/png;base64,{thumbs[0]['thumbnail_b64str']}"
-        except Exception:
-            pass
-        return dsid, None
-
-    thumbnails = {}
-    if dataset_meta:
-        with ThreadPoolExecutor(max_workers=min(len(dataset_meta), 10)) as executor:
-            for dsid, thumb in executor.map(fetch_thumbnail, dataset_meta):
-                thumbnails[dsid] = thumb
+    group_nodes, sample_ds_edges, sample_ds_meta = dataset_graph_elements(
+        project_id, pc, view.depths, collapse=args['collapse'], seen=seen)
+    nodes += group_nodes
+    edges += sample_ds_edges
+    dataset_meta.update(sample_ds_meta)
 
     # Build dataset nodes
-    for dsid, ds in dataset_meta.items():
-        nodes.append({
-            'id': dsid,
-            'label': ds.get('dataset_name', dsid[:13]),
-            'type': 'dataset',
-            'measurement': ds.get('measurement', ''),
-            'url': f'/{project_id}/dataset/{dsid}',
-            'thumbnail': thumbnails.get(dsid)
-        })
+    nodes += dataset_nodes(project_id, dataset_meta)
 
     return jsonify({
         'nodes': nodes,
         'edges': edges,
         'centerNodeId': entity_id,
-        'centerNodeType': entity_type
+        'centerNodeType': entity_type,
+        'truncated': view.truncated
     })
 
 
-@app.route("/<project_id>/api/samples")
+@app.route("/<project_id>/api/thumbnails")
 @auth.oidc_auth('orcid')
-def api_samples(project_id):
+def api_thumbnails(project_id):
+    """Batch thumbnails: ?ids=dsid1,dsid2,... -> {dsid: image URL or null}"""
     if not is_user_in_project(project_id):
         abort(403)
-    q = request.args.get('q', '').lower()
-    pc = get_project(project_id)
-    samples = pc['samples']
-    if q:
-        samples = [s for s in samples if q in s['sample_name'].lower() or q in s['unique_id'].lower()]
-    return jsonify([{'id': s['unique_id'], 'name': s['sample_name']} for s in samples[:20]])
+    ids = [dsid for dsid in request.args.get('ids', '').split(',') if dsid][:200]
+    return jsonify({dsid: thumbnail_url(project_id, dsid) if thumbs else None
+                    for dsid, thumbs in app.thumbnails.get_many(ids).items()})
 
 
-@app.route("/<project_id>/api/datasets")
+def thumbnail_url(project_id, dsid, n=0):
+    url = f"/{project_id}/thumb/{dsid}.png"
+    return f"{url}?n={n}" if n else url
+
+
+@app.route("/<project_id>/thumb/<dsid>.png")
 @auth.oidc_auth('orcid')
-def api_datasets(project_id):
+def dataset_thumbnail(project_id, dsid):
+    """n-th (default first) thumbnail of a dataset as an image, with ETag for conditional requests"""
     if not is_user_in_project(project_id):
         abort(403)
-    q = request.args.get('q', '').lower()
+    n = request.args.get('n', '0')
+    if not n.isdigit():
+        abort(400)
+    image = app.thumbnails.image(dsid, int(n))
+    if image is None:
+        abort(404)
+    data, mimetype, etag = image
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(etag)
+    # behind login, so only the browser (not shared caches) may keep it
+    response.cache_control.private = True
+    response.cache_control.max_age = THUMBNAIL_MAX_AGE
+    return response.make_conditional(request)
+
+
+# autocomplete indexes keyed by (project_id, kind) -> (snapshot_version, AutocompleteIndex)
+app.autocomplete_indexes = {}
+
+def get_autocomplete_index(project_id, kind):
+    """Autocomplete index over the project's samples or datasets, rebuilt when the snapshot changes"""
     pc = get_project(project_id)
-    datasets = pc['datasets']
-    if q:
-        datasets = [d for d in datasets if q in d['dataset_name'].lower() or q in d['unique_id'].lower()]
-    return jsonify([{'id': d['unique_id'], 'name': d['dataset_name']} for d in datasets[:20]])
+    version = pc.get('snapshot_version')
+    cached = app.autocomplete_indexes.get((project_id, kind))
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    if kind == 'sample':
+        index = AutocompleteIndex((s['unique_id'], s['sample_name']) for s in pc['samples'])
+    else:
+        index = AutocompleteIndex((d['unique_id'], d['dataset_name']) for d in pc['datasets'])
+    app.autocomplete_indexes[(project_id, kind)] = (version, index)
+    return index
+
+def autocomplete_response(project_id, kind):
+    """JSON list of {id, name} matching ?q= (exact, then prefix, then substring matches)
+
+    ?limit= sets the page size (default 20); the X-Next-Cursor response header,
+    passed back as ?cursor=, fetches the next page.
+    """
+    if not is_user_in_project(project_id):
+        abort(403)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+    matches, next_cursor = get_autocomplete_index(project_id, kind).search(
+        request.args.get('q', ''), limit=limit, cursor=request.args.get('cursor'))
+    response = jsonify([{'id': uid, 'name': name} for uid, name in matches])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+@app.route("/<project_id>/api/samples")
+@auth.oidc_auth('orcid')
+def api_samples(project_id):
+    return autocomplete_response(project_id, 'sample')
+
+
+@app.route("/<project_id>/api/datasets")
+@auth.oidc_auth('orcid')
+def api_datasets(project_id):
+    return autocomplete_response(project_id, 'dataset')
 
 
 @app.route("/<project_id>/dataset/<dsid>/mdnote-edit", methods=['GET', 'POST'])
@@ -586,8 +1011,6 @@ def api_datasets(project_id):
 def mdnote_edit(project_id, dsid):
     if not is_user_in_project(project_id):
         abort(403)
-    ds = app.crucible_client.get_dataset(dsid, include_metadata=True)
-
     if request.method == 'POST':
         md_content = request.json.get('content', '')
         associated_files = app.crucible_client.get_associated_files(dsid)
@@ -609,23 +1032,17 @@ def mdnote_edit(project_id, dsid):
         return jsonify({'status': 'ok'})
 
     # GET: load current markdown content
-    associated_files = app.crucible_client.get_associated_files(dsid)
-    download_links = app.crucible_client.get_dataset_download_links(dsid)
-    md_content = ''
-    for file in associated_files:
-        if file['filename'].endswith('.md'):
-            md_basename = os.path.basename(file['filename'])
-            download_key = f"{ds['unique_id']}/{md_basename}"
-            if download_key in download_links:
-                response = requests.get(download_links[download_key])
-                if response.status_code == 200:
-                    md_content = response.text
-            break
+    fetched = dataset_fetch_plan(dsid, mdnote_only=False).run('ds', 'md_content')
+    if not fetched.ok('ds') or not fetched['ds']:
+        abort(502 if 'ds' in fetched.errors else 404)
+    if fetched.errors:
+        # an empty editor would overwrite the existing note on save
+        abort(502)
 
     return render_template('mdnote_edit.html',
                            project_id=project_id,
-                           ds=ds,
-                           md_content=md_content)
+                           ds=fetched['ds'],
+                           md_content=fetched['md_content'])
 
 
 @app.route("/auth-test/")
@@ -640,6 +1057,8 @@ def auth_test():
 def error(error=None, error_description=None):
     if error == 'login_required':
         user_session = UserSession(flask.session)
+        if user_session.userinfo:
+            app.user_projects.invalidate(user_session.userinfo.get('sub'))
         user_session.clear()
         return redirect('/')
 
@@ -652,6 +1071,11 @@ def error(error=None, error_description=None):
 
 CHAT_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-5-haiku-20241022")
 
+# tool calls of a turn run concurrently on this bounded pool, each with its own deadline
+CHAT_TOOL_TIMEOUT = float(os.getenv("CHAT_TOOL_TIMEOUT", 30))
+app.chat_tool_executor = ThreadPoolExecutor(max_workers=int(os.getenv("CHAT_TOOL_WORKERS", 8)),
+                                            thread_name_prefix='chat-tools')
+
 CHAT_TOOL_DEFS = [
     {
         "name": "get_sample",
@@ -677,22 +1101,30 @@ CHAT_TOOL_DEFS = [
     },
     {
         "name": "search_samples",
-        "description": "Search samples in the project by name substring.",
+        "description": (
+            "Search samples in the project by name substring. Results are ranked (exact, prefix, then "
+            "substring matches) and paged, with the total and counts by sample type."
+        ),
         "input_schema": {
             "type": "object",
             "properties": {
-                "query": {"type": "string", "description": "Substring to match against sample names"}
+                "query": {"type": "string", "description": "Substring to match against sample names"},
+                "page":  {"type": "integer", "description": "1-based page of results (default 1); use next_page from a previous result"}
             },
             "required": ["query"]
         }
     },
     {
         "name": "search_datasets",
-        "description": "Search datasets in the project by name or measurement type substring.",
+        "description": (
+            "Search datasets in the project by name or measurement type substring. Results are ranked "
+            "(name matches first) and paged, with the total and counts by measurement type."
+        ),
         "input_schema": {
             "type": "object",
             "properties": {
-                "query": {"type": "string", "description": "Substring to match against dataset names or measurement types"}
+                "query": {"type": "string", "description": "Substring to match against dataset names or measurement types"},
+                "page":  {"type": "integer", "description": "1-based page of results (default 1); use next_page from a previous result"}
             },
             "required": ["query"]
         }
@@ -713,18 +1145,58 @@ CHAT_TOOL_DEFS = [
         "description": (
             "Return the lineage graph for a sample or dataset: its ancestor and descendant samples, "
             "sample-to-sample relationships, and the datasets associated with each sample. "
-            "Use this to understand provenance, processing history, or what measurements exist for a sample."
+            "Use this to understand provenance, processing history, or what measurements exist for a sample. "
+            "Large graphs are paged: focal samples come first, and edges touching the page's samples are included."
         ),
         "input_schema": {
             "type": "object",
             "properties": {
                 "entity_type": {"type": "string", "enum": ["sample", "dataset"],
                                 "description": "Whether the ID refers to a sample or a dataset"},
-                "entity_id":   {"type": "string", "description": "The unique_id of the sample or dataset"}
+                "entity_id":   {"type": "string", "description": "The unique_id of the sample or dataset"},
+                "page":        {"type": "integer", "description": "1-based page of results (default 1); use next_page from a previous result"}
             },
             "required": ["entity_type", "entity_id"]
         }
     },
+    {
+        "name": "describe_metadata",
+        "description": (
+            "List the measurement types of the project with their dataset counts or, given a measurement, "
+            "its scientific metadata fields (dotted keys) with their type, count and range or most common values. "
+            "Use this before query_metadata to find field names."
+        ),
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "measurement": {"type": "string", "description": "Measurement type, e.g. spin_run (omit to list measurement types)"}
+            }
+        }
+    },
+    {
+        "name": "query_metadata",
+        "description": (
+            "Filter the datasets of one measurement type by scientific metadata values, or aggregate a field "
+            "over them (count, min, max, mean, or most common values; optionally per value of group_by). "
+            "Filters look like 'heater_sv_temp:100..150', 'recipe.speed>=3000' or 'solvent:DMF*'."
+        ),
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "measurement": {"type": "string", "description": "Measurement type, e.g. spin_run"},
+                "filters":     {"type": "array", "items": {"type": "string"},
+                                "description": "Filters key:value, key!=value, key>number, key<=number or key:low..high; * is a wildcard"},
+                "fields":      {"type": "array", "items": {"type": "string"},
+                                "description": "Metadata fields to return per dataset (default: the filtered fields)"},
+                "sort":        {"type": "string", "description": "Field to sort by"},
+                "descending":  {"type": "boolean", "description": "Sort descending"},
+                "aggregate":   {"type": "string", "description": "Summarise this field instead of listing datasets"},
+                "group_by":    {"type": "string", "description": "With aggregate: summarise per value of this field"},
+                "page":        {"type": "integer", "description": "1-based page of results (default 1); use next_page from a previous result"}
+            },
+            "required": ["measurement"]
+        }
+    },
     {
         "name": "get_thumbnail",
         "description": "Retrieve and display a thumbnail image for a dataset. Use this when the user asks to see an image, photo, or thumbnail of a dataset.",
@@ -790,8 +1262,77 @@ def build_system_prompt(pc):
 {dataset_section}{dataset_note}
 
 Use the provided tools to retrieve scientific metadata, sample details, and dataset details \
-when answering questions. Always cite the IDs of the samples or datasets you reference."""
-
+when answering questions. To find or compare datasets by metadata values (e.g. all spin_run datasets \
+with heater_sv_temp between 100 and 150), use describe_metadata and query_metadata. Always cite the IDs of the samples or datasets you reference."""
+
+
+# system prompts keyed by project_id -> (snapshot_version, prompt)
+app.chat_system_prompts = {}
+
+def get_system_prompt(pc):
+    """build_system_prompt(pc), rebuilt only when the project snapshot changes"""
+    project_id, version = pc['project_id'], pc.get('snapshot_version')
+    cached = app.chat_system_prompts.get(project_id)
+    if cached is None or cached[0] != version or version is None:
+        cached = (version, build_system_prompt(pc))
+        app.chat_system_prompts[project_id] = cached
+    return cached[1]
+
+
+# Prompt caching: tools, system prompt and the conversation so far are sent as a
+# cacheable prefix, so follow-up turns and tool-loop iterations only pay for new tokens
+CHAT_PROMPT_CACHING = os.getenv("CHAT_PROMPT_CACHING", "1") == "1"
+_CACHE_CONTROL = {'type': 'ephemeral'}
+CHAT_TOOL_DEFS_CACHED = CHAT_TOOL_DEFS[:-1] + [dict(CHAT_TOOL_DEFS[-1], cache_control=_CACHE_CONTROL)]
+
+def chat_request_prefix(system_prompt, messages):
+    """(system, tools, messages) for messages.stream, with cache breakpoints when enabled"""
+    if not CHAT_PROMPT_CACHING or not messages:
+        return system_prompt, CHAT_TOOL_DEFS, messages
+    system = [{'type': 'text', 'text': system_prompt, 'cache_control': _CACHE_CONTROL}]
+    # mark the last block of the conversation that can carry a breakpoint; other messages keep
+    # their content untouched
+    for i in range(len(messages) - 1, -1, -1):
+        content = messages[i]['content']
+        if isinstance(content, str):
+            content = [{'type': 'text', 'text': content}]
+        for j in range(len(content) - 1, -1, -1):
+            if _cacheable_block(content[j]):
+                content = content[:j] + [dict(content[j], cache_control=_CACHE_CONTROL)] + content[j + 1:]
+                marked = dict(messages[i], content=content)
+                return system, CHAT_TOOL_DEFS_CACHED, messages[:i] + [marked] + messages[i + 1:]
+    return system, CHAT_TOOL_DEFS_CACHED, messages
+
+
+def _cacheable_block(block):
+    # the API rejects cache_control on empty text blocks and on thinking blocks
+    if block.get('type') == 'text':
+        return bool(block.get('text'))
+    return block.get('type') not in ('thinking', 'redacted_thinking')
+
+
+app.chat_usage = dict(requests=0, input_tokens=0, output_tokens=0,
+                      cache_read_input_tokens=0, cache_creation_input_tokens=0)
+_chat_usage_lock = threading.Lock()
+
+def record_chat_usage(usage):
+    """Add one response's token usage (including prompt cache reads/writes) to app.chat_usage"""
+    if usage is None:
+        return
+    with _chat_usage_lock:
+        app.chat_usage['requests'] += 1
+        for key in ('input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens'):
+            app.chat_usage[key] += getattr(usage, key, None) or 0
+    print(f"chat usage: input={usage.input_tokens} output={usage.output_tokens} "
+          f"cache_read={getattr(usage, 'cache_read_input_tokens', None) or 0} "
+          f"cache_write={getattr(usage, 'cache_creation_input_tokens', None) or 0}")
+
+
+# result shaping: page sizes of the search and graph tools, datasets listed per graph node, result size budget
+CHAT_TOOL_PAGE_SIZE = int(os.getenv("CHAT_TOOL_PAGE_SIZE", 25))
+GRAPH_PAGE_SIZE = 10
+GRAPH_NODE_DATASETS = 5
+CHAT_TOOL_RESULT_CHARS = int(os.getenv("CHAT_TOOL_RESULT_CHARS", 3000))
 
 def execute_chat_tool(name, inputs, crucible_client, pc):
     try:
@@ -800,25 +1341,22 @@ def execute_chat_tool(name, inputs, crucible_client, pc):
         elif name == 'get_dataset':
             result = crucible_client.get_dataset(inputs['dataset_id'], include_metadata=True)
         elif name == 'search_samples':
-            q = inputs['query'].lower()
-            result = [
-                {'id': s['unique_id'], 'name': s['sample_name'], 'type': s.get('sample_type', '')}
-                for s in pc.get('samples', [])
-                if q in s['sample_name'].lower()
-            ]
+            matches = rank_matches(pc.get('samples', []), inputs['query'], ('sample_name',))
+            result = page_results(
+                [{'id': s['unique_id'], 'name': s['sample_name'], 'type': s.get('sample_type', '')} for s in matches],
+                inputs.get('page', 1), CHAT_TOOL_PAGE_SIZE)
         elif name == 'search_datasets':
-            q = inputs['query'].lower()
-            result = [
-                {'id': d['unique_id'], 'name': d['dataset_name'], 'measurement': d.get('measurement', '')}
-                for d in pc.get('datasets', [])
-                if q in d['dataset_name'].lower() or q in d.get('measurement', '').lower()
-            ]
+            matches = rank_matches(pc.get('datasets', []), inputs['query'], ('dataset_name', 'measurement'))
+            result = page_results(
+                [{'id': d['unique_id'], 'name': d['dataset_name'], 'measurement': d.get('measurement', '')}
+                 for d in matches],
+                inputs.get('page', 1), CHAT_TOOL_PAGE_SIZE, type_key='measurement')
         elif name == 'list_samples_for_dataset':
             result = crucible_client.list_samples(dataset_id=inputs['dataset_id'])
         elif name == 'get_entity_graph':
             entity_type = inputs['entity_type']
             entity_id   = inputs['entity_id']
-            G = get_project_sample_graph(pc['project_id'])
+            lineage = get_project_lineage(pc['project_id'])
 
             if entity_type == 'sample':
                 focal_ids = {entity_id}
@@ -827,35 +1365,85 @@ def execute_chat_tool(name, inputs, crucible_client, pc):
 
             all_sample_ids = set()
             for sid in focal_ids:
-                if sid in G:
-                    all_sample_ids |= nx.ancestors(G, sid) | nx.descendants(G, sid) | {sid}
-                else:
-                    all_sample_ids.add(sid)
+                all_sample_ids |= lineage.lineage(sid)
 
-            subgraph = G.subgraph(all_sample_ids)
             nodes = []
             for sid in all_sample_ids:
                 s = pc['samples_by_id'].get(sid, {})
+                sample_datasets = s.get('datasets', [])
                 datasets_for_sample = [
                     {'id': d['unique_id'], 'name': d.get('dataset_name', ''), 'measurement': d.get('measurement', '')}
-                    for d in s.get('datasets', [])
+                    for d in sample_datasets[:GRAPH_NODE_DATASETS]
                 ]
                 nodes.append({
                     'id': sid,
                     'name': s.get('sample_name', sid[:13]),
                     'type': s.get('sample_type', ''),
                     'is_focal': sid in focal_ids,
+                    'dataset_count': len(sample_datasets),
                     'datasets': datasets_for_sample
                 })
-            edges = [{'source': src, 'target': tgt} for src, tgt in subgraph.edges()]
-            result = {'nodes': nodes, 'edges': edges}
+            nodes.sort(key=lambda n: (not n['is_focal'], n['name']))
+            edges = lineage.edges_within(all_sample_ids)
+            result = page_results(nodes, inputs.get('page', 1), GRAPH_PAGE_SIZE, results_key='nodes')
+            on_page = {n['id'] for n in result['nodes']}
+            result['total_edges'] = len(edges)
+            result['edges'] = [{'source': src, 'target': tgt} for src, tgt in edges
+                               if src in on_page or tgt in on_page]
+        elif name == 'describe_metadata':
+            store = get_metadata_store(pc['project_id'])
+            if inputs.get('measurement'):
+                result = store.describe(inputs['measurement'])
+            else:
+                result = {'measurements': store.measurements()}
+        elif name == 'query_metadata':
+            store = get_metadata_store(pc['project_id'])
+            if inputs.get('aggregate'):
+                result = store.aggregate(inputs['measurement'], inputs['aggregate'], inputs.get('filters', []),
+                                         group_by=inputs.get('group_by'))
+            else:
+                result = store.query(inputs['measurement'], inputs.get('filters', []), fields=inputs.get('fields'),
+                                     sort=inputs.get('sort'), descending=inputs.get('descending', False),
+                                     page=inputs.get('page', 1), per_page=CHAT_TOOL_PAGE_SIZE)
         else:
             result = {'error': f'Unknown tool: {name}'}
     except Exception as e:
         result = {'error': str(e)}
 
-    text = json.dumps(result, default=str)
-    return text[:3000] if len(text) > 3000 else text
+    # always valid JSON: large results are shrunk structurally instead of cut mid-text
+    return fit_json(result, CHAT_TOOL_RESULT_CHARS)
+
+
+# chat tool results keyed by (project_id, snapshot_version, tool, normalized input):
+# repeated lookups across turns and users are served locally until the snapshot changes
+app.chat_tool_cache = SnapshotCache(
+    None,
+    ttl=float(os.getenv("CHAT_TOOL_CACHE_TTL", 3600)),
+    max_bytes=int(os.getenv("CHAT_TOOL_CACHE_MAX_MB", 64)) * 1024 * 1024,
+    sizeof=len,
+    name='chat-tools')
+app.chat_tool_cache_counts = {}  # tool -> dict(hits, misses)
+_chat_tool_counts_lock = threading.Lock()
+
+def normalize_tool_input(name, inputs):
+    """Canonical JSON of a tool input; search queries are case-insensitive"""
+    normalized = {k: v.strip() if isinstance(v, str) else v for k, v in inputs.items()}
+    if name in ('search_samples', 'search_datasets') and isinstance(normalized.get('query'), str):
+        normalized['query'] = normalized['query'].lower()
+    return json.dumps(normalized, sort_keys=True, separators=(',', ':'), default=str)
+
+def execute_chat_tool_cached(name, inputs, crucible_client, pc):
+    """execute_chat_tool through app.chat_tool_cache; errors are not cached"""
+    key = (pc['project_id'], pc.get('snapshot_version'), name, normalize_tool_input(name, inputs))
+    text = app.chat_tool_cache.peek(key)
+    with _chat_tool_counts_lock:
+        counts = app.chat_tool_cache_counts.setdefault(name, dict(hits=0, misses=0))
+        counts['hits' if text is not None else 'misses'] += 1
+    if text is None:
+        text = execute_chat_tool(name, inputs, crucible_client, pc)
+        if not text.startswith('{"error"'):
+            app.chat_tool_cache.put(key, text)
+    return text
 
 
 @app.route("/<project_id>/chat")
@@ -867,6 +1455,133 @@ def project_chat(project_id):
     return render_template('chat.html', pc=pc)
 
 
+async def run_chat_tool(name, inputs, project_id, pc):
+    """Run one chat tool call without blocking the event loop -> (result_text, extra SSE events)
+
+    A tool that takes longer than CHAT_TOOL_TIMEOUT reports a timeout to the model instead.
+    """
+    try:
+        return await asyncio.wait_for(_run_chat_tool(name, inputs, project_id, pc), CHAT_TOOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        return f"Tool {name} timed out after {CHAT_TOOL_TIMEOUT:g}s; try again or narrow the request.", []
+
+
+async def _run_chat_tool(name, inputs, project_id, pc):
+    if name == 'get_thumbnail':
+        dsid = inputs['dataset_id']
+        try:
+            thumbs = await asyncio.wrap_future(app.thumbnails.submit(dsid))
+        except Exception as e:
+            return f"Failed to retrieve thumbnail: {e}", []
+        if not thumbs:
+            return "No thumbnail available for this dataset.", []
+        label = pc['datasets_by_id'].get(dsid, {}).get('dataset_name', dsid[:13])
+        image = {'type': 'image', 'src': thumbnail_url(project_id, dsid), 'label': label}
+        return f"Thumbnail for '{label}' retrieved and displayed to the user.", [image]
+    # Crucible calls are blocking, run them on the chat tool pool
+    result_text = await asyncio.get_running_loop().run_in_executor(
+        app.chat_tool_executor, execute_chat_tool_cached, name, inputs, app.crucible_client, pc)
+    return result_text, []
+
+
+async def chat_events(project_id, pc, history, anthropic_client):
+    """The chat loop as an async generator of SSE event dicts, shared by the WSGI and ASGI servers"""
+    messages = list(history)
+    system_prompt = get_system_prompt(pc)
+
+    # tool_use id -> task, started as soon as the tool's input is complete, so the
+    # tools of one turn run concurrently; results are still reported in block order
+    tool_tasks = {}
+    try:
+        while True:
+            tool_tasks.clear()
+            system, tools, request_messages = chat_request_prefix(system_prompt, messages)
+            async with anthropic_client.messages.stream(
+                model=CHAT_MODEL,
+                system=system,
+                messages=request_messages,
+                tools=tools,
+                max_tokens=4096
+            ) as stream:
+                async for event in stream:
+                    # Emit text as it arrives
+                    if event.type == 'text' and event.text:
+                        yield {'type': 'text', 'delta': event.text}
+                    elif event.type == 'content_block_stop' and event.content_block.type == 'tool_use':
+                        block = event.content_block
+                        yield {'type': 'tool_call', 'name': block.name, 'input': block.input}
+                        tool_tasks[block.id] = asyncio.ensure_future(
+                            run_chat_tool(block.name, block.input, project_id, pc))
+                response = await stream.get_final_message()
+            record_chat_usage(getattr(response, 'usage', None))
+
+            if response.stop_reason == 'tool_use':
+                # Append assistant turn — only include fields the API accepts
+                assistant_content = []
+                for b in response.content:
+                    if b.type == 'text':
+                        assistant_content.append({'type': 'text', 'text': b.text})
+                    elif b.type == 'tool_use':
+                        assistant_content.append({'type': 'tool_use', 'id': b.id, 'name': b.name, 'input': b.input})
+                messages.append({'role': 'assistant', 'content': assistant_content})
+
+                tool_results = []
+                for block in response.content:
+                    if block.type == 'tool_use':
+                        result_text, events = await tool_tasks[block.id]
+                        for event in events:
+                            yield event
+                        yield {'type': 'tool_result', 'name': block.name, 'result': result_text}
+                        tool_results.append({
+                            'type': 'tool_result',
+                            'tool_use_id': block.id,
+                            'content': result_text
+                        })
+
+                messages.append({'role': 'user', 'content': tool_results})
+            else:
+                break
+
+    except Exception as e:
+        yield {'type': 'error', 'message': str(e)}
+    finally:
+        for task in tool_tasks.values():
+            task.cancel()
+
+    yield {'type': 'done'}
+
+
+CHAT_SSE_HEADERS = {'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'}
+
+def sse_event(event):
+    return f"data: {json.dumps(event)}\n\n"
+
+
+# one event loop thread runs the async chat loop for all WSGI worker threads
+_chat_loop = None
+_chat_loop_lock = threading.Lock()
+
+def chat_loop():
+    global _chat_loop
+    with _chat_loop_lock:
+        if _chat_loop is None:
+            _chat_loop = asyncio.new_event_loop()
+            threading.Thread(target=_chat_loop.run_forever, daemon=True, name='chat-loop').start()
+    return _chat_loop
+
+def iter_chat_events(events):
+    """Iterate the async generator events from a (WSGI) worker thread"""
+    loop = chat_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(events.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(events.aclose(), loop).result()
+
+
 @app.route("/<project_id>/api/chat", methods=['POST'])
 @auth.oidc_auth('orcid')
 def project_chat_api(project_id):
@@ -877,148 +1592,103 @@ def project_chat_api(project_id):
     history = body.get('history', [])   # list of {"role": ..., "content": ...} dicts
 
     pc = get_project(project_id)
-    system_prompt = build_system_prompt(pc)
 
     def generate():
-        messages = list(history)
-
-        try:
-            while True:
-                response = app.anthropic_client.messages.create(
-                    model=CHAT_MODEL,
-                    system=system_prompt,
-                    messages=messages,
-                    tools=CHAT_TOOL_DEFS,
-                    max_tokens=4096
-                )
-
-                # Emit text content
-                for block in response.content:
-                    if block.type == 'text' and block.text:
-                        payload = json.dumps({'type': 'text', 'delta': block.text})
-                        yield f"data: {payload}\n\n"
-
-                if response.stop_reason == 'tool_use':
-                    # Append assistant turn — only include fields the API accepts
-                    assistant_content = []
-                    for b in response.content:
-                        if b.type == 'text':
-                            assistant_content.append({'type': 'text', 'text': b.text})
-                        elif b.type == 'tool_use':
-                            assistant_content.append({'type': 'tool_use', 'id': b.id, 'name': b.name, 'input': b.input})
-                    messages.append({'role': 'assistant', 'content': assistant_content})
-
-                    tool_results = []
-                    for block in response.content:
-                        if block.type == 'tool_use':
-                            yield f"data: {json.dumps({'type': 'tool_call', 'name': block.name, 'input': block.input})}\n\n"
-
-                            if block.name == 'get_thumbnail':
-                                dsid = block.input['dataset_id']
-                                try:
-                                    thumbs = app.crucible_client.get_thumbnails(dsid)
-                                    if thumbs:
-                                        src = f"data:image/png;base64,{thumbs[0]['thumbnail_b64str']}"
-                                        label = pc['datasets_by_id'].get(dsid, {}).get('dataset_name', dsid[:13])
-                                        yield f"data: {json.dumps({'type': 'image', 'src': src, 'label': label})}\n\n"
-                                        result_text = f"Thumbnail for '{label}' retrieved and displayed to the user."
-                                    else:
-                                        result_text = "No thumbnail available for this dataset."
-                                except Exception as e:
-                                    result_text = f"Failed to retrieve thumbnail: {e}"
-                            else:
-                                result_text = execute_chat_tool(block.name, block.input, app.crucible_client, pc)
-
-                            yield f"data: {json.dumps({'type': 'tool_result', 'name': block.name, 'result': result_text})}\n\n"
-                            tool_results.append({
-                                'type': 'tool_result',
-                                'tool_use_id': block.id,
-                                'content': result_text
-                            })
-
-                    messages.append({'role': 'user', 'content': tool_results})
-                else:
-                    break
-
-        except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        for event in iter_chat_events(chat_events(project_id, pc, history, app.anthropic_client)):
+            yield sse_event(event)
 
     return Response(stream_with_context(generate()), mimetype='text/event-stream',
-                    headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'})
+                    headers=CHAT_SSE_HEADERS)
 
 
-# 10_perovskite specific views
+# ── project views ─────────────────────────────────────────────────────────────
+# Declarative tabular views (see project_views) are materialized from flat tables
+# of each project (see ProjectTables), and refreshed when the snapshot or its sample graph changes
 
-project_id = "10k_perovskites"
-@app.route(f"/10k_perovskites/view/overview")
-@auth.oidc_auth('orcid')
-def overview10k():
-    pc = get_project(project_id, include_metadata=True)
-    G = get_project_sample_graph(project_id)
+app.project_tables = {}  # project_id -> ProjectTables
+app.project_views = ViewStore()
 
+def get_project_tables(project_id):
+    pc = get_project(project_id, include_metadata=True)
+    lineage = get_project_lineage(project_id)
+    tables = app.project_tables.get(project_id)
+    version = (pc.get('snapshot_version'), lineage.version)
+    if tables is None or tables.version != version or version[0] is None:
+        # diffed against the previous tables, so views can refresh only what changed
+        tables = ProjectTables(pc, lineage, previous=tables)
+        app.project_tables[project_id] = tables
+    return tables
+
+def get_project_view(project_id, name):
+    """The MaterializedView of a registered view of the project (404 if there is none)"""
+    view = get_view(project_id, name)
+    if view is None:
+        abort(404)
+    return app.project_views.get(view, get_project_tables(project_id))
+
+VIEW_EXPORTS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+def project_view_export(project_id, name, fmt):
+    if fmt not in VIEW_EXPORTS:
+        abort(404)
     if not is_user_in_project(project_id):
         abort(403)
+    materialized = get_project_view(project_id, name)
+    try:
+        data = dataframe_bytes(materialized.df, fmt)
+    except ImportError:
+        abort(501, description="Parquet export needs the pyarrow package (the parquet extra)")
+    return Response(data, mimetype=VIEW_EXPORTS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={project_id}_{name}.{fmt}'})
 
-    thin_films = [s for s in pc['samples'] 
-                  if s['sample_name'].startswith('TF')]
-    thin_films.sort(key= lambda x: x['sample_name'])
+@app.route("/<project_id>/views/<name>")
+@auth.oidc_auth('orcid')
+def project_view_page(project_id, name):
+    if not is_user_in_project(project_id):
+        abort(403)
+    pc = get_project(project_id)
+    materialized = get_project_view(project_id, name)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
+    return render_template('project_view.html', pc=pc, view=materialized.view,
+                           found=materialized.page(page, per_page))
 
-    rows = []
+@app.route("/<project_id>/views/<name>.<fmt>")
+@auth.oidc_auth('orcid')
+def project_view_download(project_id, name, fmt):
+    return project_view_export(project_id, name, fmt)
 
-    for s in thin_films:
+@app.route("/<project_id>/api/views/<name>")
+@auth.oidc_auth('orcid')
+def api_project_view(project_id, name):
+    """One page of a project view: ?page=&per_page= -> {columns, total, next_page, rows, ...}"""
+    if not is_user_in_project(project_id):
+        abort(403)
+    materialized = get_project_view(project_id, name)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
+    return jsonify(materialized.page(page, per_page))
 
-        # all ancestors
-        ancestors = nx.ancestors(G, s['unique_id'])
-        ancestors = [pc['samples_by_id'][sid] for sid in ancestors]
-        # all descendants
-        descendants = nx.descendants(G, s['unique_id'])
-        descendants = [pc['samples_by_id'][sid] for sid in descendants]
 
-        # Find the solid precursor samples that were used to make this thin film sample
-        solid_precursors = [sample for sample in ancestors if sample['sample_name'].startswith('SP')]
-        
-        # Capture their compositions from the 'Solid Precursor synthesis' dataset
-        precursor_compositions = []
-        try:
-            for sp in solid_precursors:
-                for ds in sp['datasets']:
-                    if ds['measurement'] == 'Solid Precursor synthesis':
-                        full_ds = pc['datasets_by_id'][ds['unique_id']]
-                        material = full_ds['scientific_metadata']['name']
-                        precursor_compositions.append(material)
-        except Exception as err:
-            print(f"Failed to get solid precursor details {s['sample_name']}: {err}")
-        
-        if len(precursor_compositions) != 2:
-            #print(f"Warning: expected 2 solid precursors for {s['sample_name']}, found {len(precursor_compositions)}")
-            if len(precursor_compositions) < 2:
-                precursor_compositions += [None] * (2 - len(precursor_compositions))
-        
-        sr = [ds for ds in s['datasets'] if ds['measurement'] == 'spin_run']
-        if sr:
-            print(sr)
-            sr = pc['datasets_by_id'][sr[0]['unique_id']]
-            anneal_temp = sr['scientific_metadata']['heater_sv_temp']
-        else: 
-            anneal_temp = '?'
-
-        row = {
-            'thin_film_sample_name': s['sample_name'],
-            'thin_film_unique_id': s['unique_id'],
-            'sp_A': precursor_compositions[0],
-            'sp_B': precursor_compositions[1],
-            'anneal_temp': anneal_temp,
-        }
-        #print(row)
-        rows.append(row)    
+# 10_perovskite specific views
 
-    df = pandas.DataFrame(rows)
+project_id = "10k_perovskites"
+@app.route(f"/10k_perovskites/view/overview")
+@auth.oidc_auth('orcid')
+def overview10k():
+    if not is_user_in_project(project_id):
+        abort(403)
+    pc = get_project(project_id, include_metadata=True)
+    overview = get_project_view(project_id, 'overview')
 
     return render_template(f'proj10k_templates/overview.html', 
                            pc=pc,
-                           tfs=thin_films, df=df)
+                           df=overview.df, table_html=overview.html)
+
+@app.route(f"/10k_perovskites/view/overview.<fmt>")
+@auth.oidc_auth('orcid')
+def overview10k_export(fmt):
+    return project_view_export(project_id, 'overview', fmt)
 
 @app.route(f"/10k_perovskites/view/thinfilm-gallery")
 @auth.oidc_auth('orcid')
@@ -1026,30 +1696,17 @@ def thinfilm_gallery_10k():
     project_id = "10k_perovskites"
     if not is_user_in_project(project_id):
         abort(403)
-    pc = get_project(project_id)
-
-    thin_films = [s for s in pc['samples'] 
-                  if s['sample_name'].startswith('TF')]
-    thin_films.sort(key= lambda x: x['sample_name'])
+    images = get_project_view(project_id, 'thin-film-images').df
 
+    # link the thumbnail of the first 'sample well image' dataset; the browser
+    # fetches (and caches) the images lazily instead of inlining them in the page
     tf_thumbs = []
-    # get the thumbnail of the 
-    for tf in thin_films:
-        print(tf['sample_name'])
-        img_datasets = [ds for ds in tf['datasets'] if ds['measurement'] == 'sample well image']
-        
-        if img_datasets:
-            ds = img_datasets[0]
-            dsid = ds['unique_id']
-            thumbnails = app.crucible_client.get_thumbnails(dsid)    
-            tn  = thumbnails[0]
-        else:
-            tn = {}
-        tn['sample_name'] = tf['sample_name']
-        tn['sample_url'] = f"/10k_perovskites/sample-graph/{tf['unique_id']}"
+    for tf in images.itertuples(index=False):
+        tn = {}
+        if tf.image_dataset_id:
+            tn['thumbnail_url'] = thumbnail_url(project_id, tf.image_dataset_id)
+        tn['sample_name'] = tf.sample_name
+        tn['sample_url'] = f"/10k_perovskites/sample-graph/{tf.unique_id}"
         tf_thumbs.append(tn)
-            
-
-
 
     return render_template('proj10k_templates/thinfilm-gallery.html', tf_thumbs=tf_thumbs)
@@ -1,8 +1,30 @@
+import hashlib
+import inspect
 import json
 from networkx.readwrite import json_graph
 import networkx as nx
 import networkx.readwrite
 import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from snapshot_store import ProjectSnapshotStore
+from search_index import ProjectSearchIndex
+
+# paginated Crucible list calls: records per page, pages fetched ahead, and the offset query parameter
+PAGE_SIZE = int(os.getenv("CRUCIBLE_PAGE_SIZE", 1000))
+PAGE_WORKERS = int(os.getenv("CRUCIBLE_PAGE_WORKERS", 4))
+PAGE_OFFSET_PARAM = os.getenv("CRUCIBLE_PAGE_OFFSET_PARAM", "offset")
+# `limit` of a single call listing everything, for list calls that cannot be paged
+UNPAGED_LIMIT = int(os.getenv("CRUCIBLE_UNPAGED_LIMIT", 100000))
+# incremental syncs only see new datasets and those with a newer modification time, so every
+# FULL_SYNC_INTERVAL seconds all metadata is re-listed; more than METADATA_BATCH changed datasets are
+# re-listed in one paged call instead of fetched one by one
+FULL_SYNC_INTERVAL = float(os.getenv("PROJECT_FULL_SYNC_INTERVAL", 3600))
+METADATA_BATCH = int(os.getenv("CRUCIBLE_METADATA_BATCH", 50))
+
+_page_executor = ThreadPoolExecutor(max_workers=PAGE_WORKERS, thread_name_prefix='crucible-pages')
 
 def get_project(project_id, crucible_client):
     # if project_id in app.project_cache:
@@ -15,7 +37,11 @@ def get_project(project_id, crucible_client):
         return load_project_cache(project_id)
     
 def clear_project_cache(project_id):
-    fname = cache_filename(project_id)
+    for include_metadata in (True, False):
+        project_snapshot_store(project_id, include_metadata).clear()
+    project_search_index(project_id).clear()
+    # legacy indented JSON cache
+    fname = legacy_cache_filename(project_id)
     if os.path.exists(fname):
         os.remove(fname)
     # remove in memory cache
@@ -27,26 +53,26 @@ def generate_project_cache(project_id, crucible_client, include_metadata=True, s
     pc = dict(project_id=project_id)
 
     print(f'getting samples and datasets from Crucible {project_id=} {include_metadata=} {save=}', )
-    pc['samples'] = crucible_client.list_samples(project_id=project_id, limit=9999)
-    pc['datasets'] = crucible_client.list_datasets(project_id=project_id, limit=9999, include_metadata=include_metadata)
+    # index records page by page as they arrive
+    pc['samples'], pc['samples_by_id'], pc['samples_by_name'] = [], {}, {}
+    for page in iter_pages(crucible_client.list_samples, project_id=project_id):
+        for s in page:
+            pc['samples'].append(s)
+            pc['samples_by_id'][s['unique_id']] = s
+            pc['samples_by_name'][s['sample_name']] = s
 
-    # fix double nesting in scientific metadata:
-    for ds in pc['datasets']:
-        if 'scientific_metadata' in ds:
-            if ds['scientific_metadata'] and 'scientific_metadata' in ds['scientific_metadata']:
-                ds['scientific_metadata'] = ds['scientific_metadata']['scientific_metadata']
+    pc['datasets'], pc['datasets_by_id'] = [], {}
+    for page in iter_pages(crucible_client.list_datasets, project_id=project_id, include_metadata=include_metadata):
+        for ds in page:
+            # fix double nesting in scientific metadata:
+            fix_metadata_nesting(ds)
+            pc['datasets'].append(ds)
+            pc['datasets_by_id'][ds['unique_id']] = ds
 
-
-    pc['samples_by_id'] = {s['unique_id']:s for s in pc['samples']}
-    pc['samples_by_name'] = {s['sample_name']:s for s in pc['samples']}
-
-    pc['datasets_by_id'] = {ds['unique_id']: ds for ds in pc['datasets']}
-    # find some datasets assocated with project samples, but datasets not in project
-    for sid, s in pc['samples_by_id'].items():
-        for ds in s['datasets']:
-            if not ds['unique_id'] in pc['datasets_by_id']:
-                pc['datasets_by_id'][ds['unique_id']] = ds
-                pc['datasets'].append(ds)
+    add_sample_datasets(pc)
+    now = time.time()
+    pc['sync'] = dict(sync_high_water_mark(pc), synced_at=now, full_sync_at=now)
+    pc['snapshot_version'] = uuid.uuid4().hex
 
     # load scientific metadata (should now be handled via list_datasets include_metadata flag)
     # if include_metadata:
@@ -61,11 +87,207 @@ def generate_project_cache(project_id, crucible_client, include_metadata=True, s
     #     print('done')
     # save cache
     if save:
-        fname = cache_filename(project_id)
-        with open(fname,'w') as jsonf:
-            json.dump( pc, jsonf, indent=4)
+        project_snapshot_store(project_id, include_metadata).save(pc)
     return pc
 
+def sync_project_cache(pc, crucible_client, include_metadata=True, save=True, full=None):
+    """Returns a new project cache updated from an existing one, fetching metadata only for new or changed datasets
+
+    Sample and dataset listings (without metadata) are always re-read; scientific
+    metadata is carried over from pc for datasets that are neither newer than its
+    high-water mark nor modified since. Records without a modification time
+    (Crucible datasets only carry creation_time) are refetched by a full sync,
+    which re-lists all datasets with metadata: when `full` is True, when the last
+    full sync is older than FULL_SYNC_INTERVAL, or when more than METADATA_BATCH
+    datasets changed. pc itself is not modified.
+    """
+    project_id = pc['project_id']
+    hwm = pc.get('sync') or sync_high_water_mark(pc)
+    if full is None:
+        full = time.time() - (hwm.get('full_sync_at') or 0) >= FULL_SYNC_INTERVAL
+    print(f'syncing samples and datasets from Crucible {project_id=} {include_metadata=} {full=} since {hwm}')
+
+    new_pc = dict(project_id=project_id)
+    new_pc['samples'] = list_all(crucible_client.list_samples, project_id=project_id)
+
+    if not full:
+        new_pc['datasets'] = list_all(crucible_client.list_datasets, project_id=project_id, include_metadata=False)
+        changed = []
+        for ds in new_pc['datasets']:
+            old = pc['datasets_by_id'].get(ds['unique_id'])
+            if old is not None and not _is_newer(ds, hwm):
+                if 'scientific_metadata' in old:
+                    ds['scientific_metadata'] = old['scientific_metadata']
+            else:
+                changed.append(ds)
+        if include_metadata and len(changed) > METADATA_BATCH:
+            print(f'{project_id}: {len(changed)} new/changed datasets, re-listing all with metadata')
+            full = True
+        elif include_metadata:
+            fetch_dataset_metadata(changed, crucible_client)
+
+    if full:
+        new_pc['datasets'] = list_all(crucible_client.list_datasets, project_id=project_id,
+                                      include_metadata=include_metadata)
+        for ds in new_pc['datasets']:
+            fix_metadata_nesting(ds)
+        changed = [ds for ds in new_pc['datasets'] if pc['datasets_by_id'].get(ds['unique_id']) != ds]
+
+    index_project_cache(new_pc)
+    removed = set(pc['datasets_by_id']) - set(new_pc['datasets_by_id'])
+    unchanged = not changed and not removed and _listing_digest(pc) == _listing_digest(new_pc)
+    # keep the version when nothing changed so caches derived from this snapshot stay valid
+    new_pc['snapshot_version'] = pc.get('snapshot_version') if unchanged else uuid.uuid4().hex
+    # what changed since the previous version, so derived tables can be refreshed incrementally
+    now = time.time()
+    new_pc['sync'] = dict(sync_high_water_mark(new_pc), synced_at=now,
+                          full_sync_at=now if full else hwm.get('full_sync_at'),
+                          previous_version=pc.get('snapshot_version'),
+                          changed_datasets=[ds['unique_id'] for ds in changed],
+                          removed_datasets=sorted(removed))
+    print(f'{project_id}: {len(changed)} new/changed and {len(removed)} removed datasets')
+
+    if save:
+        project_snapshot_store(project_id, include_metadata).save(new_pc)
+    return new_pc
+
+def fetch_dataset_metadata(datasets, crucible_client):
+    """Fills in scientific_metadata of datasets (in place), fetched concurrently"""
+    def fetch(ds):
+        try:
+            full_ds = crucible_client.get_dataset(ds['unique_id'], include_metadata=True)
+            ds['scientific_metadata'] = full_ds.get('scientific_metadata')
+            fix_metadata_nesting(ds)
+        except Exception as err:
+            print(f"failed to get metadata for {ds['unique_id']}: {err}")
+
+    list(_page_executor.map(fetch, datasets))
+
+def paging_param(list_fn):
+    """PAGE_OFFSET_PARAM if list_fn accepts it (by name or through **kwargs), else None"""
+    try:
+        params = inspect.signature(list_fn).parameters
+    except (TypeError, ValueError):
+        return PAGE_OFFSET_PARAM
+    if PAGE_OFFSET_PARAM in params or any(p.kind == p.VAR_KEYWORD for p in params.values()):
+        return PAGE_OFFSET_PARAM
+    return None
+
+def iter_pages(list_fn, page_size=PAGE_SIZE, max_workers=PAGE_WORKERS, **kwargs):
+    """Yields pages of records from a Crucible list call, e.g. iter_pages(client.list_samples, project_id=...)
+
+    The first page is fetched alone; only when it comes back full are up to
+    max_workers pages requested ahead of the one being consumed. Stops at the
+    first short page. If list_fn takes no offset parameter, or a page repeats
+    records already seen (the API ignores the offset), the remaining records
+    come from one call with limit=UNPAGED_LIMIT instead, so a project is never
+    silently cut off at the page size.
+    """
+    name = getattr(list_fn, '__name__', 'list call')
+    offset_param = paging_param(list_fn)
+    seen = set()
+    if offset_param is None:
+        print(f"{name} takes no {PAGE_OFFSET_PARAM} parameter, listing without paging")
+        yield from _unpaged(list_fn, seen, **kwargs)
+        return
+
+    def fetch(page):
+        return list_fn(limit=page_size, **{offset_param: page * page_size}, **kwargs) or []
+
+    pending = deque()
+    page, next_page = 0, 1
+    records = fetch(0)
+    try:
+        while True:
+            new = [r for r in records if r['unique_id'] not in seen]
+            if len(new) < len(records):
+                print(f"ERROR: page {page} of {name}({kwargs}) repeats {len(records) - len(new)} records, "
+                      f"the API does not seem to honour {offset_param}; listing the rest without paging")
+                yield from _unpaged(list_fn, seen, **kwargs)
+                return
+            seen.update(r['unique_id'] for r in new)
+            if new:
+                yield new
+            if len(records) < page_size:
+                return
+            while len(pending) < max(max_workers, 1):
+                pending.append(_page_executor.submit(fetch, next_page))
+                next_page += 1
+            records = pending.popleft().result()
+            page += 1
+    finally:
+        for future in pending:
+            future.cancel()
+
+def _unpaged(list_fn, seen, **kwargs):
+    """The records of one list call with limit=UNPAGED_LIMIT that are not in seen"""
+    records = list_fn(limit=UNPAGED_LIMIT, **kwargs) or []
+    if len(records) >= UNPAGED_LIMIT:
+        print(f"ERROR: {getattr(list_fn, '__name__', 'list call')}({kwargs}) returned {len(records)} records, "
+              f"the CRUCIBLE_UNPAGED_LIMIT; the listing may be incomplete")
+    new = [r for r in records if r['unique_id'] not in seen]
+    seen.update(r['unique_id'] for r in new)
+    if new:
+        yield new
+
+def list_all(list_fn, **kwargs):
+    """All records of a paginated Crucible list call"""
+    records = []
+    for page in iter_pages(list_fn, **kwargs):
+        records.extend(page)
+    return records
+
+def index_project_cache(pc):
+    """Builds samples_by_id, samples_by_name and datasets_by_id for pc (in place)"""
+    pc['samples_by_id'] = {s['unique_id']:s for s in pc['samples']}
+    pc['samples_by_name'] = {s['sample_name']:s for s in pc['samples']}
+
+    pc['datasets_by_id'] = {ds['unique_id']: ds for ds in pc['datasets']}
+    return add_sample_datasets(pc)
+
+def add_sample_datasets(pc):
+    # find some datasets assocated with project samples, but datasets not in project
+    for sid, s in pc['samples_by_id'].items():
+        for ds in s['datasets']:
+            if not ds['unique_id'] in pc['datasets_by_id']:
+                pc['datasets_by_id'][ds['unique_id']] = ds
+                pc['datasets'].append(ds)
+    return pc
+
+def fix_metadata_nesting(ds):
+    if 'scientific_metadata' in ds:
+        if ds['scientific_metadata'] and 'scientific_metadata' in ds['scientific_metadata']:
+            ds['scientific_metadata'] = ds['scientific_metadata']['scientific_metadata']
+
+# record fields that may carry a last-modified timestamp
+MODIFIED_KEYS = ('modification_time', 'modified_at', 'updated_at', 'last_modified')
+
+def _modified(record):
+    for key in MODIFIED_KEYS:
+        if record.get(key):
+            return str(record[key])
+    return None
+
+def sync_high_water_mark(pc):
+    """Newest unique_id (mfids are time ordered) and latest modification time seen in pc"""
+    dataset_ids = [ds['unique_id'] for ds in pc['datasets']]
+    modified = [m for m in (_modified(r) for r in pc['samples'] + pc['datasets']) if m]
+    return dict(newest_sample_id=max((s['unique_id'] for s in pc['samples']), default=None),
+                newest_dataset_id=max(dataset_ids, default=None),
+                modified_at=max(modified, default=None))
+
+def _is_newer(record, hwm):
+    newest = hwm.get('newest_dataset_id')
+    if newest is None or record['unique_id'] > newest:
+        return True
+    modified = _modified(record)
+    return modified is not None and hwm.get('modified_at') is not None and modified > hwm['modified_at']
+
+def _listing_digest(pc):
+    listing = [pc['samples'],
+               [{k: v for k, v in ds.items() if k != 'scientific_metadata'} for ds in pc['datasets']]]
+    return hashlib.sha1(json.dumps(listing, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
 def generate_project_sample_graph(project_id, crucible_client):
     # Generate directed graph of sample relationships, using unique_id
     G = nx.DiGraph()
@@ -170,14 +392,21 @@ def load_sample_graph(project_id):
     G = nx.readwrite.json_graph.node_link_graph(node_link_data)
     return G
 
-def load_project_cache(project_id):
+def load_project_cache(project_id, include_metadata=True):
     """Loads existing project cache into dictionary"""
-    fname = cache_filename(project_id)
-    with open(fname, 'r') as jsonf:
-        pc = json.load(jsonf)
+    store = project_snapshot_store(project_id, include_metadata)
+    if not store.exists():
+        raise FileNotFoundError(store.path)
+    pc = store.load()
     #pc['sample_graph'] = nx.readwrite.json_graph.node_link_graph(pc['sample_graph_nodelink'])
     return pc
 
+def project_snapshot_store(project_id, include_metadata=True):
+    return ProjectSnapshotStore(cache_filename(project_id, include_metadata))
+
+def project_search_index(project_id):
+    return ProjectSearchIndex(search_index_filename(project_id))
+
 def load_project_sample_graph(project_id):
     """Returns a NetworkX directed graph object, G"""
     with open(cache_sample_graph_filename(project_id),'r') as jsonf:
@@ -192,10 +421,19 @@ def cache_sample_graph_filename(project_id):
     fname = f'cache/{proj_name}_project_sample_graph.json'
     return fname
 
-def cache_filename(project_id):
+def cache_filename(project_id, include_metadata=True):
     # clean up to make a filename
     fname = str(project_id)  
     fname = fname.replace('.','-')
     fname = fname.replace('/','-')
-    fname = f'cache/{fname}.json'
-    return fname
\ No newline at end of file
+    suffix = '' if include_metadata else '-nometa'
+    fname = f'cache/{fname}{suffix}.sqlite'
+    return fname
+
+def search_index_filename(project_id):
+    fname = str(project_id).replace('.','-').replace('/','-')
+    return f'cache/{fname}-search.sqlite'
+
+def legacy_cache_filename(project_id):
+    fname = str(project_id).replace('.','-').replace('/','-')
+    return f'cache/{fname}.json'
\ No newline at end of file
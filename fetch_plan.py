@@ -0,0 +1,91 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class FetchResults(dict):
+    """Values of a finished FetchPlan by step name; failed steps hold their default.
+
+    `errors` maps the names of failed, timed out or skipped steps to a message.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.errors = {}
+
+    def ok(self, name):
+        return name in self and name not in self.errors
+
+
+class FetchPlan:
+    """Named, mostly independent calls (e.g. to Crucible) run concurrently.
+
+    Steps are added with `add(name, fn, *args, requires=(...), **kwargs)`;
+    a step with requirements is started once they have finished and gets
+    their values as keyword arguments of the same name. Each step has its
+    own timeout: a step that fails or takes too long gets its default value
+    and an entry in `results.errors` (as do the steps depending on it),
+    so callers can render whatever did arrive.
+    """
+
+    def __init__(self, executor, timeout=15):
+        self.executor = executor
+        self.timeout = timeout
+        self.steps = {}
+
+    def add(self, name, fn, *args, requires=(), default=None, timeout=None, **kwargs):
+        self.steps[name] = dict(fn=fn, args=args, kwargs=kwargs, requires=tuple(requires),
+                                default=default, timeout=self.timeout if timeout is None else timeout)
+        return self
+
+    def run(self, *names):
+        """Run the named steps (and what they require), or all steps; returns FetchResults"""
+        results = FetchResults()
+        pending = {name: self.steps[name] for name in self._needed(names or self.steps)}
+        running = {}  # future -> (name, deadline)
+        while pending or running:
+            for name, step in list(pending.items()):
+                if not all(r in results for r in step['requires']):
+                    continue
+                del pending[name]
+                failed = [r for r in step['requires'] if r in results.errors]
+                if failed:
+                    self._fail(results, name, f"skipped, {', '.join(failed)} failed")
+                    continue
+                deps = {r: results[r] for r in step['requires']}
+                future = self.executor.submit(step['fn'], *step['args'], **step['kwargs'], **deps)
+                running[future] = (name, time.monotonic() + step['timeout'])
+            if not running:
+                break
+
+            next_deadline = min(deadline for _, deadline in running.values())
+            done, _ = wait(running, timeout=max(next_deadline - time.monotonic(), 0),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                name, _ = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as err:
+                    self._fail(results, name, f"{type(err).__name__}: {err}")
+            now = time.monotonic()
+            for future, (name, deadline) in list(running.items()):
+                if deadline <= now:
+                    # the call itself cannot be interrupted; stop waiting for it
+                    del running[future]
+                    future.cancel()
+                    self._fail(results, name, f"timed out after {self.steps[name]['timeout']}s")
+        return results
+
+    def _needed(self, names):
+        needed = []
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name not in needed:
+                needed.append(name)
+                stack.extend(self.steps[name]['requires'])
+        return needed
+
+    def _fail(self, results, name, message):
+        print(f"fetch {name} failed: {message}")
+        results[name] = self.steps[name]['default']
+        results.errors[name] = message
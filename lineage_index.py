@@ -0,0 +1,191 @@
+import hashlib
+import json
+from collections import deque
+from itertools import islice
+import networkx as nx
+
+
+def graph_version(node_link_data):
+    """Stable content hash of a node-link sample graph"""
+    payload = json.dumps(node_link_data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class ProjectLineageIndex:
+    """Indexed, read-only view of a project sample graph for fast lineage queries.
+
+    Sample ids are mapped to integers; successors and predecessors are kept
+    as integer adjacency lists alongside a topological order. Ancestor and descendant
+    sets are computed on first use as integer bitsets, reusing the closures of
+    parents/children already computed, and memoized, so repeated lineage
+    queries against the same graph version are dictionary lookups. The memo
+    is dropped whenever it grows past `max_memo_bytes`, and estimated_bytes()
+    counts it at that bound, so a cache sized with it stays within budget.
+    """
+
+    def __init__(self, G, version=None, max_memo_bytes=16 * 1024 * 1024):
+        self.graph = G
+        self.version = version
+        self.max_memo_bytes = max_memo_bytes
+        self.ids = list(G.nodes)
+        self.index = {sid: i for i, sid in enumerate(self.ids)}
+        self.succ = [[self.index[c] for c in G.successors(sid)] for sid in self.ids]
+        self.pred = [[self.index[p] for p in G.predecessors(sid)] for sid in self.ids]
+        self.n_edges = G.number_of_edges()
+        try:
+            self.topo_order = [self.index[sid] for sid in nx.topological_sort(G)]
+            self.is_dag = True
+        except nx.NetworkXUnfeasible:
+            print(f"sample graph {version} has cycles, lineage closures will not be memoized")
+            self.topo_order = None
+            self.is_dag = False
+        self._clear_memo()
+
+    @classmethod
+    def from_node_link(cls, node_link_data, version=None, **kwargs):
+        if version is None:
+            version = graph_version(node_link_data)
+        return cls(nx.node_link_graph(node_link_data), version=version, **kwargs)
+
+    def __contains__(self, sample_id):
+        return sample_id in self.index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def estimated_bytes(self):
+        """Rough size of the index, with its memo at the most it can grow to"""
+        n = len(self.ids)
+        # at most every sample's ancestor and descendant bitsets, and every (sample, relative) pair
+        full_memo = 2 * n * (n // 8 + 64) + n * n * 60
+        return 300 * n + 100 * self.n_edges + min(full_memo, self.max_memo_bytes)
+
+    def memo_bytes(self):
+        """Rough size of the memoized closures"""
+        bitsets = len(self._ancestor_bits) + len(self._descendant_bits)
+        return bitsets * (len(self.ids) // 8 + 64) + self._memo_items * 60
+
+    def ancestors(self, sample_id):
+        """frozenset of ids of all ancestors of sample_id (empty if not in the graph)"""
+        return self._closure(sample_id, self.pred, self._ancestor_bits, self._ancestors)
+
+    def descendants(self, sample_id):
+        """frozenset of ids of all descendants of sample_id (empty if not in the graph)"""
+        return self._closure(sample_id, self.succ, self._descendant_bits, self._descendants)
+
+    def lineage(self, sample_id):
+        """sample_id together with all of its ancestors and descendants"""
+        return self.ancestors(sample_id) | self.descendants(sample_id) | {sample_id}
+
+    def parents(self, sample_id):
+        """ids of the direct parents of sample_id"""
+        i = self.index.get(sample_id)
+        return [] if i is None else [self.ids[j] for j in self.pred[i]]
+
+    def children(self, sample_id):
+        """ids of the direct children of sample_id"""
+        i = self.index.get(sample_id)
+        return [] if i is None else [self.ids[j] for j in self.succ[i]]
+
+    def edges_within(self, sample_ids):
+        """(source, target) sample edges with both ends in sample_ids"""
+        members = {self.index[sid] for sid in sample_ids if sid in self.index}
+        ids = self.ids
+        return [(ids[i], ids[j]) for i in members for j in self.succ[i] if j in members]
+
+    def descendant_paths(self, sample_id):
+        """{descendant_id: [sample_id, ..., descendant_id]} along a shortest path to each descendant"""
+        return self._tree_paths(sample_id, self.succ, reverse=False)
+
+    def ancestor_paths(self, sample_id):
+        """{ancestor_id: [ancestor_id, ..., sample_id]} along a shortest path from each ancestor"""
+        return self._tree_paths(sample_id, self.pred, reverse=True)
+
+    def alternative_paths(self, source, target, k=3):
+        """Up to k distinct simple paths from source to target, shortest first"""
+        if source not in self.index or target not in self.index:
+            return []
+        between = (self.descendants(source) & self.ancestors(target)) | {source, target}
+        paths = nx.shortest_simple_paths(self.graph.subgraph(between), source, target)
+        try:
+            return list(islice(paths, k))
+        except nx.NetworkXNoPath:
+            return []
+
+    def _tree_paths(self, sample_id, adj, reverse):
+        # one BFS gives a shortest-path predecessor tree; each node's path extends its parent's
+        start = self.index.get(sample_id)
+        if start is None:
+            return {}
+        ids = self.ids
+        paths = {start: [sample_id]}
+        queue = deque([start])
+        while queue:
+            v = queue.popleft()
+            for u in adj[v]:
+                if u not in paths:
+                    paths[u] = paths[v] + [ids[u]]
+                    queue.append(u)
+        del paths[start]
+        if reverse:
+            return {ids[i]: path[::-1] for i, path in paths.items()}
+        return {ids[i]: path for i, path in paths.items()}
+
+    def _closure(self, sample_id, adj, bits_memo, set_memo):
+        i = self.index.get(sample_id)
+        if i is None:
+            return frozenset()
+        result = set_memo.get(i)
+        if result is None:
+            if self.is_dag:
+                bits = self._closure_bits(i, adj, bits_memo)
+            else:
+                bits = self._bfs_bits(i, adj)
+            result = frozenset(self._bits_to_ids(bits))
+            set_memo[i] = result
+            self._memo_items += len(result)
+            if self.memo_bytes() > self.max_memo_bytes:
+                self._clear_memo()
+        return result
+
+    def _clear_memo(self):
+        # new dicts rather than clear(), so closures being computed by other threads keep theirs
+        self._ancestor_bits, self._descendant_bits = {}, {}
+        self._ancestors, self._descendants = {}, {}
+        self._memo_items = 0
+
+    @staticmethod
+    def _closure_bits(start, adj, memo):
+        # post-order walk so every node's closure is built from its neighbours' (DAG only)
+        stack = [start]
+        while stack:
+            v = stack[-1]
+            if v in memo:
+                stack.pop()
+                continue
+            pending = [u for u in adj[v] if u not in memo]
+            if pending:
+                stack.extend(pending)
+                continue
+            bits = 0
+            for u in adj[v]:
+                bits |= memo[u] | (1 << u)
+            memo[v] = bits
+            stack.pop()
+        return memo[start]
+
+    @staticmethod
+    def _bfs_bits(start, adj):
+        bits = 0
+        queue = [start]
+        while queue:
+            v = queue.pop()
+            for u in adj[v]:
+                if not bits >> u & 1 and u != start:
+                    bits |= 1 << u
+                    queue.append(u)
+        return bits
+
+    def _bits_to_ids(self, bits):
+        ids = self.ids
+        return [ids[i] for i, bit in enumerate(reversed(bin(bits)[2:])) if bit == '1']
@@ -0,0 +1,96 @@
+from collections import defaultdict
+
+# sibling groups at least this large are collapsed into one summary node
+COLLAPSE_MIN_GROUP = 5
+
+
+class LineageView:
+    """Samples kept by compact_lineage, with what was left out.
+
+    `depths` maps kept sample ids to their generation relative to the focal
+    samples (ancestors negative), in breadth-first order. `groups` are the
+    collapsed sibling groups, each a dict of direction ('up' or 'down'),
+    anchor (the kept relative they hang off), key and members. `more` maps
+    kept samples to {'up': n, 'down': n} counts of relatives not shown
+    because of the depth limits or the node cap; `truncated` is set if the
+    node cap was hit.
+    """
+
+    def __init__(self):
+        self.depths = {}
+        self.groups = []
+        self.more = defaultdict(lambda: {'up': 0, 'down': 0})
+        self.truncated = False
+
+    def __len__(self):
+        return len(self.depths) + len(self.groups)
+
+
+def group_siblings(items, key, min_group=COLLAPSE_MIN_GROUP):
+    """Split items into those shown singly and {key: members} groups of at least min_group"""
+    by_key = defaultdict(list)
+    for item in items:
+        by_key[key(item)].append(item)
+    singles = []
+    groups = {}
+    for k, members in by_key.items():
+        if len(members) >= min_group:
+            groups[k] = members
+        else:
+            singles.extend(members)
+    return singles, groups
+
+
+def compact_lineage(lineage, focal_ids, group_key, depth_up=None, depth_down=None, max_nodes=None,
+                    collapse=False, min_group=COLLAPSE_MIN_GROUP):
+    """Ancestors and descendants of focal_ids, nearest generations first, as a LineageView
+
+    Generations are added alternately up and down until depth_up/depth_down
+    (None for no limit) or max_nodes (samples plus groups) is reached. With
+    collapse, the new relatives of one sample that share group_key(id)
+    (e.g. sample_type) are folded into a group once there are min_group of
+    them, and the walk does not continue past a folded group.
+    """
+    view = LineageView()
+    for sid in focal_ids:
+        view.depths[sid] = 0
+    folded = set()
+    frontier = {'up': list(view.depths), 'down': list(view.depths)}
+    limits = {'up': depth_up, 'down': depth_down}
+    steps = {'up': lineage.parents, 'down': lineage.children}
+    depth = 0
+    while frontier['up'] or frontier['down']:
+        depth += 1
+        for direction in ('up', 'down'):
+            current, frontier[direction] = frontier[direction], []
+            limit = limits[direction]
+            found = {}  # relative -> the sample it was reached from
+            for sid in current:
+                for rel in steps[direction](sid):
+                    if rel in view.depths or rel in folded or rel in found:
+                        continue
+                    if (limit is not None and depth > limit) or view.truncated:
+                        view.more[sid][direction] += 1
+                    else:
+                        found[rel] = sid
+            by_via = defaultdict(list)
+            for rel, via in found.items():
+                by_via[via].append(rel)
+            for via, relatives in by_via.items():
+                if collapse:
+                    relatives, groups = group_siblings(relatives, group_key, min_group)
+                    for k, members in groups.items():
+                        if max_nodes is not None and len(view) >= max_nodes:
+                            view.truncated = True
+                            view.more[via][direction] += len(members)
+                            continue
+                        view.groups.append(dict(direction=direction, anchor=via, key=k, members=members))
+                        folded.update(members)
+                for rel in relatives:
+                    if max_nodes is not None and len(view) >= max_nodes:
+                        view.truncated = True
+                        view.more[via][direction] += 1
+                        continue
+                    view.depths[rel] = depth if direction == 'down' else -depth
+                    frontier[direction].append(rel)
+    return view
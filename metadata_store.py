@@ -0,0 +1,253 @@
+import fnmatch
+import json
+import threading
+import numpy
+from search_index import flatten_metadata, parse_query
+
+# text columns report this many most common values in summaries and aggregates
+_TOP_VALUES = 10
+
+
+class Column:
+    """One flattened metadata key of a measurement: float64 values (NaN where missing) or text"""
+
+    def __init__(self, key, n, cells):
+        self.key = key
+        self.present = numpy.zeros(n, dtype=bool)
+        self.present[list(cells)] = True
+        numbers = {i: _number(v) for i, v in cells.items()}
+        if all(x is not None for x in numbers.values()):
+            self.kind = 'number'
+            self.values = numpy.full(n, numpy.nan)
+            self.values[list(numbers)] = list(numbers.values())
+        else:
+            self.kind = 'text'
+            self.values = numpy.full(n, None, dtype=object)
+            for i, v in cells.items():
+                self.values[i] = _text(v)
+            self.lower = numpy.array([v.lower() if v is not None else None for v in self.values], dtype=object)
+
+    def python(self, i):
+        if not self.present[i]:
+            return None
+        value = self.values[i]
+        if self.kind == 'number':
+            return int(value) if float(value).is_integer() else float(value)
+        return value
+
+    def mask(self, op, value):
+        """Boolean mask of the rows matching `<key> <op> <value>`"""
+        if value == '*' and op in (':', '='):
+            return self.present.copy()
+        if self.kind == 'number':
+            low, high = _range(value)
+            if low is not None:
+                return self.present & (self.values >= low) & (self.values <= high)
+            number = _number(value)
+            if number is None:
+                raise ValueError(f"{self.key} is numeric, cannot compare it with {value!r}")
+            with numpy.errstate(invalid='ignore'):
+                result = {':': self.values == number, '=': self.values == number, '!=': self.values != number,
+                          '<': self.values < number, '<=': self.values <= number,
+                          '>': self.values > number, '>=': self.values >= number}[op]
+            return result & self.present
+        if op in ('<', '<=', '>', '>='):
+            raise ValueError(f"{self.key} is text, use : or != to compare it")
+        pattern = value.lower()
+        if '*' in pattern:
+            matched = numpy.array([v is not None and fnmatch.fnmatchcase(v, pattern) for v in self.lower])
+        else:
+            matched = self.lower == pattern
+        matched = matched.astype(bool) & self.present
+        return self.present & ~matched if op == '!=' else matched
+
+    def summary(self, rows=None):
+        """Count plus min/max/mean (numbers) or the most common values (text) over rows"""
+        present = self.present if rows is None else self.present & rows
+        values = self.values[present]
+        summary = {'key': self.key, 'type': self.kind, 'count': int(present.sum())}
+        if self.kind == 'number':
+            if len(values):
+                summary.update(min=_plain(values.min()), max=_plain(values.max()),
+                               mean=float(values.mean()), sum=_plain(values.sum()))
+        else:
+            distinct, counts = numpy.unique(values.astype(str), return_counts=True) if len(values) else ([], [])
+            order = numpy.argsort(-numpy.asarray(counts), kind='stable')[:_TOP_VALUES]
+            summary.update(distinct=len(distinct), top=[[str(distinct[i]), int(counts[i])] for i in order])
+        return summary
+
+
+class MeasurementTable:
+    """Flattened scientific_metadata of one measurement's datasets, one Column per dotted key"""
+
+    def __init__(self, measurement, datasets):
+        self.measurement = measurement
+        self.ids = numpy.array([d['unique_id'] for d in datasets], dtype=object)
+        self.names = numpy.array([d.get('dataset_name') or '' for d in datasets], dtype=object)
+        cells = {}  # key -> {row: value}
+        for i, d in enumerate(datasets):
+            for key, value in flatten_metadata(d.get('scientific_metadata') or {}):
+                cells.setdefault(key, {})[i] = value
+        self.columns = {key: Column(key, len(datasets), values) for key, values in sorted(cells.items())}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def column(self, key):
+        """Column by full dotted key, or by its last component(s) if that is unambiguous"""
+        if key in self.columns:
+            return self.columns[key]
+        candidates = [k for k in self.columns if k.endswith('.' + key)]
+        if len(candidates) == 1:
+            return self.columns[candidates[0]]
+        if candidates:
+            raise ValueError(f"{key!r} is ambiguous in {self.measurement}: {', '.join(candidates[:10])}")
+        raise ValueError(f"no metadata field {key!r} in {self.measurement}")
+
+    def select(self, filters):
+        """Boolean mask of the rows matching all (key, op, value) filters
+
+        `name` and `id` filter on the dataset itself unless they are metadata keys.
+        """
+        rows = numpy.ones(len(self), dtype=bool)
+        for key, op, value in filters:
+            if key in ('name', 'id') and key not in self.columns:
+                target = self.names if key == 'name' else self.ids
+                matched = numpy.array([fnmatch.fnmatchcase(v.lower(), value.lower()) for v in target], dtype=bool)
+                rows &= ~matched if op == '!=' else matched
+            else:
+                rows &= self.column(key).mask(op, value)
+        return rows
+
+
+class MetadataStore:
+    """Columnar scientific_metadata of a project snapshot, per measurement type.
+
+    Each measurement's metadata is flattened to dotted keys and stored as
+    typed NumPy columns (built on first use), so filters like
+    `heater_sv_temp:100..150` or `recipe.speed>=3000` and aggregates are
+    vectorized instead of walking each dataset's nested dict.
+    """
+
+    def __init__(self, pc):
+        self.version = pc.get('snapshot_version')
+        self.datasets = {}
+        for d in pc.get('datasets', []):
+            self.datasets.setdefault(d.get('measurement') or '', []).append(d)
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def measurements(self):
+        """{measurement: number of datasets}"""
+        return {m: len(ds) for m, ds in sorted(self.datasets.items())}
+
+    def table(self, measurement):
+        if measurement not in self.datasets:
+            raise ValueError(f"no datasets with measurement {measurement!r}")
+        with self.lock:
+            table = self.tables.get(measurement)
+            if table is None:
+                table = MeasurementTable(measurement, self.datasets[measurement])
+                self.tables[measurement] = table
+            return table
+
+    def describe(self, measurement):
+        """Summary of every metadata field of the measurement"""
+        table = self.table(measurement)
+        return {'measurement': measurement, 'datasets': len(table),
+                'fields': [column.summary() for column in table.columns.values()]}
+
+    def query(self, measurement, filters=(), fields=None, sort=None, descending=False, page=1, per_page=50):
+        """One page of the datasets matching filters, with the requested fields (default: the filtered ones)"""
+        table = self.table(measurement)
+        filters = parse_filters(filters)
+        rows = numpy.flatnonzero(table.select(filters))
+        if fields is None:
+            fields = list(dict.fromkeys(key for key, _, _ in filters
+                                        if key in table.columns or key not in ('name', 'id')))
+        columns = [table.column(key) for key in fields]
+        if sort:
+            column = table.column(sort)
+            keys = column.values[rows]
+            if column.kind == 'text':
+                keys = numpy.array(['' if v is None else v for v in keys], dtype=object)
+            order = numpy.argsort(keys, kind='stable')
+            if descending:
+                order = order[::-1]
+            rows = rows[order]
+        else:
+            rows = rows[numpy.argsort(table.names[rows], kind='stable')]
+        total = len(rows)
+        page = max(page, 1)
+        start = (page - 1) * per_page
+        results = [{'id': table.ids[i], 'name': table.names[i],
+                    'values': {column.key: column.python(i) for column in columns}}
+                   for i in rows[start:start + per_page]]
+        return {'measurement': measurement, 'total': total, 'page': page, 'per_page': per_page,
+                'next_page': page + 1 if start + per_page < total else None,
+                'fields': [column.key for column in columns], 'results': results}
+
+    def aggregate(self, measurement, field, filters=(), group_by=None, limit=50):
+        """Summary of field over the datasets matching filters, overall or per value of group_by"""
+        table = self.table(measurement)
+        rows = table.select(parse_filters(filters))
+        column = table.column(field)
+        result = {'measurement': measurement, 'matched': int(rows.sum()), 'aggregate': column.summary(rows)}
+        if group_by:
+            group_column = table.column(group_by)
+            keys = numpy.array([str(group_column.python(i)) for i in range(len(table))], dtype=object)
+            keys[~group_column.present] = ''
+            groups = []
+            for key in numpy.unique(keys[rows]):
+                summary = column.summary(rows & (keys == key))
+                groups.append(dict(summary, group=key or None))
+            groups.sort(key=lambda g: -g['count'])
+            result.update(group_by=group_column.key, groups=groups[:limit], group_count=len(groups))
+        return result
+
+
+def parse_filters(filters):
+    """(key, op, value) filters from strings like 'heater_sv_temp:100..150' (as in search queries)"""
+    if isinstance(filters, str):
+        filters = [filters]
+    parsed = []
+    for f in filters:
+        if isinstance(f, (tuple, list)):
+            parsed.append(tuple(f))
+            continue
+        terms, found = parse_query(f)
+        if terms:
+            raise ValueError(f"not a filter: {' '.join(terms)!r} (use key:value, key>=number or key:low..high)")
+        parsed.extend(found)
+    return parsed
+
+
+def _number(value):
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if numpy.isfinite(number) else None
+
+
+def _text(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def _range(value):
+    low, sep, high = value.partition('..')
+    if not sep:
+        return None, None
+    low, high = _number(low) if low else -numpy.inf, _number(high) if high else numpy.inf
+    if low is None or high is None:
+        raise ValueError(f"invalid range {value!r}")
+    return low, high
+
+
+def _plain(x):
+    x = float(x)
+    return int(x) if x.is_integer() else x
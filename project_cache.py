@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from single_flight import SingleFlight
+
+
+def estimate_size(value):
+    """Rough size in bytes of a JSON-like value (its compact JSON encoding)"""
+    try:
+        return len(json.dumps(value, separators=(',', ':'), default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def estimate_snapshot_size(pc, sample=32):
+    """Rough size in bytes of a project snapshot: its record counts times the encoded size of a few records
+
+    Cheap enough to run on every put, unlike encoding the whole snapshot.
+    """
+    size = 0
+    for key in ('samples', 'datasets'):
+        records = pc.get(key) or []
+        if records:
+            picked = records[::max(len(records) // sample, 1)][:sample]
+            size += len(records) * sum(estimate_size(r) for r in picked) // len(picked)
+    return size
+
+
+class SnapshotCache:
+    """In-process cache of loaded snapshots (e.g. project dicts).
+
+    Entries are loaded with `loader(key)` and are fresh for `ttl` seconds.
+    After that they are stale: the old value is still returned while a
+    background thread reloads it (stale-while-revalidate), so only a cold
+    miss blocks on the loader. Total size is bounded by `max_bytes`;
+    least recently used entries are evicted first.
+
+    An optional `warm(key)` returning (value, loaded_at) or None is tried
+    before the loader on a cold miss, e.g. to start from an on-disk snapshot.
+
+    Loads go through `single_flight` (keyed by (name, key)), so threads
+    missing the same key at the same time wait for one load instead of
+    each calling the loader; pass one SingleFlight to several caches to
+    report their suppressed loads together.
+    """
+
+    def __init__(self, loader, ttl=300, max_bytes=512 * 1024 * 1024, sizeof=estimate_size, name='cache',
+                 warm=None, single_flight=None):
+        self.loader = loader
+        self.single_flight = single_flight if single_flight is not None else SingleFlight()
+        self.warm = warm
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.name = name
+        self._entries = OrderedDict()  # key -> dict(value, size, loaded_at)
+        self._refreshing = set()
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def get(self, key):
+        """Return the cached value for key, loading it on a cold miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if self._is_fresh(entry):
+                    self.hits += 1
+                else:
+                    self.stale_hits += 1
+                    self._refresh_in_background(key)
+                return entry['value']
+            self.misses += 1
+        return self.single_flight.do((self.name, key), self._load_missing, key, resource=self.name)
+
+    def peek(self, key, allow_stale=False):
+        """Return the cached value for key without loading; None if missing (or stale)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (allow_stale or self._is_fresh(entry)):
+                self._entries.move_to_end(key)
+                return entry['value']
+        return None
+
+    def put(self, key, value, loaded_at=None):
+        size = self.sizeof(value)
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                print(f"{self.name}: not caching {key}, {size} bytes exceeds limit of {self.max_bytes}")
+                return
+            self._entries[key] = dict(value=value, size=size,
+                                      loaded_at=time.time() if loaded_at is None else loaded_at)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                old_key, _ = next(iter(self._entries.items()))
+                print(f"{self.name}: evicting {old_key}")
+                self._discard(old_key)
+
+    def invalidate(self, project_id=None):
+        """Drop entries for project_id (keys equal to it or tuples starting with it), or everything"""
+        with self._lock:
+            for key in list(self._entries):
+                if project_id is None or key == project_id or \
+                        (isinstance(key, tuple) and key and key[0] == project_id):
+                    self._discard(key)
+
+    def stats(self):
+        coalesced = self.single_flight.stats()['by_resource'].get(self.name, {}).get('suppressed', 0)
+        with self._lock:
+            return dict(name=self.name, entries=len(self._entries), bytes=self.total_bytes,
+                        max_bytes=self.max_bytes, ttl=self.ttl, hits=self.hits,
+                        stale_hits=self.stale_hits, misses=self.misses, coalesced=coalesced)
+
+    def _load_missing(self, key):
+        # loaded by the flight that finished between this caller's miss and its own flight
+        value = self.peek(key, allow_stale=True)
+        if value is not None:
+            return value
+
+        if self.warm is not None:
+            warmed = self.warm(key)
+            if warmed is not None:
+                value, loaded_at = warmed
+                self.put(key, value, loaded_at=loaded_at)
+                if time.time() - loaded_at >= self.ttl:
+                    with self._lock:
+                        self._refresh_in_background(key)
+                return value
+
+        return self._reload(key)
+
+    def _reload(self, key):
+        value = self.loader(key)
+        self.put(key, value)
+        return value
+
+    def _is_fresh(self, entry):
+        return time.time() - entry['loaded_at'] < self.ttl
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry['size']
+
+    def _refresh_in_background(self, key):
+        # caller holds the lock
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        thread = threading.Thread(target=self._refresh, args=(key,), daemon=True,
+                                  name=f"{self.name}-refresh")
+        thread.start()
+
+    def _refresh(self, key):
+        try:
+            # not through single_flight: a refresh started by a warm load would join that load
+            self._reload(key)
+        except Exception as err:
+            print(f"{self.name}: background refresh of {key} failed, serving stale copy: {err}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
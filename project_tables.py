@@ -0,0 +1,87 @@
+import io
+import pandas
+
+
+class ProjectTables:
+    """Flat pandas tables of a project snapshot, for batched joins instead of per-sample loops.
+
+    samples:          unique_id, sample_name, sample_type
+    datasets:         unique_id, dataset_name, measurement, scientific_metadata
+    sample_datasets:  sample_id, dataset_id, measurement, position (order within the sample)
+    ancestors:        sample_id, ancestor_id (the transitive closure of the sample graph)
+
+    Given the tables of the previous snapshot, `changed_samples` is the set
+    of samples whose listing, dataset links or dataset metadata changed
+    since (None if that is unknown, e.g. after a full reload or a change of
+    the sample graph) and `previous_version` is the version they were diffed against.
+    """
+
+    def __init__(self, pc, lineage, previous=None):
+        self.version = (pc.get('snapshot_version'), lineage.version)
+        self.samples = pandas.DataFrame(
+            [(s['unique_id'], s.get('sample_name', ''), s.get('sample_type') or '') for s in pc['samples']],
+            columns=['unique_id', 'sample_name', 'sample_type'])
+        self.datasets = pandas.DataFrame(
+            [(d['unique_id'], d.get('dataset_name', ''), d.get('measurement') or '', d.get('scientific_metadata'))
+             for d in pc['datasets']],
+            columns=['unique_id', 'dataset_name', 'measurement', 'scientific_metadata'])
+        self.sample_datasets = pandas.DataFrame(
+            [(s['unique_id'], d['unique_id'], d.get('measurement') or '', i)
+             for s in pc['samples'] for i, d in enumerate(s.get('datasets', []))],
+            columns=['sample_id', 'dataset_id', 'measurement', 'position'])
+        self.ancestors = pandas.DataFrame(
+            [(s['unique_id'], a) for s in pc['samples'] for a in lineage.ancestors(s['unique_id'])],
+            columns=['sample_id', 'ancestor_id'])
+        self.previous_version = previous.version if previous is not None else None
+        self.changed_samples = self._changed_samples(pc.get('sync') or {}, previous)
+
+    def _changed_samples(self, sync, previous):
+        if (previous is None or previous.version[1] != self.version[1]
+                or previous.version[0] is None or sync.get('previous_version') != previous.version[0]):
+            return None
+        changed_datasets = set(sync.get('changed_datasets', ())) | set(sync.get('removed_datasets', ()))
+        changed = set()
+        for old, new in ((previous.samples, self.samples), (previous.sample_datasets, self.sample_datasets)):
+            rows = pandas.concat([old, new]).drop_duplicates(keep=False)
+            changed.update(rows.iloc[:, 0])
+        for links in (previous.sample_datasets, self.sample_datasets):
+            changed.update(links.loc[links['dataset_id'].isin(changed_datasets), 'sample_id'])
+        return changed
+
+    def descendants_of(self, sample_ids):
+        """ids of samples with an ancestor in sample_ids"""
+        ancestors = self.ancestors
+        return set(ancestors.loc[ancestors['ancestor_id'].isin(sample_ids), 'sample_id'])
+
+
+def metadata_field(metadata, field):
+    """Values of one scientific_metadata field, by dotted key as in flatten_metadata (None where missing)"""
+    path = field.split('.')
+
+    def lookup(m):
+        for key in path:
+            if not isinstance(m, dict):
+                return None
+            m = m.get(key)
+        return m
+    # built as object, not with map(), which would turn ints into floats once a value is missing
+    return pandas.Series([lookup(m) for m in metadata], index=metadata.index, dtype=object)
+
+
+def dataframe_bytes(df, fmt):
+    """df as CSV or Parquet bytes; Parquet needs the optional pyarrow package"""
+    if fmt == 'csv':
+        return df.to_csv(index=False).encode('utf-8')
+    buffer = io.BytesIO()
+    _parquet_safe(df).to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def _parquet_safe(df):
+    # Parquet columns have one type: columns mixing e.g. numbers and '?' are written as strings
+    df = df.copy()
+    for column in df.columns[df.dtypes == object]:
+        types = {type(v) for v in df[column] if v is not None}
+        if len(types) > 1:
+            df[column] = df[column].map(lambda v: None if v is None else str(v))
+    return df
@@ -0,0 +1,7 @@
+"""Declarative per-project tabular views, materialized from ProjectTables and cached per snapshot
+
+Views are declared (and registered) in one module per project, imported below.
+"""
+from project_views.engine import VIEWS, Join, ProjectView, MaterializedView, ViewStore, \
+    register, views_for, get_view
+from project_views import proj10k_perovskite_views
@@ -0,0 +1,194 @@
+import threading
+import pandas
+from project_tables import metadata_field
+
+# project_id -> {view name: ProjectView}
+VIEWS = {}
+
+
+def register(view):
+    """Adds view to the registry of its project; returns it"""
+    VIEWS.setdefault(view.project_id, {})[view.name] = view
+    return view
+
+
+def views_for(project_id):
+    return list(VIEWS.get(project_id, {}).values())
+
+
+def get_view(project_id, name):
+    return VIEWS.get(project_id, {}).get(name)
+
+
+class Join:
+    """Columns taken from the datasets of one measurement of a sample or its ancestors.
+
+    source='self' uses the row's own sample, source='ancestors' its
+    ancestors (only those whose name starts with source_prefix, if given).
+    Each column in `names` takes one matching dataset, in order of
+    (source sample id, position in the sample's dataset list): its
+    scientific_metadata `field` (a dotted key), or its unique_id if field
+    is None. Rows without a matching dataset get `default`.
+    """
+
+    def __init__(self, names, measurement, field=None, source='self', source_prefix=None, default=None):
+        if source not in ('self', 'ancestors'):
+            raise ValueError(f"unknown join source {source!r}")
+        self.names = [names] if isinstance(names, str) else list(names)
+        self.measurement = measurement
+        self.field = field
+        self.source = source
+        self.source_prefix = source_prefix
+        self.default = default
+
+    def compute(self, tables, sample_ids):
+        """DataFrame of the join's columns indexed by sample id (only samples with a match)"""
+        if self.source == 'self':
+            links = pandas.DataFrame({'row_id': sample_ids, 'source_id': sample_ids})
+        else:
+            ancestors = tables.ancestors[tables.ancestors['sample_id'].isin(sample_ids)]
+            if self.source_prefix:
+                samples = tables.samples
+                prefixed = samples.loc[samples['sample_name'].str.startswith(self.source_prefix), 'unique_id']
+                ancestors = ancestors[ancestors['ancestor_id'].isin(prefixed)]
+            links = ancestors.rename(columns={'sample_id': 'row_id', 'ancestor_id': 'source_id'})
+
+        sample_datasets = tables.sample_datasets[tables.sample_datasets['measurement'] == self.measurement]
+        rows = links.merge(sample_datasets, left_on='source_id', right_on='sample_id')
+        if self.field is None:
+            rows['value'] = rows['dataset_id']
+        else:
+            rows = rows.merge(tables.datasets[['unique_id', 'scientific_metadata']],
+                              left_on='dataset_id', right_on='unique_id')
+            rows['value'] = metadata_field(rows['scientific_metadata'], self.field)
+        rows = rows.sort_values(['row_id', 'source_id', 'position'])
+        rows['slot'] = rows.groupby('row_id').cumcount()
+        rows = rows[rows['slot'] < len(self.names)]
+
+        # one column per slot, as Python objects so missing values stay None
+        columns = {}
+        for slot, name in enumerate(self.names):
+            in_slot = rows[rows['slot'] == slot]
+            columns[name] = pandas.Series(list(in_slot['value']), index=list(in_slot['row_id']), dtype=object)
+        return pandas.DataFrame(columns, dtype=object)
+
+
+class ProjectView:
+    """Declarative tabular view of a project: one row per sample named with `sample_prefix`.
+
+    Rows are sorted by sample name; their first columns are the sample's
+    name and unique_id (as `name_column` and `id_column`), followed by the
+    columns of each Join, e.g.
+
+        ProjectView('overview', '10k_perovskites', 'Thin films', 'TF', joins=[
+            Join(['sp_A', 'sp_B'], 'Solid Precursor synthesis', 'name', source='ancestors', source_prefix='SP'),
+            Join('anneal_temp', 'spin_run', 'heater_sv_temp', default='?')])
+    """
+
+    def __init__(self, name, project_id, title, sample_prefix, joins=(), description='',
+                 name_column='sample_name', id_column='unique_id'):
+        self.name = name
+        self.project_id = project_id
+        self.title = title
+        self.sample_prefix = sample_prefix
+        self.joins = list(joins)
+        self.description = description
+        self.name_column = name_column
+        self.id_column = id_column
+
+    @property
+    def columns(self):
+        return [self.name_column, self.id_column] + [name for join in self.joins for name in join.names]
+
+    def materialize(self, tables, sample_ids=None):
+        """The view's rows as a DataFrame, only for sample_ids if given"""
+        samples = tables.samples
+        rows = samples[samples['sample_name'].str.startswith(self.sample_prefix)]
+        if sample_ids is not None:
+            rows = rows[rows['unique_id'].isin(sample_ids)]
+        rows = rows.sort_values('sample_name', kind='stable')
+        df = pandas.DataFrame({self.name_column: rows['sample_name'].values,
+                               self.id_column: rows['unique_id'].values})
+        for join in self.joins:
+            values = join.compute(tables, df[self.id_column])
+            for name in join.names:
+                column = df[self.id_column].map(values[name]).astype(object)
+                matched = df[self.id_column].isin(values[name].index)
+                df[name] = column.where(matched, join.default).where(column.notna() | ~matched, None)
+        return df
+
+
+class MaterializedView:
+    """A view's rows for one version of the project tables"""
+
+    def __init__(self, view, version, df):
+        self.view = view
+        self.version = version
+        self.df = df
+        self._html = None
+
+    @property
+    def html(self):
+        if self._html is None:
+            self._html = self.df.to_html()
+        return self._html
+
+    def page(self, page=1, per_page=100):
+        """One page of rows as a dict for the JSON API"""
+        total = len(self.df)
+        page = max(page, 1)
+        start = (page - 1) * per_page
+        rows = self.df.iloc[start:start + per_page]
+        return {
+            'view': self.view.name,
+            'title': self.view.title,
+            'columns': list(self.df.columns),
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'next_page': page + 1 if start + per_page < total else None,
+            'rows': rows.to_dict('records'),
+        }
+
+
+class ViewStore:
+    """Materialized views by (project_id, view name), kept until the project tables change.
+
+    When the tables of the next snapshot know which samples changed since
+    the cached version, only rows of those samples and their descendants
+    are recomputed; otherwise the whole view is.
+    """
+
+    def __init__(self):
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def get(self, view, tables):
+        key = (view.project_id, view.name)
+        with self.lock:
+            cached = self.views.get(key)
+            if cached is not None and cached.version == tables.version and tables.version[0] is not None:
+                return cached
+            if (cached is not None and tables.changed_samples is not None
+                    and cached.version == tables.previous_version):
+                df = self._refresh(view, cached.df, tables)
+            else:
+                df = view.materialize(tables)
+            cached = MaterializedView(view, tables.version, df)
+            self.views[key] = cached
+            return cached
+
+    def invalidate(self, project_id):
+        with self.lock:
+            for key in [key for key in self.views if key[0] == project_id]:
+                del self.views[key]
+
+    @staticmethod
+    def _refresh(view, df, tables):
+        changed = tables.changed_samples
+        if not changed:
+            return df
+        affected = changed | tables.descendants_of(changed)
+        kept = df[~df[view.id_column].isin(affected)]
+        merged = pandas.concat([kept, view.materialize(tables, affected)], ignore_index=True)
+        return merged.sort_values(view.name_column, kind='stable').reset_index(drop=True)
@@ -0,0 +1,19 @@
+from project_views.engine import ProjectView, Join, register
+
+project_id = "10k_perovskites"
+
+overview = register(ProjectView(
+    'overview', project_id, 'Thin Film Table', 'TF',
+    description="Thin films with the materials of their solid precursors and the spin-run anneal temperature",
+    name_column='thin_film_sample_name', id_column='thin_film_unique_id',
+    joins=[
+        Join(['sp_A', 'sp_B'], 'Solid Precursor synthesis', 'name', source='ancestors', source_prefix='SP'),
+        Join('anneal_temp', 'spin_run', 'heater_sv_temp', default='?'),
+    ]))
+
+thin_film_images = register(ProjectView(
+    'thin-film-images', project_id, 'Thin Film Images', 'TF',
+    description="Thin films with their first sample well image dataset",
+    joins=[
+        Join('image_dataset_id', 'sample well image'),
+    ]))
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import re
+import shlex
+import sqlite3
+from contextlib import closing
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS docs (doc INTEGER PRIMARY KEY, kind TEXT NOT NULL, unique_id TEXT NOT NULL UNIQUE,
+                                 name TEXT NOT NULL, type TEXT NOT NULL, digest TEXT NOT NULL);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(name, unique_id, type, description, metadata,
+                                                       tokenize = "trigram");
+CREATE TABLE IF NOT EXISTS fields (doc INTEGER NOT NULL, key TEXT NOT NULL, leaf TEXT NOT NULL,
+                                   text_value TEXT COLLATE NOCASE, num_value REAL);
+CREATE INDEX IF NOT EXISTS fields_leaf ON fields (leaf, num_value);
+CREATE INDEX IF NOT EXISTS fields_key ON fields (key, num_value);
+CREATE INDEX IF NOT EXISTS fields_doc ON fields (doc);
+"""
+
+# bumped when the stored layout changes, so existing index files are rebuilt
+# (2: metadata keys stored lowercased, as query fields are; 3: trigram tokens, unique_id searchable)
+_FORMAT = 3
+
+# bm25 column weights: name, unique_id, type, description, metadata
+_RANK = "bm25(docs_fts, 10.0, 8.0, 4.0, 2.0, 1.0)"
+_TEXT_COLUMNS = ('name', 'unique_id', 'type', 'description', 'metadata')
+
+# query fields that filter on the document itself rather than on metadata keys
+_DOC_FIELDS = {'kind': 'kind', 'name': 'name', 'id': 'unique_id', 'type': 'type',
+               'measurement': 'type', 'sample_type': 'type'}
+
+_FILTER = re.compile(r'^([^\s:<>=!]+)(:|>=|<=|!=|>|<|=)(.+)$')
+_NUMERIC_OPS = {'>': '>', '<': '<', '>=': '>=', '<=': '<='}
+
+
+def flatten_metadata(obj, path=''):
+    """Recursively flatten a nested dict to ('dotted.key', value) pairs"""
+    items = []
+    if not isinstance(obj, dict):
+        return items
+    for key, val in obj.items():
+        full_path = f"{path}.{key}" if path else key
+        if isinstance(val, dict):
+            items.extend(flatten_metadata(val, full_path))
+        else:
+            items.append((full_path, val))
+    return items
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _documents(pc):
+    """(kind, unique_id, name, type, description, metadata pairs) for every sample and dataset"""
+    for s in pc.get('samples', []):
+        yield ('sample', s['unique_id'], s.get('sample_name') or '', s.get('sample_type') or '',
+               s.get('description') or '', [])
+    for d in pc.get('datasets', []):
+        yield ('dataset', d['unique_id'], d.get('dataset_name') or '', d.get('measurement') or '', '',
+               flatten_metadata(d.get('scientific_metadata') or {}))
+
+
+def _digest(doc):
+    payload = json.dumps(doc, separators=(',', ':'), default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class ProjectSearchIndex:
+    """Per-project full-text and field index in a SQLite (FTS5) file.
+
+    Samples and datasets are indexed by name, type (sample_type or
+    measurement), description and flattened scientific metadata. Metadata
+    values are also kept per key, with numeric values parsed, for field
+    filters. `update(pc)` only rewrites documents whose indexed content
+    changed since the last snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def version(self):
+        """snapshot_version of the project cache the index was last updated from (None if outdated)"""
+        if not os.path.exists(self.path):
+            return None
+        with closing(self._connect()) as conn:
+            try:
+                meta = dict(conn.execute("SELECT key, value FROM meta"))
+            except sqlite3.OperationalError:
+                return None
+        if 'snapshot_version' not in meta or json.loads(meta.get('format', 'null')) != _FORMAT:
+            return None
+        return json.loads(meta['snapshot_version'])
+
+    def update(self, pc):
+        """Bring the index in line with project cache pc; returns (added/changed, removed) counts"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+            row = conn.execute("SELECT value FROM meta WHERE key = 'format'").fetchone()
+            if row is None or json.loads(row[0]) != _FORMAT:
+                # written by an older version: start over with the current tables
+                conn.executescript("DROP TABLE docs; DROP TABLE docs_fts; DROP TABLE fields; DELETE FROM meta;")
+                conn.executescript(_SCHEMA)
+                with conn:
+                    conn.execute("INSERT INTO meta (key, value) VALUES ('format', ?)", (json.dumps(_FORMAT),))
+            existing = {uid: (doc, digest) for doc, uid, digest in
+                        conn.execute("SELECT doc, unique_id, digest FROM docs")}
+            changed = 0
+            seen = set()
+            with conn:
+                for kind, uid, name, type_, description, metadata in _documents(pc):
+                    seen.add(uid)
+                    digest = _digest((kind, name, type_, description, metadata))
+                    doc, old_digest = existing.get(uid, (None, None))
+                    if digest == old_digest:
+                        continue
+                    if doc is not None:
+                        self._delete(conn, doc)
+                    self._insert(conn, kind, uid, name, type_, description, metadata, digest)
+                    changed += 1
+                removed = [doc for uid, (doc, _) in existing.items() if uid not in seen]
+                for doc in removed:
+                    self._delete(conn, doc)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('snapshot_version', ?)",
+                             (json.dumps(pc.get('snapshot_version')),))
+        return changed, len(removed)
+
+    def search(self, query, kind=None, page=1, per_page=50):
+        """Ranked matches for query; returns dict(total, counts, results)
+
+        Free-text terms match anywhere (case-insensitive substrings) in the
+        name, unique_id, type, description or metadata; all terms must match.
+        Terms like `measurement:XRD`, `kind:sample` or `anneal_temp>150`
+        filter on document fields or metadata keys (by full dotted key or
+        its last component, ignoring case); `:` and `=` compare values,
+        `!=`, `<`, `<=`, `>` and `>=` are also supported.
+        """
+        terms, filters = parse_query(query)
+        if kind:
+            filters.append(('kind', ':', kind))
+        where, params = [], []
+        # the trigram index only finds terms of 3 or more characters; shorter ones are scanned for
+        indexed = [t for t in terms if len(t) >= 3]
+        if indexed:
+            where.append("docs_fts MATCH ?")
+            params.append(' '.join('"{}"'.format(t.replace('"', '""')) for t in indexed))
+        for term in terms:
+            if len(term) < 3:
+                where.append('(' + ' OR '.join(f"docs_fts.{c} LIKE ? ESCAPE '\\'" for c in _TEXT_COLUMNS) + ')')
+                params.extend([_like_pattern(term)] * len(_TEXT_COLUMNS))
+        for field, op, value in filters:
+            clause, clause_params = _filter_clause(field, op, value)
+            where.append(clause)
+            params.extend(clause_params)
+        if not where:
+            return dict(total=0, counts={}, results=[])
+        join = "JOIN docs_fts ON docs_fts.rowid = docs.doc" if terms else ""
+        sql_where = ' AND '.join(where)
+        order = f"{_RANK}, docs.name" if indexed else "docs.kind DESC, docs.name"
+        offset = (max(page, 1) - 1) * per_page
+
+        with closing(self._connect()) as conn:
+            counts = dict(conn.execute(
+                f"SELECT docs.kind, count(*) FROM docs {join} WHERE {sql_where} GROUP BY docs.kind", params))
+            rows = conn.execute(
+                f"SELECT docs.kind, docs.unique_id, docs.name, docs.type, docs.doc FROM docs {join} "
+                f"WHERE {sql_where} ORDER BY {order} LIMIT ? OFFSET ?",
+                params + [per_page, offset]).fetchall()
+            results = []
+            for kind_, uid, name, type_, doc in rows:
+                description, metadata = conn.execute(
+                    "SELECT description, metadata FROM docs_fts WHERE rowid = ?", (doc,)).fetchone()
+                results.append(dict(kind=kind_, id=uid, name=name, type=type_, description=description,
+                                    metadata=_matching_lines(metadata, terms, filters)))
+        return dict(total=sum(counts.values()), counts=counts, results=results)
+
+    def clear(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    @staticmethod
+    def _insert(conn, kind, uid, name, type_, description, metadata, digest):
+        cur = conn.execute("INSERT INTO docs (kind, unique_id, name, type, digest) VALUES (?, ?, ?, ?, ?)",
+                           (kind, uid, name, type_, digest))
+        doc = cur.lastrowid
+        conn.execute("INSERT INTO docs_fts (rowid, name, unique_id, type, description, metadata) "
+                     "VALUES (?, ?, ?, ?, ?, ?)",
+                     (doc, name, uid, type_, description, '\n'.join(f"{k}: {v}" for k, v in metadata)))
+        conn.executemany("INSERT INTO fields (doc, key, leaf, text_value, num_value) VALUES (?, ?, ?, ?, ?)",
+                         [(doc, k.lower(), k.rsplit('.', 1)[-1].lower(), str(v), _number(v))
+                          for k, v in metadata])
+
+    @staticmethod
+    def _delete(conn, doc):
+        conn.execute("DELETE FROM docs WHERE doc = ?", (doc,))
+        conn.execute("DELETE FROM docs_fts WHERE rowid = ?", (doc,))
+        conn.execute("DELETE FROM fields WHERE doc = ?", (doc,))
+
+
+def parse_query(query):
+    """Split a search query into free-text terms and (field, op, value) filters"""
+    try:
+        tokens = shlex.split(query or '')
+    except ValueError:
+        # unbalanced quotes
+        tokens = (query or '').replace('"', ' ').split()
+    terms, filters = [], []
+    for token in tokens:
+        match = _FILTER.match(token)
+        if match:
+            filters.append(match.groups())
+        else:
+            terms.append(token)
+    return terms, filters
+
+
+def _filter_clause(field, op, value):
+    field = field.lower()
+    if field in _DOC_FIELDS and op in (':', '=', '!='):
+        column = _DOC_FIELDS[field]
+        negate = 'NOT ' if op == '!=' else ''
+        return f"{negate}docs.{column} LIKE ?", [value.replace('*', '%')]
+
+    key_match = "(f.key = ? OR f.leaf = ?)"
+    number = _number(value)
+    if op in _NUMERIC_OPS:
+        if number is None:
+            return "0", []
+        return (f"docs.doc IN (SELECT f.doc FROM fields f WHERE {key_match} AND f.num_value {_NUMERIC_OPS[op]} ?)",
+                [field, field, number])
+    if number is not None:
+        value_match, value_params = "(f.num_value = ? OR f.text_value = ?)", [number, value]
+    else:
+        value_match, value_params = "f.text_value LIKE ?", [value.replace('*', '%')]
+    negate = 'NOT ' if op == '!=' else ''
+    return (f"docs.doc {negate}IN (SELECT f.doc FROM fields f WHERE {key_match} AND {value_match})",
+            [field, field] + value_params)
+
+
+def _like_pattern(term):
+    """LIKE pattern (escaped with \\) matching term anywhere"""
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _matching_lines(metadata, terms, filters, limit=3):
+    """Metadata 'key: value' lines relevant to the query, for result snippets"""
+    if not metadata:
+        return []
+    needles = [t.lower() for t in terms] + [field.lower() for field, _, _ in filters
+                                            if field.lower() not in _DOC_FIELDS]
+    if not needles:
+        return []
+    lines = [line for line in metadata.split('\n') if any(n in line.lower() for n in needles)]
+    return lines[:limit]
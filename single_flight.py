@@ -0,0 +1,48 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """At most one call in flight per key; concurrent callers for the same key share its outcome.
+
+    The first caller of `do(key, fn, ...)` runs fn; callers arriving while
+    it runs wait for it and get the same result (or exception) instead of
+    calling fn again. Counters are kept per `resource` (default: the key),
+    so stats() shows how many duplicate calls were suppressed.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+        self.counts = {}     # resource -> dict(calls, suppressed)
+
+    def do(self, key, fn, *args, resource=None, **kwargs):
+        with self._lock:
+            counts = self.counts.setdefault(key if resource is None else resource,
+                                            dict(calls=0, suppressed=0))
+            waiting = self._inflight.get(key)
+            if waiting is not None:
+                counts['suppressed'] += 1
+            else:
+                counts['calls'] += 1
+                future = self._inflight[key] = Future()
+        if waiting is not None:
+            return waiting.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def stats(self):
+        with self._lock:
+            return dict(inflight=len(self._inflight), calls=sum(c['calls'] for c in self.counts.values()),
+                        suppressed=sum(c['suppressed'] for c in self.counts.values()),
+                        by_resource={resource: dict(c) for resource, c in self.counts.items()})
@@ -0,0 +1,153 @@
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+
+# map this much of the snapshot file into memory when reading
+SNAPSHOT_MMAP_BYTES = 256 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE records (record INTEGER PRIMARY KEY, kind TEXT NOT NULL, listed INTEGER NOT NULL, body BLOB NOT NULL);
+CREATE TABLE id_index (kind TEXT NOT NULL, unique_id TEXT NOT NULL, record INTEGER NOT NULL,
+                       PRIMARY KEY (kind, unique_id)) WITHOUT ROWID;
+CREATE TABLE name_index (sample_name TEXT PRIMARY KEY, record INTEGER NOT NULL) WITHOUT ROWID;
+"""
+
+# pc keys holding records (kind -> list key, by-id key) and derived indexes that are not stored
+_RECORD_KINDS = {'sample': ('samples', 'samples_by_id'), 'dataset': ('datasets', 'datasets_by_id')}
+_DERIVED_KEYS = {'samples', 'datasets', 'samples_by_id', 'samples_by_name', 'datasets_by_id'}
+
+
+def _encode(record):
+    return json.dumps(record, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def _decode(body):
+    return json.loads(body)
+
+
+class ProjectSnapshotStore:
+    """On-disk project snapshot in a single SQLite file.
+
+    Every sample and dataset record is written once as compact JSON;
+    samples_by_id, datasets_by_id and samples_by_name are stored as maps
+    from id (or name) to record number and rebuilt on load so they share
+    the record objects. Files are replaced atomically on save and opened
+    read-only with mmap, so several workers can read the same snapshot.
+
+    These files are the durable disk cache when no shared cache backend is
+    configured (CACHE_BACKEND=none). Otherwise the same database is shared
+    through the backend as bytes (dumps/loads), and files written before
+    are only read to warm up.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self, pc):
+        """Write project cache dict pc, replacing any existing snapshot"""
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            conn = sqlite3.connect(tmp_path)
+            try:
+                conn.executescript(_SCHEMA)
+                self._write(conn, pc)
+                conn.commit()
+            finally:
+                conn.close()
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load(self):
+        """Read the whole snapshot back into a project cache dict"""
+        with closing(self._connect()) as conn:
+            return self._read(conn)
+
+    @classmethod
+    def dumps(cls, pc):
+        """Snapshot of pc as the bytes of a SQLite database, e.g. to share it through a cache backend"""
+        with closing(sqlite3.connect(':memory:')) as conn:
+            conn.executescript(_SCHEMA)
+            cls._write(conn, pc)
+            conn.commit()
+            return conn.serialize()
+
+    @classmethod
+    def loads(cls, data):
+        """Project cache dict from the bytes returned by dumps"""
+        with closing(sqlite3.connect(':memory:')) as conn:
+            conn.deserialize(data)
+            return cls._read(conn)
+
+    @classmethod
+    def _read(cls, conn):
+        pc = cls._read_meta(conn)
+        records = {}
+        for kind, (list_key, _) in _RECORD_KINDS.items():
+            pc[list_key] = []
+        for record, kind, listed, body in conn.execute(
+                "SELECT record, kind, listed, body FROM records ORDER BY record"):
+            obj = _decode(body)
+            records[record] = obj
+            if listed:
+                pc[_RECORD_KINDS[kind][0]].append(obj)
+        for _, by_id_key in _RECORD_KINDS.values():
+            pc[by_id_key] = {}
+        for kind, unique_id, record in conn.execute("SELECT kind, unique_id, record FROM id_index"):
+            pc[_RECORD_KINDS[kind][1]][unique_id] = records[record]
+        pc['samples_by_name'] = {name: records[record] for name, record in
+                                 conn.execute("SELECT sample_name, record FROM name_index")}
+        return pc
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _connect(self):
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        conn.execute(f"PRAGMA mmap_size = {SNAPSHOT_MMAP_BYTES}")
+        return conn
+
+    @staticmethod
+    def _read_meta(conn):
+        return {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+
+    @staticmethod
+    def _write(conn, pc):
+        meta = {k: v for k, v in pc.items() if k not in _DERIVED_KEYS}
+        meta['saved_at'] = time.time()
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                         [(k, json.dumps(v, default=str)) for k, v in meta.items()])
+
+        record_of = {}  # id(obj) -> record number, so shared objects are stored once
+        for kind, (list_key, by_id_key) in _RECORD_KINDS.items():
+            objs = list(pc.get(list_key, []))
+            listed = {id(o) for o in objs}
+            # by-id entries missing from the list are still stored, just not listed
+            objs += [o for o in pc.get(by_id_key, {}).values() if id(o) not in listed]
+            for obj in objs:
+                if id(obj) in record_of:
+                    continue
+                cur = conn.execute("INSERT INTO records (kind, listed, body) VALUES (?, ?, ?)",
+                                   (kind, id(obj) in listed, _encode(obj)))
+                record_of[id(obj)] = cur.lastrowid
+            by_id = pc.get(by_id_key) or {o['unique_id']: o for o in objs}
+            conn.executemany("INSERT OR REPLACE INTO id_index (kind, unique_id, record) VALUES (?, ?, ?)",
+                             [(kind, uid, record_of[id(o)]) for uid, o in by_id.items()])
+
+        by_name = pc.get('samples_by_name') or {s['sample_name']: s for s in pc.get('samples', [])}
+        conn.executemany("INSERT OR REPLACE INTO name_index (sample_name, record) VALUES (?, ?)",
+                         [(name, record_of[id(s)]) for name, s in by_name.items() if id(s) in record_of])
+
@@ -0,0 +1,63 @@
+import random
+from autocomplete import AutocompleteIndex
+
+
+def _entries(n=300, seed=4):
+    rng = random.Random(seed)
+    words = ['spin', 'coat', 'film', 'anneal', 'xrd', 'pl', 'mapi', 'cs']
+    entries = []
+    for i in range(n):
+        name = '_'.join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+        if rng.random() < 0.1:
+            name = rng.choice(words)
+        entries.append((f'{rng.choice("0123456789abcdef")}{i:05d}x', name.upper() if i % 7 == 0 else name))
+    entries.append(('dup', 'film'))
+    entries.append(('nameless', None))
+    return entries
+
+
+def _brute_force(entries, query):
+    q = query.lower()
+    ranked = []
+    for uid, name in sorted(entries, key=lambda e: ((e[1] or '').lower(), str(e[0]).lower())):
+        keys = ((name or '').lower(), str(uid).lower())
+        if not q or any(q in key for key in keys):
+            rank = 2
+            if q and q in keys:
+                rank = 0
+            elif q and any(key.startswith(q) for key in keys):
+                rank = 1
+            ranked.append((rank, len(ranked), (uid, name)))
+        else:
+            ranked.append(None)
+    return [entry for _, _, entry in sorted(r for r in ranked if r is not None)]
+
+
+def _all_pages(index, query, limit):
+    results, cursor = [], None
+    while True:
+        page, cursor = index.search(query, limit=limit, cursor=cursor)
+        assert len(page) <= limit
+        results.extend(page)
+        if cursor is None:
+            return results
+        assert len(page) == limit
+
+
+def test_pages_match_brute_force_ranking():
+    entries = _entries()
+    index = AutocompleteIndex(entries)
+    assert len(index) == len(entries)
+    for query in ['', 'f', 'FILM', 'film', 'spin_coat', 'an', 'nnea', 'pl_x', '0001', '00012x', 'dup', 'zzz']:
+        expected = _brute_force(entries, query)
+        for limit in (1, 7, 20, 1000):
+            assert _all_pages(index, query, limit) == expected, (query, limit)
+
+
+def test_first_page_and_bad_cursor():
+    entries = _entries()
+    index = AutocompleteIndex(entries)
+    page, cursor = index.search('film', limit=5)
+    assert page == _brute_force(entries, 'film')[:5]
+    assert cursor is not None
+    assert index.search('film', limit=5, cursor='not-a-cursor') == (page, cursor)
@@ -0,0 +1,84 @@
+import random
+from itertools import islice
+import networkx as nx
+from lineage_index import ProjectLineageIndex
+
+
+def _random_dag(n=200, edges=600, seed=1):
+    rng = random.Random(seed)
+    G = nx.DiGraph()
+    G.add_nodes_from(f's{i}' for i in range(n))
+    while G.number_of_edges() < edges:
+        a, b = sorted(rng.sample(range(n), 2))
+        G.add_edge(f's{a}', f's{b}')
+    return G
+
+
+def test_memo_stays_within_its_limit_and_is_counted_in_the_size():
+    G = _random_dag()
+    index = ProjectLineageIndex(G, max_memo_bytes=20000)
+    empty = index.estimated_bytes()
+    for sid in G.nodes:
+        assert index.ancestors(sid) == nx.ancestors(G, sid)
+        assert index.descendants(sid) == nx.descendants(G, sid)
+        assert index.memo_bytes() <= index.max_memo_bytes
+    assert index.estimated_bytes() == empty
+    assert empty >= index.memo_bytes() + 300 * len(index)
+
+
+def _random_graph_with_cycles(n=120, edges=300, seed=2):
+    rng = random.Random(seed)
+    G = nx.DiGraph()
+    G.add_nodes_from(f's{i}' for i in range(n))
+    while G.number_of_edges() < edges:
+        a, b = rng.sample(range(n), 2)
+        G.add_edge(f's{a}', f's{b}')
+    return G
+
+
+def _check_paths(G, paths, sample_id, lengths):
+    assert set(paths) == set(lengths) - {sample_id}
+    for sid, path in paths.items():
+        assert nx.is_simple_path(G, path)
+        assert len(path) - 1 == lengths[sid]
+
+
+def test_closures_and_paths_match_networkx():
+    for G in (_random_dag(n=80, edges=200), _random_graph_with_cycles()):
+        index = ProjectLineageIndex(G)
+        assert index.is_dag == nx.is_directed_acyclic_graph(G)
+        for sid in G.nodes:
+            assert index.ancestors(sid) == nx.ancestors(G, sid)
+            assert index.descendants(sid) == nx.descendants(G, sid)
+            assert index.lineage(sid) == nx.ancestors(G, sid) | nx.descendants(G, sid) | {sid}
+            paths = index.descendant_paths(sid)
+            assert all(path[0] == sid for path in paths.values())
+            _check_paths(G, paths, sid, nx.single_source_shortest_path_length(G, sid))
+            paths = index.ancestor_paths(sid)
+            assert all(path[-1] == sid for path in paths.values())
+            _check_paths(G, paths, sid, nx.single_source_shortest_path_length(G.reverse(), sid))
+
+
+def test_alternative_paths_and_edges_within_match_networkx():
+    G = _random_graph_with_cycles(n=40, edges=90)
+    index = ProjectLineageIndex(G)
+    rng = random.Random(3)
+    for _ in range(50):
+        source, target = rng.sample(sorted(G.nodes), 2)
+        paths = index.alternative_paths(source, target, k=3)
+        if not nx.has_path(G, source, target):
+            assert paths == []
+            continue
+        expected = [len(p) for p in islice(nx.shortest_simple_paths(G, source, target), 3)]
+        assert [len(p) for p in paths] == expected
+        assert len({tuple(p) for p in paths}) == len(paths)
+        assert all(nx.is_simple_path(G, p) and p[0] == source and p[-1] == target for p in paths)
+    members = set(rng.sample(sorted(G.nodes), 20)) | {'not-a-sample'}
+    assert sorted(index.edges_within(members)) == sorted(G.subgraph(members).edges)
+
+
+def test_unknown_samples_have_no_lineage():
+    index = ProjectLineageIndex(_random_dag(n=10, edges=20))
+    assert index.ancestors('missing') == frozenset()
+    assert index.descendant_paths('missing') == {}
+    assert index.alternative_paths('missing', 's1') == []
@@ -0,0 +1,101 @@
+import random
+import networkx as nx
+from lineage_index import ProjectLineageIndex
+from lineage_view import compact_lineage, group_siblings
+
+
+def _random_dag(n=150, edges=300, seed=6):
+    rng = random.Random(seed)
+    G = nx.DiGraph()
+    G.add_nodes_from(f's{i}' for i in range(n))
+    while G.number_of_edges() < edges:
+        a, b = sorted(rng.sample(range(n), 2))
+        G.add_edge(f's{a}', f's{b}')
+    return G
+
+
+def _kind(sid):
+    return 'film' if int(sid[1:]) % 3 else 'powder'
+
+
+def _expected_depths(G, sid, depth_up=None, depth_down=None):
+    down = nx.single_source_shortest_path_length(G, sid, cutoff=depth_down)
+    up = nx.single_source_shortest_path_length(G.reverse(), sid, cutoff=depth_up)
+    return {**{a: -d for a, d in up.items()}, **down}
+
+
+def test_depths_are_shortest_generations_within_the_limits():
+    G = _random_dag()
+    lineage = ProjectLineageIndex(G)
+    for sid in list(G.nodes)[::10]:
+        for depth_up, depth_down in ((None, None), (1, 2), (0, 3), (2, 0)):
+            view = compact_lineage(lineage, [sid], _kind, depth_up=depth_up, depth_down=depth_down)
+            assert view.depths == _expected_depths(G, sid, depth_up, depth_down)
+            assert not view.groups and not view.truncated
+            for kept, depth in view.depths.items():
+                # relatives past the depth limit are counted on the last kept generation
+                for direction, limit, step in (('up', depth_up, G.predecessors), ('down', depth_down, G.successors)):
+                    hidden = [r for r in step(kept) if r not in view.depths]
+                    at_limit = limit is not None and abs(depth) == limit and (depth <= 0 if direction == 'up' else depth >= 0)
+                    assert view.more.get(kept, {}).get(direction, 0) == (len(hidden) if at_limit else 0)
+
+
+def test_node_cap_keeps_the_nearest_generations():
+    G = _random_dag()
+    lineage = ProjectLineageIndex(G)
+    focal = ['s40', 's75']
+    full = compact_lineage(lineage, focal, _kind)
+    assert set(full.depths) == set(focal).union(*(lineage.lineage(sid) for sid in focal))
+    for max_nodes in (2, 5, 20, len(full.depths) - 1, len(full.depths)):
+        view = compact_lineage(lineage, focal, _kind, max_nodes=max_nodes)
+        assert len(view) == max_nodes
+        assert view.truncated == (max_nodes < len(full.depths))
+        assert all(full.depths[sid] == depth for sid, depth in view.depths.items())
+        dropped = [abs(d) for sid, d in full.depths.items() if sid not in view.depths]
+        if dropped:
+            assert max(abs(d) for d in view.depths.values()) <= min(dropped)
+            assert sum(m['up'] + m['down'] for m in view.more.values()) > 0
+        else:
+            assert not view.more
+
+
+def test_collapse_folds_sibling_groups_and_stops_there():
+    G = nx.DiGraph()
+    G.add_edges_from(('root', f'film{i}') for i in range(7))
+    G.add_edges_from(('root', f'powder{i}') for i in range(3))
+    G.add_edges_from((f'film{i}', f'child{i}') for i in range(7))
+    G.add_edge('parent', 'root')
+    G.add_edge('powder0', 'child-of-powder')
+    lineage = ProjectLineageIndex(G)
+    kind = lambda sid: sid.rstrip('0123456789')
+    view = compact_lineage(lineage, ['root'], kind, collapse=True, min_group=5)
+    assert view.depths == {'root': 0, 'parent': -1, 'powder0': 1, 'powder1': 1, 'powder2': 1, 'child-of-powder': 2}
+    assert len(view.groups) == 1
+    group = view.groups[0]
+    assert (group['direction'], group['anchor'], group['key']) == ('down', 'root', 'film')
+    assert sorted(group['members']) == sorted(f'film{i}' for i in range(7))
+    assert compact_lineage(lineage, ['root'], kind, collapse=True, min_group=8).depths == \
+        _expected_depths(G, 'root')
+
+
+def test_collapsed_view_accounts_for_the_whole_lineage():
+    G = _random_dag(n=100, edges=400)
+    lineage = ProjectLineageIndex(G)
+    for sid in list(G.nodes)[::7]:
+        view = compact_lineage(lineage, [sid], _kind, collapse=True, min_group=3)
+        members = [m for g in view.groups for m in g['members']]
+        assert len(members) == len(set(members)) and not set(members) & set(view.depths)
+        for g in view.groups:
+            assert len(g['members']) >= 3 and {_kind(m) for m in g['members']} == {g['key']}
+            step = lineage.children if g['direction'] == 'down' else lineage.parents
+            assert set(g['members']) <= set(step(g['anchor']))
+        shown = set(view.depths) | set(members)
+        assert shown <= lineage.lineage(sid)
+        # anything left out lies beyond a folded group
+        beyond = set().union(*(lineage.lineage(m) for m in members))
+        assert lineage.lineage(sid) - shown <= beyond
+
+
+def test_group_siblings():
+    singles, groups = group_siblings(['a1', 'b1', 'a2', 'c1', 'a3'], key=lambda s: s[0], min_group=3)
+    assert singles == ['b1', 'c1'] and groups == {'a': ['a1', 'a2', 'a3']}
@@ -0,0 +1,157 @@
+import random
+import networkx as nx
+from lineage_index import ProjectLineageIndex
+from project_tables import ProjectTables
+from project_views.engine import Join, ProjectView, ViewStore
+
+
+def _lineage():
+    G = nx.DiGraph()
+    G.add_edges_from([('sp1', 'tf1'), ('sp1', 'tf2')])
+    G.add_node('tf3')
+    return ProjectLineageIndex(G, version='g1')
+
+
+def _project(version, temps, previous_version=None, changed_datasets=()):
+    """Thin films tf1..tf3 (tf3 without datasets) with one spin_run each; temps by dataset id"""
+    samples = [dict(unique_id='sp1', sample_name='SP1', datasets=[])]
+    datasets = []
+    for i in (1, 2):
+        ds = dict(unique_id=f'd{i}', measurement='spin_run',
+                  scientific_metadata={'heater_sv_temp': temps[f'd{i}']} if temps.get(f'd{i}') is not None else {})
+        datasets.append(ds)
+        samples.append(dict(unique_id=f'tf{i}', sample_name=f'TF{i}', datasets=[ds]))
+    samples.append(dict(unique_id='tf3', sample_name='TF3', datasets=[]))
+    return dict(samples=samples, datasets=datasets, snapshot_version=version,
+                sync=dict(previous_version=previous_version, changed_datasets=list(changed_datasets)))
+
+
+VIEW = ProjectView('spin', 'p', 'Spin runs', 'TF', joins=[Join('temp', 'spin_run', 'heater_sv_temp', default='?')])
+
+
+def test_integer_metadata_keeps_its_type_next_to_missing_values():
+    lineage = _lineage()
+    store = ViewStore()
+    first = ProjectTables(_project('v1', {'d1': 101, 'd2': None}), lineage)
+    assert list(store.get(VIEW, first).df['temp']) == [101, None, '?']
+    assert type(store.get(VIEW, first).df['temp'][0]) is int
+
+    second = ProjectTables(_project('v2', {'d1': 101, 'd2': 999}, 'v1', ['d2']), lineage, previous=first)
+    refreshed = store.get(VIEW, second).df
+    assert list(refreshed['temp']) == [101, 999, '?']
+    assert refreshed.to_csv(index=False) == VIEW.materialize(second).to_csv(index=False)
+    assert 'TF1,tf1,101\n' in refreshed.to_csv(index=False)
+
+
+class RecordingView(ProjectView):
+    """ProjectView that records the sample_ids of each materialize call (None for the whole view)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def materialize(self, tables, sample_ids=None):
+        self.calls.append(None if sample_ids is None else set(sample_ids))
+        return super().materialize(tables, sample_ids)
+
+
+def _random_lineage(rng):
+    G = nx.DiGraph()
+    G.add_nodes_from(f'sp{i}' for i in range(4))
+    G.add_nodes_from(f'tf{i}' for i in range(20))
+    for i in range(20):
+        for sp in rng.sample(range(4), rng.randint(0, 2)):
+            G.add_edge(f'sp{sp}', f'tf{i}')
+        if i and rng.random() < 0.3:
+            G.add_edge(f'tf{rng.randrange(i)}', f'tf{i}')
+    return ProjectLineageIndex(G, version='g1')
+
+
+def _snapshot(state, version, previous_version=None, changed_datasets=(), removed_datasets=()):
+    datasets = {dsid: dict(unique_id=dsid, measurement=measurement, scientific_metadata=metadata)
+                for dsid, (measurement, metadata) in state['datasets'].items()}
+    samples = [dict(unique_id=sid, sample_name=name, datasets=[datasets[d] for d in state['links'][sid]])
+               for sid, name in state['names'].items()]
+    return dict(samples=samples, datasets=list(datasets.values()), snapshot_version=version,
+                sync=dict(previous_version=previous_version, changed_datasets=list(changed_datasets),
+                          removed_datasets=list(removed_datasets)))
+
+
+def _edit(state, rng):
+    """One random change to state; returns (changed dataset ids, removed dataset ids)"""
+    sid = rng.choice(sorted(state['names']))
+    kind = rng.choice(['metadata', 'metadata', 'rename', 'link', 'unlink', 'remove'])
+    links = state['links'][sid]
+    if kind == 'metadata' and links:
+        dsid = rng.choice(links)
+        measurement, _ = state['datasets'][dsid]
+        state['datasets'][dsid] = (measurement, rng.choice([{}, {'temp': rng.randint(20, 400)}, {'name': f'n{rng.random():.3f}'}]))
+        return [dsid], []
+    if kind == 'rename':
+        state['names'][sid] = state['names'][sid][:4] + f'-{rng.randrange(10 ** 6):06d}'
+    elif kind == 'link':
+        dsid = f'd{len(state["datasets"])}-{rng.randrange(10 ** 6)}'
+        state['datasets'][dsid] = (rng.choice(['spin_run', 'synth']), {'temp': rng.randint(20, 400), 'name': dsid})
+        links.insert(rng.randint(0, len(links)), dsid)
+        return [dsid], []
+    elif kind == 'unlink' and links:
+        links.pop(rng.randrange(len(links)))
+    elif kind == 'remove' and links:
+        dsid = links.pop()
+        del state['datasets'][dsid]
+        return [], [dsid]
+    return [], []
+
+
+def _values(df):
+    return [[(type(v), v) for v in row] for row in df.itertuples(index=False)]
+
+
+def test_incremental_refresh_matches_full_materialization():
+    rng = random.Random(7)
+    lineage = _random_lineage(rng)
+    view = RecordingView('mix', 'p', 'Mix', 'TF', joins=[
+        Join('temp', 'spin_run', 'temp', default='?'),
+        Join(['sp_a', 'sp_b'], 'synth', 'name', source='ancestors', source_prefix='SP'),
+        Join('any_synth', 'synth', source='ancestors')])
+    state = dict(names={sid: sid.upper() + '-000000' for sid in lineage.ids}, links={}, datasets={})
+    for sid in lineage.ids:
+        state['links'][sid] = []
+        for j in range(rng.randint(0, 2)):
+            dsid = f'{sid}-d{j}'
+            state['datasets'][dsid] = ('synth' if sid.startswith('sp') else rng.choice(['spin_run', 'synth']),
+                                       {'temp': rng.randint(20, 400), 'name': dsid})
+            state['links'][sid].append(dsid)
+    store = ViewStore()
+    tables = ProjectTables(_snapshot(state, 'v0'), lineage)
+    assert _values(store.get(view, tables).df) == _values(view.materialize(tables))
+    for step in range(1, 60):
+        changed, removed = [], []
+        for _ in range(rng.randint(0, 3)):
+            c, r = _edit(state, rng)
+            changed += c
+            removed += r
+        tables = ProjectTables(_snapshot(state, f'v{step}', f'v{step - 1}', changed, removed), lineage,
+                               previous=tables)
+        view.calls.clear()
+        refreshed = store.get(view, tables)
+        assert view.calls in ([], [tables.changed_samples | tables.descendants_of(tables.changed_samples)])
+        assert _values(refreshed.df) == _values(view.materialize(tables)), step
+        assert store.get(view, tables) is refreshed
+
+
+def test_unknown_changes_rematerialize_the_whole_view():
+    lineage = _lineage()
+    store = ViewStore()
+    view = RecordingView('spin', 'p', 'Spin runs', 'TF', joins=VIEW.joins)
+    first = ProjectTables(_project('v1', {'d1': 1, 'd2': 2}), lineage)
+    store.get(view, first)
+    # the sync was diffed against a version the store never saw
+    second = ProjectTables(_project('v2', {'d1': 1, 'd2': 3}, 'v0', ['d2']), lineage, previous=first)
+    view.calls.clear()
+    assert list(store.get(view, second).df['temp']) == [1, 3, '?']
+    assert view.calls == [None]
+    third = ProjectTables(_project('v3', {'d1': 5, 'd2': 3}, 'v2', ['d1']), lineage, previous=second)
+    view.calls.clear()
+    assert list(store.get(view, third).df['temp']) == [5, 3, '?']
+    assert view.calls == [{'tf1'}]
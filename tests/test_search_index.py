@@ -0,0 +1,63 @@
+from search_index import ProjectSearchIndex
+
+
+def _project():
+    return {
+        'snapshot_version': 'v1',
+        'samples': [{'unique_id': 's1', 'sample_name': 'TF_001', 'sample_type': 'thin film'}],
+        'datasets': [
+            {'unique_id': 'd1', 'dataset_name': 'spin 1', 'measurement': 'spin_run',
+             'scientific_metadata': {'Anneal_Temp': 160, 'recipe': {'Speed': 3000}}},
+            {'unique_id': 'd2', 'dataset_name': 'spin 2', 'measurement': 'spin_run',
+             'scientific_metadata': {'Anneal_Temp': 120, 'recipe': {'Speed': 1500}}},
+        ],
+    }
+
+
+def _ids(index, query):
+    return sorted(r['id'] for r in index.search(query)['results'])
+
+
+def test_metadata_filters_ignore_key_case(tmp_path):
+    index = ProjectSearchIndex(str(tmp_path / 'search.sqlite'))
+    index.update(_project())
+    assert _ids(index, 'Anneal_Temp>150') == ['d1']
+    assert _ids(index, 'anneal_temp>150') == ['d1']
+    assert _ids(index, 'Speed>=3000') == ['d1']
+    assert _ids(index, 'recipe.Speed:3000') == ['d1']
+    assert _ids(index, 'RECIPE.speed<3000') == ['d2']
+
+
+def test_index_from_older_format_is_rebuilt(tmp_path):
+    index = ProjectSearchIndex(str(tmp_path / 'search.sqlite'))
+    index.update(_project())
+    with index._connect() as conn:
+        conn.execute("UPDATE fields SET key = 'Anneal_Temp', leaf = 'Anneal_Temp' WHERE key = 'anneal_temp'")
+        conn.execute("DELETE FROM meta WHERE key = 'format'")
+    assert index.update(_project()) == (3, 0)
+    assert _ids(index, 'anneal_temp>150') == ['d1']
+
+
+def _brute_force(pc, term):
+    """unique_ids whose name, id, type, description or metadata contain term (the old client-side search)"""
+    from search_index import _documents
+    term = term.lower()
+    return sorted(uid for kind, uid, name, type_, description, metadata in _documents(pc)
+                  if any(term in text.lower() for text in
+                         [name, uid, type_, description] + [f"{k}: {v}" for k, v in metadata]))
+
+
+def test_free_text_matches_ids_and_substrings(tmp_path):
+    pc = _project()
+    index = ProjectSearchIndex(str(tmp_path / 'search.sqlite'))
+    index.update(pc)
+    for query in ['s1', 'd2', 'TF_001', '001', 'F_0', 'spin', 'pin 2', 'run', 'film', '3000', 'recipe.sp', 'x']:
+        assert _ids(index, f'"{query}"') == _brute_force(pc, query), query
+
+
+def test_free_text_terms_must_all_match(tmp_path):
+    index = ProjectSearchIndex(str(tmp_path / 'search.sqlite'))
+    index.update(_project())
+    assert _ids(index, 'spin 2') == ['d2']
+    assert _ids(index, 'spin_run 160') == ['d1']
+    assert _ids(index, '100%') == []
@@ -0,0 +1,66 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from single_flight import SingleFlight
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+
+def _gated(calls, gate, result):
+    def fn(*args, **kwargs):
+        calls.append((args, kwargs))
+        assert gate.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return fn
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls, gate, result = [], threading.Event(), object()
+    fn = _gated(calls, gate, result)
+    with ThreadPoolExecutor(10) as pool:
+        futures = [pool.submit(flight.do, 'graph:p', fn, 1, resource='graph', flag=True) for _ in range(10)]
+        _wait_for(lambda: flight.stats()['suppressed'] == 9)
+        assert flight.stats()['inflight'] == 1
+        gate.set()
+        assert all(f.result() is result for f in futures)
+    assert calls == [((1,), {'flag': True})]
+    assert flight.stats() == dict(inflight=0, calls=1, suppressed=9,
+                                  by_resource={'graph': dict(calls=1, suppressed=9)})
+
+
+def test_waiters_get_the_same_exception():
+    flight = SingleFlight()
+    calls, gate, error = [], threading.Event(), ValueError('fetch failed')
+    fn = _gated(calls, gate, error)
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(flight.do, 'k', fn) for _ in range(4)]
+        _wait_for(lambda: flight.stats()['suppressed'] == 3)
+        gate.set()
+        for f in futures:
+            with pytest.raises(ValueError) as raised:
+                f.result()
+            assert raised.value is error
+    assert len(calls) == 1 and flight.stats()['inflight'] == 0
+
+
+def test_keys_run_independently_and_calls_are_not_cached():
+    flight = SingleFlight()
+    calls, gate = [], threading.Event()
+    with ThreadPoolExecutor(2) as pool:
+        a = pool.submit(flight.do, 'a', _gated(calls, gate, 'A'))
+        b = pool.submit(flight.do, 'b', _gated(calls, gate, 'B'))
+        # both keys are in flight at once
+        _wait_for(lambda: len(calls) == 2)
+        gate.set()
+        assert (a.result(), b.result()) == ('A', 'B')
+    assert flight.do('a', lambda: 'again') == 'again'
+    assert flight.stats()['by_resource'] == {'a': dict(calls=2, suppressed=0), 'b': dict(calls=1, suppressed=0)}
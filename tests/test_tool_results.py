@@ -0,0 +1,70 @@
+import json
+import random
+from collections import Counter
+from tool_results import fit_json, page_results, rank_matches
+
+
+def _items(n=103, seed=5):
+    rng = random.Random(seed)
+    return [{'unique_id': f'id{i:03d}', 'name': rng.choice(['film', 'Film A', 'a film', 'powder']) + str(i % 3),
+             'type': rng.choice(['sample', 'dataset', None]),
+             'description': ' '.join(rng.choice(['spin', 'coat', 'film']) for _ in range(rng.randint(0, 200)))}
+            for i in range(n)]
+
+
+def test_pages_cover_every_item_once():
+    items = _items()
+    for page_size in (1, 10, 25, 103, 500):
+        first = page_results(items, page_size=page_size)
+        results, page = [], 1
+        while page is not None:
+            result = page_results(items, page=page, page_size=page_size)
+            assert result['page'] == page
+            assert result['total'] == len(items)
+            assert result['pages'] == first['pages']
+            assert len(result['results']) <= page_size
+            results.extend(result['results'])
+            page = result['next_page']
+        assert results == items
+        assert first['pages'] == -(-len(items) // page_size)
+    counts = Counter(it['type'] or 'unknown' for it in items)
+    assert page_results(items)['counts_by_type'] == dict(counts)
+
+
+def test_out_of_range_pages_are_clamped():
+    items = _items(30)
+    assert page_results(items, page=0, page_size=10)['page'] == 1
+    last = page_results(items, page=99, page_size=10)
+    assert (last['page'], last['next_page'], last['results']) == (3, None, items[20:])
+    empty = page_results([], page=3, results_key='samples')
+    assert (empty['page'], empty['pages'], empty['next_page'], empty['samples']) == (1, 1, None, [])
+
+
+def test_rank_matches_orders_exact_prefix_substring_then_other_fields():
+    items = _items()
+    ranked = rank_matches(items, ' FILM0 ', ['name', 'description'])
+    def rank(item):
+        name = item['name'].lower()
+        return 0 if name == 'film0' else 1 if name.startswith('film0') else 2 if 'film0' in name else 3
+    expected = sorted((it for it in items if 'film0' in it['name'].lower() or 'film0' in it['description']),
+                      key=rank)
+    assert ranked == expected
+
+
+def test_fit_json_is_valid_and_within_limit():
+    result = {'total': 103, 'results': _items(), 'nested': {'a': [[[[[[[['deep']]]]]]]]}}
+    full = json.dumps(result)
+    assert fit_json(result, len(full)) == full
+    for limit in (200, 500, 1000, 5000, 20000, len(full) - 1):
+        text = fit_json(result, limit)
+        assert len(text) <= limit
+        shrunk = json.loads(text)
+        assert isinstance(shrunk, dict)
+        if 'results' in shrunk:
+            assert shrunk['total'] == 103
+            kept = [r for r in shrunk['results'] if isinstance(r, dict)]
+            assert [r['unique_id'] for r in kept] == [r['unique_id'] for r in result['results'][:len(kept)]]
+            if len(kept) < 103:
+                assert shrunk['results'][-1] == f'… {103 - len(kept)} more'
+        else:
+            assert shrunk['truncated'] and shrunk['keys'] == ['total', 'results', 'nested']
@@ -0,0 +1,42 @@
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+pytest.importorskip('pycrucible')
+from transport import HttpTransport, pooled_crucible_client
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """(adapter, request, timeout) of every request that reaches an HTTPAdapter"""
+    calls = []
+
+    def send(self, request, timeout=None, **kwargs):
+        calls.append((self, request, timeout))
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response._content = b'{"nodes": [], "links": []}'
+        response.request, response.url = request, request.url
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, 'send', send)
+    return calls
+
+
+def test_adapter_applies_endpoint_timeouts(sent):
+    transport = HttpTransport(timeout=(5, 30), timeouts=[(r'/(samples|datasets)/?$', (5, 120))])
+    transport.get('http://crucible.test/api/v1/datasets', params={'limit': 10})
+    transport.get('http://crucible.test/api/v1/datasets/d1')
+    transport.get('http://crucible.test/api/v1/datasets', timeout=1)
+    assert [timeout for _, _, timeout in sent] == [(5, 120), (5, 30), 1]
+
+
+def test_crucible_client_requests_use_pooled_adapter(sent):
+    transport = HttpTransport()
+    client = pooled_crucible_client('http://crucible.test/api/v1', 'key', transport)
+    client._request('GET', '/projects/p1/sample_graph')
+    assert sent, "the client's request never reached the pooled adapter"
+    adapter, request, _ = sent[-1]
+    assert adapter is transport.adapter
+    assert request.url.endswith('/projects/p1/sample_graph')
@@ -0,0 +1,181 @@
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class ThumbnailService:
+    """Shared, cached access to dataset thumbnails.
+
+    Thumbnail lists, as returned by `fetch_thumbnails(dsid)` (normally
+    crucible_client.get_thumbnails), are kept in an in-memory LRU and in the
+    cache `backend` shared with the other workers, for `shared_ttl` seconds.
+    Without a shared backend (CACHE_BACKEND=none) they are kept in one JSON
+    file per dataset under `cache_dir` instead. Fetches run on one
+    long-lived bounded executor, and concurrent requests for the same
+    dataset share a single in-flight fetch. Datasets without thumbnails are
+    remembered for `negative_ttl` seconds. Decoded image bytes are memoized
+    too, for serving thumbnails as plain image responses.
+    """
+
+    def __init__(self, fetch_thumbnails, backend, cache_dir='cache/thumbnails', max_entries=2000,
+                 max_workers=10, negative_ttl=600, shared_ttl=7 * 86400):
+        self.fetch_thumbnails = fetch_thumbnails
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.shared_ttl = shared_ttl
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='thumbnails')
+        self._memory = OrderedDict()  # dsid -> (thumbnails, fetched_at)
+        self._images = OrderedDict()  # (dsid, n) -> (bytes, mimetype, etag)
+        self._inflight = {}           # dsid -> Future
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.disk_hits = 0
+        self.fetches = 0
+        self.coalesced = 0
+
+    def get(self, dsid):
+        """List of thumbnail dicts for dataset dsid (empty if it has none)"""
+        return self.submit(dsid).result()
+
+    def get_many(self, dsids):
+        """{dsid: thumbnails} for several datasets, fetched concurrently"""
+        futures = {dsid: self.submit(dsid) for dsid in dict.fromkeys(dsids)}
+        return {dsid: future.result() for dsid, future in futures.items()}
+
+    def image(self, dsid, n=0):
+        """(bytes, mimetype, etag) of the n-th thumbnail of dsid, or None"""
+        with self._lock:
+            image = self._images.get((dsid, n))
+            if image is not None:
+                self._images.move_to_end((dsid, n))
+                return image
+        thumbs = self.get(dsid)
+        if not 0 <= n < len(thumbs):
+            return None
+        data = base64.b64decode(thumbs[n]['thumbnail_b64str'])
+        mimetype = 'image/jpeg' if data[:3] == b'\xff\xd8\xff' else 'image/png'
+        image = (data, mimetype, hashlib.sha1(data).hexdigest())
+        with self._lock:
+            self._images[(dsid, n)] = image
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+        return image
+
+    def submit(self, dsid):
+        """Future resolving to the thumbnails of dsid"""
+        with self._lock:
+            cached = self._memory.get(dsid)
+            if cached is not None and self._is_valid(cached):
+                self._memory.move_to_end(dsid)
+                self.hits += 1
+                return _done(cached[0])
+            future = self._inflight.get(dsid)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            future = self.executor.submit(self._load, dsid)
+            self._inflight[dsid] = future
+        future.add_done_callback(lambda _: self._forget(dsid))
+        return future
+
+    def invalidate(self, dsid):
+        with self._lock:
+            self._memory.pop(dsid, None)
+            for key in [key for key in self._images if key[0] == dsid]:
+                del self._images[key]
+        if self.backend.shared:
+            self.backend.delete(self._key(dsid))
+        elif os.path.exists(self._path(dsid)):
+            os.remove(self._path(dsid))
+
+    def stats(self):
+        with self._lock:
+            return dict(entries=len(self._memory), inflight=len(self._inflight), hits=self.hits,
+                        shared_hits=self.shared_hits, disk_hits=self.disk_hits, fetches=self.fetches,
+                        coalesced=self.coalesced)
+
+    def _load(self, dsid):
+        cached = self._read_shared(dsid) if self.backend.shared else self._read_disk(dsid)
+        if cached is not None and self._is_valid(cached):
+            if self.backend.shared:
+                self.shared_hits += 1
+            else:
+                self.disk_hits += 1
+        else:
+            self.fetches += 1
+            try:
+                thumbs = self.fetch_thumbnails(dsid) or []
+            except Exception as err:
+                # not cached, the next request tries again
+                print(f"failed to get thumbnails for {dsid}: {err}")
+                return []
+            cached = (thumbs, time.time())
+            if self.backend.shared:
+                self.backend.set_json(self._key(dsid), dict(thumbnails=cached[0], fetched_at=cached[1]),
+                                      ttl=self.shared_ttl)
+            else:
+                self._write_disk(dsid, cached)
+        self._remember(dsid, cached)
+        return cached[0]
+
+    def _is_valid(self, cached):
+        thumbs, fetched_at = cached
+        return bool(thumbs) or time.time() - fetched_at < self.negative_ttl
+
+    def _remember(self, dsid, cached):
+        with self._lock:
+            self._memory[dsid] = cached
+            self._memory.move_to_end(dsid)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _forget(self, dsid):
+        with self._lock:
+            self._inflight.pop(dsid, None)
+
+    @staticmethod
+    def _key(dsid):
+        return f"thumbnails:{dsid}"
+
+    def _read_shared(self, dsid):
+        data = self.backend.get_json(self._key(dsid))
+        if data is None:
+            return None
+        return data['thumbnails'], data['fetched_at']
+
+    def _path(self, dsid):
+        fname = str(dsid).replace('.', '-').replace('/', '-')
+        return os.path.join(self.cache_dir, f"{fname}.json")
+
+    def _read_disk(self, dsid):
+        try:
+            with open(self._path(dsid), 'r') as jsonf:
+                data = json.load(jsonf)
+            return data['thumbnails'], data['fetched_at']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, dsid, cached):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as jsonf:
+                json.dump(dict(thumbnails=cached[0], fetched_at=cached[1]), jsonf)
+            os.replace(tmp_path, self._path(dsid))
+        except OSError as err:
+            print(f"failed to write thumbnail cache for {dsid}: {err}")
+
+
+def _done(value):
+    future = Future()
+    future.set_result(value)
+    return future
@@ -0,0 +1,83 @@
+import json
+from collections import Counter
+
+# (max list items, max string length) tried in turn until a result fits its budget
+_SHRINK_STEPS = ((50, 500), (20, 200), (10, 100), (5, 60), (3, 40), (1, 20))
+_MAX_DEPTH = 6
+
+
+def rank_matches(items, query, fields):
+    """Items whose fields contain query (case-insensitive), best first
+
+    Ranked by the first field: exact match, then prefix, then substring;
+    matches only in later fields come last. Ties keep their input order.
+    """
+    q = query.strip().lower()
+    ranked = []
+    for i, item in enumerate(items):
+        values = [str(item.get(f) or '').lower() for f in fields]
+        if values[0] == q:
+            rank = 0
+        elif values[0].startswith(q):
+            rank = 1
+        elif q in values[0]:
+            rank = 2
+        elif any(q in v for v in values[1:]):
+            rank = 3
+        else:
+            continue
+        ranked.append((rank, i, item))
+    ranked.sort(key=lambda r: r[:2])
+    return [item for _, _, item in ranked]
+
+
+def page_results(items, page=1, page_size=25, type_key='type', results_key='results'):
+    """One page of items with totals, counts by type_key and the next page number (or None)"""
+    total = len(items)
+    pages = max((total + page_size - 1) // page_size, 1)
+    page = min(max(int(page or 1), 1), pages)
+    start = (page - 1) * page_size
+    return {
+        'total': total,
+        'page': page,
+        'pages': pages,
+        'next_page': page + 1 if page < pages else None,
+        'counts_by_type': dict(Counter(it.get(type_key) or 'unknown' for it in items).most_common(20)),
+        results_key: items[start:start + page_size],
+    }
+
+
+def fit_json(result, limit):
+    """JSON text of result in at most limit characters, always valid JSON
+
+    Oversized results are shrunk structurally (long lists and strings are
+    cut, with a note of how much was left out) rather than sliced mid-text.
+    """
+    text = json.dumps(result, default=str)
+    if len(text) <= limit:
+        return text
+    for max_items, max_str in _SHRINK_STEPS:
+        text = json.dumps(_shrink(result, max_items, max_str), default=str)
+        if len(text) <= limit:
+            return text
+    keys = list(result)[:20] if isinstance(result, dict) else []
+    return json.dumps({'truncated': True, 'note': 'result too large to return', 'keys': keys}, default=str)
+
+
+def _shrink(value, max_items, max_str, depth=0):
+    if isinstance(value, str):
+        return value if len(value) <= max_str else value[:max_str] + f'… ({len(value) - max_str} more chars)'
+    if depth >= _MAX_DEPTH and isinstance(value, (dict, list)):
+        return f'… ({len(value)} items)'
+    if isinstance(value, dict):
+        items = list(value.items())
+        shrunk = {k: _shrink(v, max_items, max_str, depth + 1) for k, v in items[:max_items * 4]}
+        if len(items) > max_items * 4:
+            shrunk['_omitted_keys'] = len(items) - max_items * 4
+        return shrunk
+    if isinstance(value, (list, tuple)):
+        shrunk = [_shrink(v, max_items, max_str, depth + 1) for v in value[:max_items]]
+        if len(value) > max_items:
+            shrunk.append(f'… {len(value) - max_items} more')
+        return shrunk
+    return value
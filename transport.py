@@ -0,0 +1,94 @@
+import inspect
+import re
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pycrucible import CrucibleClient
+
+# statuses worth retrying: rate limited or a (possibly transient) server error
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that gives requests sent without a timeout the one `timeout_for(url)` picks"""
+
+    def __init__(self, timeout_for, **kwargs):
+        self.timeout_for = timeout_for
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout_for(request.url)
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+class HttpTransport:
+    """Pooled keep-alive HTTP access shared by the Crucible client and file downloads.
+
+    All threads share one connection pool (`pool_size` connections per
+    host); each thread gets its own Session on top of it, so session state
+    is never shared between threads. Idempotent requests are retried on
+    connection errors and RETRY_STATUSES with exponential backoff plus
+    random jitter, honouring Retry-After. Timeouts are chosen per endpoint
+    by the adapter, so they also apply to sessions mounted with it: the
+    first pattern in `timeouts` that matches the URL path wins.
+    """
+
+    def __init__(self, pool_size=32, retries=3, backoff=0.5, backoff_jitter=0.5,
+                 timeout=(5, 30), timeouts=()):
+        self.timeout = timeout
+        self.timeouts = [(re.compile(pattern), t) for pattern, t in timeouts]
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                      backoff_factor=backoff, backoff_jitter=backoff_jitter,
+                      status_forcelist=RETRY_STATUSES, respect_retry_after_header=True,
+                      raise_on_status=False)
+        self.adapter = TimeoutHTTPAdapter(self.timeout_for, pool_connections=8, pool_maxsize=pool_size,
+                                          max_retries=retry)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self.mount(requests.Session())
+        return session
+
+    def mount(self, session):
+        """Route session's http(s) requests through the shared pool; returns session"""
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        return session
+
+    def timeout_for(self, url):
+        path = urlsplit(url).path
+        for pattern, timeout in self.timeouts:
+            if pattern.search(path):
+                return timeout
+        return self.timeout
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+
+def pooled_crucible_client(api_url, api_key, transport):
+    """CrucibleClient whose API requests go through transport's pool, retries and timeouts
+
+    A client taking a `session` argument gets a session mounted on the
+    shared adapter; otherwise the adapter is mounted on the requests.Session
+    the client keeps. A client with neither opens its own connections, which
+    is logged rather than worked around.
+    """
+    if 'session' in inspect.signature(CrucibleClient.__init__).parameters:
+        return CrucibleClient(api_url=api_url, api_key=api_key, session=transport.mount(requests.Session()))
+    client = CrucibleClient(api_url=api_url, api_key=api_key)
+    sessions = [value for value in vars(client).values() if isinstance(value, requests.Session)]
+    for session in sessions:
+        transport.mount(session)
+    if not sessions:
+        print("CrucibleClient keeps no requests.Session, its API calls are not pooled or retried")
+    return client
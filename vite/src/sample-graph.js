@@ -3,7 +3,105 @@ import dagre from 'cytoscape-dagre';
 
 cytoscape.use(dagre);
 
-function createNodePopup() {
+// Nodes with hidden relatives, and collapsed groups, carry an `expand` URL returning
+// more nodes and edges; these are merged into the graph and the layout re-run
+async function expandNode(cy, node, toCyNode) {
+  const url = node.data('expand');
+  if (!url) return;
+  node.removeData('expand');
+  document.body.style.cursor = 'wait';
+  try {
+    const response = await fetch(url);
+    const { nodes, edges } = await response.json();
+    // a group's summary node is replaced by its members
+    if (node.data('type') === 'group') cy.remove(node);
+
+    const added = nodes.filter(n => cy.getElementById(n.id).empty()).map(n => ({ data: toCyNode(n) }));
+    const addedNodes = cy.add(added);
+    const edgeIds = new Set();
+    const newEdges = edges
+      .map(e => ({ data: { id: `${e.source}-${e.target}`, source: e.source, target: e.target } }))
+      .filter(e => {
+        const ok = !edgeIds.has(e.data.id) && cy.getElementById(e.data.id).empty()
+          && cy.getElementById(e.data.source).nonempty() && cy.getElementById(e.data.target).nonempty();
+        edgeIds.add(e.data.id);
+        return ok;
+      });
+    cy.add(newEdges);
+    cy.runLayout();
+    loadThumbnails(cy, addedNodes);
+  } catch (err) {
+    console.error('Failed to expand graph node', err);
+    node.data('expand', url);
+  } finally {
+    document.body.style.cursor = 'default';
+  }
+}
+
+// Thumbnails of dataset nodes are looked up after the graph is shown, with one batch request
+// per 200 added nodes; datasets without thumbnails keep the plain dataset style
+async function loadThumbnails(cy, nodes) {
+  const projectId = cy.container().dataset.projectId;
+  const ids = nodes.filter('[type="dataset"]').map(node => node.id());
+  let found = false;
+  for (let i = 0; i < ids.length; i += 200) {
+    const batch = ids.slice(i, i + 200).map(encodeURIComponent).join(',');
+    try {
+      const response = await fetch(`/${projectId}/api/thumbnails?ids=${batch}`);
+      const urls = await response.json();
+      for (const [id, url] of Object.entries(urls)) {
+        if (url) {
+          cy.getElementById(id).data('thumbnail', url);
+          found = true;
+        }
+      }
+    } catch (err) {
+      console.error('Failed to load thumbnails', err);
+    }
+  }
+  // nodes with a thumbnail are larger, lay them out again
+  if (found && cy.runLayout) cy.runLayout();
+}
+
+function expandableNodeData(node) {
+  return {
+    ...(node.expand ? { expand: node.expand } : {}),
+    ...(node.count ? { count: node.count } : {}),
+    more: node.more || null
+  };
+}
+
+// Shared node styles of both graphs: summary nodes of collapsed groups, and a
+// dashed border on nodes whose further relatives can be loaded
+const expandableStyles = [
+  {
+    selector: 'node[type="group"]',
+    style: {
+      'background-color': '#f1f3f5',
+      'border-width': 2,
+      'border-style': 'dashed',
+      'border-color': '#868e96',
+      'label': 'data(label)',
+      'color': '#343a40',
+      'text-valign': 'center',
+      'text-halign': 'center',
+      'font-size': '11px',
+      'width': node => Math.max(node.data('label').length * 7, 60),
+      'height': 36,
+      'shape': 'roundrectangle'
+    }
+  },
+  {
+    selector: 'node[expand][type!="group"]',
+    style: {
+      'border-width': 3,
+      'border-style': 'dashed',
+      'border-color': '#fab005'
+    }
+  }
+];
+
+function createNodePopup(onExpand) {
   const el = document.createElement('div');
   el.style.cssText = 'position:fixed;display:none;z-index:1050;max-width:280px;pointer-events:auto;';
   el.innerHTML = `
@@ -17,13 +115,24 @@ function createNodePopup() {
         </div>
         <p class="popup-desc text-muted mb-2" style="display:none;font-size:0.8em;"></p>
         <a class="popup-link btn btn-sm btn-outline-primary" href="#">View Details →</a>
+        <button class="popup-expand btn btn-sm btn-outline-secondary" style="display:none;">Expand</button>
       </div>
     </div>`;
   document.body.appendChild(el);
 
   let ignoreNextClick = false;
 
+  let currentNode = null;
+
   el.querySelector('.popup-close').addEventListener('click', hide);
+  el.querySelector('.popup-img img').addEventListener('error', () => {
+    el.querySelector('.popup-img').style.display = 'none';
+  });
+  el.querySelector('.popup-expand').addEventListener('click', () => {
+    const node = currentNode;
+    hide();
+    if (node && onExpand) onExpand(node);
+  });
   document.addEventListener('keydown', e => { if (e.key === 'Escape') hide(); });
   document.addEventListener('click', e => {
     if (ignoreNextClick) { ignoreNextClick = false; return; }
@@ -32,16 +141,18 @@ function createNodePopup() {
 
   function show(node, clientX, clientY) {
     ignoreNextClick = true;
+    currentNode = node;
     const label    = node.data('label') || node.data('name') || '';
     const type     = node.data('type') || 'sample';
     const desc     = node.data('description') || '';
     const measure  = node.data('measurement') || '';
     const thumb    = node.data('thumbnail');
-    const url      = node.data('url') || '#';
+    const url      = node.data('url');
+    const more     = node.data('more');
 
     const badge = el.querySelector('.popup-badge');
-    badge.textContent = measure || (type === 'dataset' ? 'Dataset' : 'Sample');
-    badge.className = `popup-badge badge mb-1 ${type === 'dataset' ? 'bg-success' : 'bg-primary'}`;
+    badge.textContent = type === 'group' ? 'Group' : (measure || (type === 'dataset' ? 'Dataset' : 'Sample'));
+    badge.className = `popup-badge badge mb-1 ${type === 'group' ? 'bg-secondary' : type === 'dataset' ? 'bg-success' : 'bg-primary'}`;
 
     el.querySelector('.popup-title').textContent = label;
 
@@ -57,7 +168,18 @@ function createNodePopup() {
       imgDiv.style.display = 'none';
     }
 
-    el.querySelector('.popup-link').href = url;
+    const link = el.querySelector('.popup-link');
+    link.href = url || '#';
+    link.style.display = url ? '' : 'none';
+
+    const expandBtn = el.querySelector('.popup-expand');
+    expandBtn.style.display = node.data('expand') ? '' : 'none';
+    if (type === 'group') {
+      expandBtn.textContent = `Show all ${node.data('count')}`;
+    } else if (more) {
+      const hidden = [more.up && `${more.up} up`, more.down && `${more.down} down`].filter(Boolean).join(', ');
+      expandBtn.textContent = `Load more relatives (${hidden})`;
+    }
 
     el.style.display = 'block';
     const rect = el.getBoundingClientRect();
@@ -70,7 +192,7 @@ function createNodePopup() {
     el.style.top  = y + 'px';
   }
 
-  function hide() { el.style.display = 'none'; }
+  function hide() { el.style.display = 'none'; currentNode = null; }
 
   return { show, hide };
 }
@@ -79,18 +201,19 @@ export function initEntityGraph(containerId, graphData) {
   const { nodes, edges, centerNodeId } = graphData;
   let currentRankDir = 'LR';
 
-  const cyNodes = nodes.map(node => ({
-    data: {
-      id: node.id,
-      label: node.label,
-      type: node.type,
-      url: node.url,
-      description: node.description || '',
-      measurement: node.measurement || '',
-      ...(node.thumbnail ? { thumbnail: node.thumbnail } : {}),
-      isCenterNode: node.id === centerNodeId
-    }
-  }));
+  const toCyNode = node => ({
+    id: node.id,
+    label: node.label,
+    type: node.type,
+    url: node.url,
+    description: node.description || '',
+    measurement: node.measurement || '',
+    ...(node.thumbnail ? { thumbnail: node.thumbnail } : {}),
+    ...expandableNodeData(node),
+    isCenterNode: node.id === centerNodeId
+  });
+
+  const cyNodes = nodes.map(node => ({ data: toCyNode(node) }));
 
   const cyEdges = edges.map(edge => ({
     data: {
@@ -153,6 +276,7 @@ export function initEntityGraph(containerId, graphData) {
           'font-size': '10px',
         }
       },
+      ...expandableStyles,
       {
         selector: 'node[?isCenterNode]',
         style: {
@@ -194,9 +318,10 @@ export function initEntityGraph(containerId, graphData) {
     maxZoom: 3
   });
 
-  const popup = createNodePopup();
+  const popup = createNodePopup(node => expandNode(cy, node, toCyNode));
 
   cy.on('tap', evt => { if (evt.target === cy) popup.hide(); });
+  cy.on('dbltap', 'node[expand]', evt => expandNode(cy, evt.target, toCyNode));
 
   cy.on('tap', 'node', function(evt) {
     const node = evt.target;
@@ -221,8 +346,7 @@ export function initEntityGraph(containerId, graphData) {
     document.getElementById(containerId).style.cursor = 'default';
   });
 
-  cy.toggleLayout = function() {
-    currentRankDir = currentRankDir === 'LR' ? 'TB' : 'LR';
+  cy.runLayout = function() {
     cy.layout({
       name: 'dagre',
       rankDir: currentRankDir,
@@ -232,6 +356,11 @@ export function initEntityGraph(containerId, graphData) {
       animate: true,
       animationDuration: 500
     }).run();
+  };
+
+  cy.toggleLayout = function() {
+    currentRankDir = currentRankDir === 'LR' ? 'TB' : 'LR';
+    cy.runLayout();
     return currentRankDir;
   };
 
@@ -255,6 +384,8 @@ export function initEntityGraph(containerId, graphData) {
     return thumbnailsVisible;
   };
 
+  loadThumbnails(cy, cy.nodes());
+
   return cy;
 }
 
@@ -268,17 +399,18 @@ export function initSampleGraph(containerId, graphData) {
   const projectId = document.getElementById(containerId).dataset.projectId;
 
   // Transform nodes and edges to Cytoscape format
-  const cyNodes = nodes.map(node => ({
-    data: {
-      id: node.id,
-      label: node.label,
-      name: node.name,
-      description: node.description,
-      type: 'sample',
-      url: `/${projectId}/sample-graph/${node.id}`,
-      isCenterNode: node.id === centerNodeId
-    }
-  }));
+  const toCyNode = node => ({
+    id: node.id,
+    label: node.label,
+    name: node.name,
+    description: node.description,
+    type: node.type === 'group' ? 'group' : 'sample',
+    ...(node.type === 'group' ? {} : { url: `/${projectId}/sample-graph/${node.id}` }),
+    ...expandableNodeData(node),
+    isCenterNode: node.id === centerNodeId
+  });
+
+  const cyNodes = nodes.map(node => ({ data: toCyNode(node) }));
 
   const cyEdges = edges.map(edge => ({
     data: {
@@ -314,6 +446,7 @@ export function initSampleGraph(containerId, graphData) {
           'text-max-width': '100px'
         }
       },
+      ...expandableStyles,
       {
         selector: 'node[?isCenterNode]',
         style: {
@@ -361,9 +494,10 @@ export function initSampleGraph(containerId, graphData) {
 
   console.log('Cytoscape instance created, nodes:', cy.nodes().length, 'edges:', cy.edges().length);
 
-  const samplePopup = createNodePopup();
+  const samplePopup = createNodePopup(node => expandNode(cy, node, toCyNode));
 
   cy.on('tap', evt => { if (evt.target === cy) samplePopup.hide(); });
+  cy.on('dbltap', 'node[expand]', evt => expandNode(cy, evt.target, toCyNode));
 
   cy.on('tap', 'node', function(evt) {
     const node = evt.target;
@@ -392,10 +526,8 @@ export function initSampleGraph(containerId, graphData) {
     container.style.cursor = 'default';
   });
 
-  // Add layout toggle function
-  cy.toggleLayout = function() {
-    currentRankDir = currentRankDir === 'LR' ? 'TB' : 'LR';
-
+  // Layout (re-run as nodes are expanded) and toggle function
+  cy.runLayout = function() {
     cy.layout({
       name: 'dagre',
       rankDir: currentRankDir,
@@ -405,7 +537,11 @@ export function initSampleGraph(containerId, graphData) {
       animate: true,
       animationDuration: 500
     }).run();
+  };
 
+  cy.toggleLayout = function() {
+    currentRankDir = currentRankDir === 'LR' ? 'TB' : 'LR';
+    cy.runLayout();
     return currentRankDir;
   };
 